@@ -44,3 +44,12 @@ from .graphics import *
 from .projections import *
 from .highlights import *
 from .horizon_landscape import *
+from .profiler import *
+
+
+def __getattr__(name):
+    # graphics back-ends (CairoDrawing, SkiaDrawing, TikZDrawing) are loaded lazily by fchart3.graphics
+    from . import graphics
+    if name in graphics._BACKENDS:
+        return getattr(graphics, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,30 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_timescale():
+    """
+    Shared skyfield timescale. Skyfield is imported and timescale loaded on first use, not when fchart3 is imported.
+    """
+    from skyfield.api import load
+    return load.timescale()
+
+
+__all__ = ['get_timescale']
@@ -20,6 +20,7 @@ from typing import Optional, Tuple, Any, TypeAlias
 import numpy as np
 
 from .horizon_landscape import StellariumLandscape
+from .profiler import NULL_PROFILER
 
 Coord: TypeAlias = Tuple[float, float]
 Rect: TypeAlias = Tuple[float, float, float, float]
@@ -64,6 +65,7 @@ class RenderContext:
     planet_moons: Any = None
     trajectories: Any = None
     landscape: StellariumLandscape = None
+    profiler: Any = NULL_PROFILER
 
 
 @dataclass(slots=True)
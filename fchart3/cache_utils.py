@@ -0,0 +1,93 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import hashlib
+import os
+
+import numpy as np
+
+
+def get_cache_dir():
+    """
+    Directory for generated catalog caches. Can be overridden by FCHART3_CACHE_DIR environment variable.
+    """
+    cache_dir = os.environ.get('FCHART3_CACHE_DIR')
+    if not cache_dir:
+        base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        cache_dir = os.path.join(base_dir, 'fchart3')
+    return cache_dir
+
+
+def file_digest(filename):
+    """
+    sha1 of file content
+    """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(version, source_files, *params):
+    """
+    Cache key from cache format version, content of source files and additional parameters.
+    """
+    h = hashlib.sha1()
+    h.update(str(version).encode())
+    for source_file in source_files:
+        h.update(os.path.basename(source_file).encode())
+        h.update(file_digest(source_file).encode())
+    for param in params:
+        h.update(repr(param).encode())
+    return h.hexdigest()
+
+
+def save_npz(filename, **arrays):
+    """
+    Write npz file atomically, concurrent readers never see partially written file. Returns False on failure.
+    """
+    tmp_filename = '{}.{}.tmp'.format(filename, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(tmp_filename, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_filename, filename)
+    except OSError as e:
+        print('Cannot write cache file {}: {}'.format(filename, e))
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+        return False
+    return True
+
+
+def load_npz(filename, key):
+    """
+    Load npz file written by save_npz() if it exists and its 'key' matches, otherwise returns None.
+    """
+    if not os.path.isfile(filename):
+        return None
+    try:
+        data = np.load(filename, allow_pickle=False)
+        if str(data['key']) != key:
+            return None
+        return data
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+__all__ = ['get_cache_dir', 'file_digest', 'cache_key', 'save_npz', 'load_npz']
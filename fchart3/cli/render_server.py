@@ -0,0 +1,541 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Long-running render server (``fchart3 serve``).
+
+Catalogs are loaded once into ``UsedCatalogs`` and shared by a pool of render workers. Chart specs are
+posted as JSON to ``/render`` and the chart is returned as PDF/PNG/SVG/JPG bytes.
+
+Endpoints:
+  POST /render   JSON chart spec -> chart bytes
+  GET  /render   chart spec in query string, config overrides as ``cfg.<key>=<value>``
+  POST /reload   re-read config files (catalogs are kept)
+  GET  /status   server statistics as JSON
+"""
+
+import argparse
+import dataclasses
+import json
+import math
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse, parse_qsl
+
+import numpy as np
+
+from ..astro.astrocalc import radec_to_horizontal
+from ..astro.timescale import get_timescale
+from ..config_loader import ConfigurationLoader
+from ..configuration import EngineConfiguration, CoordSystem
+from ..graphics.graphics_interface import CoalescingGraphics
+from ..i18n import _
+from ..profiler import DEFAULT_MAX_SAMPLES, RenderProfiler
+from ..runtime_settings import RuntimeConfiguration, RuntimeConfigurationLoader, parse_time_or_date
+from ..skymap_engine import SkymapEngine, LABELi18N
+from ..star_zone_cache import ZoneCachePolicy
+from ..used_catalogs import UsedCatalogs
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+MIME_TYPES = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'jpg': 'image/jpeg',
+}
+
+
+class ChartSpecError(ValueError):
+    """ Invalid chart specification. HTTP 400 """
+    pass
+
+
+class ChartNotFoundError(LookupError):
+    """ Chart center object not found. HTTP 404 """
+    pass
+
+
+@dataclass(slots=True)
+class ChartSpec:
+    """
+    Chart request. ra/dec are in radians (J2000), fieldsize is the field diameter in degrees,
+    width/height are in mm. ``config`` holds EngineConfiguration overrides as strings in config file syntax.
+    """
+    ra: Optional[float] = None
+    dec: Optional[float] = None
+    dso: Optional[str] = None
+    fieldsize: Optional[float] = None
+    limit_stars: Optional[float] = None
+    limit_deepsky: Optional[float] = None
+    width: Optional[float] = None
+    height: Optional[float] = None
+    format: str = 'pdf'
+    landscape: Optional[bool] = None
+    caption: Optional[str] = None
+    mirror_x: Optional[bool] = None
+    mirror_y: Optional[bool] = None
+    dt: Optional[datetime] = None
+    config: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, values):
+        spec = cls()
+        for key, value in values.items():
+            if key.startswith('cfg.'):
+                spec.config[key[4:]] = value
+                continue
+            if key not in cls.__slots__:
+                raise ChartSpecError('Unknown chart spec item: {}'.format(key))
+            try:
+                if key in ('ra', 'dec', 'fieldsize', 'limit_stars', 'limit_deepsky', 'width', 'height'):
+                    value = float(value) if value is not None else None
+                elif key in ('landscape', 'mirror_x', 'mirror_y'):
+                    if isinstance(value, str):
+                        value = value.strip().lower() in ('true', '1', 'yes', 'y', 'on')
+                    else:
+                        value = bool(value)
+                elif key == 'dt':
+                    value = parse_time_or_date(value) if value else None
+                elif key == 'config':
+                    if not isinstance(value, dict):
+                        raise ChartSpecError('config must be an object')
+                    value = dict(spec.config, **value)
+                elif key == 'format':
+                    value = str(value).lower()
+            except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+                raise ChartSpecError('Invalid value of {}: {}'.format(key, e))
+            setattr(spec, key, value)
+
+        if spec.format not in MIME_TYPES:
+            raise ChartSpecError('Unsupported format: {}'.format(spec.format))
+        if spec.dso is None and (spec.ra is None or spec.dec is None):
+            raise ChartSpecError('Chart center (ra, dec) or dso must be specified')
+        return spec
+
+
+@dataclass(slots=True)
+class RenderResult:
+    data: bytes
+    mime: str
+    timings: dict
+
+
+class ChartRenderService:
+    """
+    Renders chart specs using shared catalogs. Base configuration can be reloaded at runtime.
+    """
+    def __init__(self, used_catalogs, config_files=None, workers=None, language=LABELi18N, profiler=None,
+                 coalesce_draw_calls=False):
+        self.used_catalogs = used_catalogs
+        self.profiler = profiler
+        self.coalesce_draw_calls = coalesce_draw_calls
+        self.config_files = list(config_files) if config_files else []
+        self.language = language
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fchart3-render')
+        self._cfg_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._base_cfg = None
+        self._runtime_cfg = None
+        self._config_version = 0
+        self.requests_total = 0
+        self.requests_failed = 0
+        self.render_time_total = 0.0
+        self.reload_config()
+
+    def reload_config(self):
+        """
+        Re-read default.conf and config files. Catalogs drawn with new configuration are preloaded.
+        """
+        from .. import get_data
+
+        cfg = EngineConfiguration()
+        ConfigurationLoader(get_data('default.conf')).load_config(cfg)
+        runtime_cfg = RuntimeConfiguration()
+        for config_file in self.config_files:
+            ConfigurationLoader(config_file).load_config(cfg)
+            RuntimeConfigurationLoader(config_file).load_config(runtime_cfg)
+
+        # load catalogs before the configuration is used, so requests do not wait for them
+        self.used_catalogs.preload(cfg)
+
+        with self._cfg_lock:
+            self._base_cfg = cfg
+            self._runtime_cfg = runtime_cfg
+            self._config_version += 1
+            version = self._config_version
+        print(_('Configuration reloaded (version {})').format(version), flush=True)
+        return version
+
+    def prewarm_text_metrics(self, formats=('png', 'pdf')):
+        """
+        Measure labels of deepsky objects and BSC stars in fonts of base configuration, raster and vector
+        Cairo surfaces measure text differently.
+        """
+        from ..graphics.graphics_cairo import CairoDrawing
+
+        with self._cfg_lock:
+            cfg = self._base_cfg
+            runtime_cfg = self._runtime_cfg
+        for output_format in formats:
+            graphics = CairoDrawing(None, runtime_cfg.width, runtime_cfg.height, output_format)
+            graphics.new()
+            engine = SkymapEngine(graphics, language=self.language, lm_deepsky=cfg.limit_deepsky)
+            engine.set_configuration(cfg)
+            engine.prewarm_text_metrics(self.used_catalogs, graphics)
+
+    def submit(self, spec):
+        """
+        Queue chart spec for rendering, returns Future of RenderResult.
+        """
+        return self._executor.submit(self.render, spec, time.perf_counter())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _create_configuration(self, spec):
+        with self._cfg_lock:
+            cfg = dataclasses.replace(self._base_cfg)
+            runtime_cfg = self._runtime_cfg
+
+        loader = ConfigurationLoader(None)
+        for key, value in spec.config.items():
+            if isinstance(value, bool):
+                value = str(value)
+            elif isinstance(value, (list, tuple)):
+                value = ','.join(str(v) for v in value)
+            if not loader.set_item(cfg, key, str(value)):
+                raise ChartSpecError('Invalid config item: {}={}'.format(key, value))
+
+        if spec.fieldsize is not None:
+            cfg.fieldsize = spec.fieldsize
+        if spec.limit_stars is not None:
+            cfg.limit_stars = spec.limit_stars
+        if spec.limit_deepsky is not None:
+            cfg.limit_deepsky = spec.limit_deepsky
+        return cfg, runtime_cfg
+
+    def _field_center(self, spec, cfg, dt_utc):
+        caption = spec.caption
+        showing_dsos = None
+        if spec.dso is not None:
+            dso, cat, name = self.used_catalogs.lookup_dso(spec.dso)
+            if dso is None:
+                raise ChartNotFoundError('Object not found: {}'.format(spec.dso))
+            ra, dec = dso.ra, dso.dec
+            showing_dsos = [dso.master_object or dso]
+            if caption is None:
+                caption = cat + ' ' + name
+        else:
+            ra, dec = spec.ra, spec.dec
+
+        if cfg.coord_system == CoordSystem.EQUATORIAL:
+            return ra, dec, dt_utc, caption, showing_dsos
+
+        if cfg.observer_lat_deg is None or cfg.observer_lon_deg is None:
+            raise ChartSpecError('Horizontal mode needs observer_lat_deg/observer_lon_deg')
+        if dt_utc is None:
+            dt_utc = datetime.now(timezone.utc)
+        t = get_timescale().from_datetime(dt_utc)
+        lst = ((t.gast + cfg.observer_lon_deg / 15.0) % 24.0) * (math.pi / 12.0)
+        lat = math.radians(cfg.observer_lat_deg)
+        alt, az = radec_to_horizontal(lst, (math.sin(lat), math.cos(lat)), ra, dec)
+        return az, alt, dt_utc, caption, showing_dsos
+
+    def render(self, spec, queued_at=None):
+        from ..graphics.graphics_cairo import CairoDrawing
+
+        tm_start = time.perf_counter()
+        timings = {}
+        if queued_at is not None:
+            timings['queue'] = (tm_start - queued_at) * 1000.0
+        try:
+            cfg, runtime_cfg = self._create_configuration(spec)
+            dt_utc = spec.dt if spec.dt is not None else runtime_cfg.observation_time
+            phi, theta, dt_utc, caption, showing_dsos = self._field_center(spec, cfg, dt_utc)
+
+            width = spec.width if spec.width is not None else runtime_cfg.width
+            height = spec.height if spec.height is not None else runtime_cfg.height
+            landscape = spec.landscape if spec.landscape is not None else runtime_cfg.landscape_paper
+            mirror_x = spec.mirror_x if spec.mirror_x is not None else runtime_cfg.mirror_x
+            mirror_y = spec.mirror_y if spec.mirror_y is not None else runtime_cfg.mirror_y
+
+            graphics = CairoDrawing(None, width, height, spec.format, landscape=landscape)
+            if self.coalesce_draw_calls:
+                graphics = CoalescingGraphics(graphics)
+            engine = SkymapEngine(graphics, language=self.language, lm_stars=cfg.limit_stars, lm_deepsky=cfg.limit_deepsky,
+                                  profiler=self.profiler)
+            engine.set_configuration(cfg)
+            engine.set_field(phi, theta, np.deg2rad(cfg.fieldsize) / 2.0, mirror_x=mirror_x, mirror_y=mirror_y)
+            if caption:
+                engine.set_caption(caption)
+            tm_render = time.perf_counter()
+            timings['setup'] = (tm_render - tm_start) * 1000.0
+
+            data, mime = engine.render_to_bytes(self.used_catalogs, dt=dt_utc, showing_dsos=showing_dsos)
+            tm_end = time.perf_counter()
+            timings['render'] = (tm_end - tm_render) * 1000.0
+            timings['total'] = (tm_end - (queued_at if queued_at is not None else tm_start)) * 1000.0
+        except Exception:
+            with self._stats_lock:
+                self.requests_total += 1
+                self.requests_failed += 1
+            raise
+
+        with self._stats_lock:
+            self.requests_total += 1
+            self.render_time_total += timings['render']
+        return RenderResult(data, mime, timings)
+
+    def status(self):
+        with self._stats_lock:
+            ok = self.requests_total - self.requests_failed
+            return {
+                'workers': self.workers,
+                'config_files': self.config_files,
+                'config_version': self._config_version,
+                'requests_total': self.requests_total,
+                'requests_failed': self.requests_failed,
+                'avg_render_ms': self.render_time_total / ok if ok > 0 else None,
+                'star_zone_cache': {level: dataclasses.asdict(stats)
+                                    for level, stats in self.used_catalogs.star_catalog.zone_cache_stats().items()},
+                'star_epoch_cache': {level: dataclasses.asdict(stats)
+                                     for level, stats in self.used_catalogs.star_catalog.epoch_cache_stats().items()},
+                'star_zone_queries': self.used_catalogs.star_catalog.zone_query_stats(),
+                'star_selection': dataclasses.asdict(self.used_catalogs.star_catalog.selection_stats()),
+                'profile': self.profiler.summary() if self.profiler is not None else None,
+            }
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'fchart3'
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/render':
+            try:
+                spec = ChartSpec.from_dict(dict(parse_qsl(url.query)))
+            except ChartSpecError as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            self._render(spec)
+        elif url.path == '/status':
+            self._send_json(200, self.server.service.status())
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/render':
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                spec = ChartSpec.from_dict(json.loads(self.rfile.read(length) or b'{}'))
+            except (ChartSpecError, ValueError, AttributeError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            self._render(spec)
+        elif url.path == '/reload':
+            try:
+                version = self.server.service.reload_config()
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+            self._send_json(200, {'config_version': version})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def _render(self, spec):
+        try:
+            result = self.server.service.submit(spec).result()
+        except ChartSpecError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except ChartNotFoundError as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except Exception as e:
+            self.log_error('Render failed: %r', e)
+            self._send_json(500, {'error': str(e)})
+            return
+
+        timings = result.timings
+        self.send_response(200)
+        self.send_header('Content-Type', result.mime)
+        self.send_header('Content-Length', str(len(result.data)))
+        self.send_header('Server-Timing', ', '.join('{};dur={:.1f}'.format(k, v) for k, v in timings.items()))
+        self.send_header('X-Render-Time-Ms', '{:.1f}'.format(timings['total']))
+        self.end_headers()
+        self.wfile.write(result.data)
+        self.log_message('render %s %d bytes %s', spec.format, len(result.data),
+                         ' '.join('{}={:.1f}ms'.format(k, v) for k, v in timings.items()))
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RenderHTTPServer(ThreadingHTTPServer):
+    def __init__(self, address, service):
+        super().__init__(address, RenderRequestHandler)
+        self.service = service
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class RenderUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def __init__(self, path, service):
+            if os.path.exists(path):
+                os.unlink(path)
+            super().__init__(path, RenderRequestHandler)
+            self.service = service
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='fchart3 serve',
+                                     description='Run fchart3 render server with preloaded catalogs.')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Listen address (default: {})'.format(DEFAULT_HOST))
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Listen port (default: {})'.format(DEFAULT_PORT))
+    parser.add_argument('--socket', dest='socket_path', default=None, help='Listen on Unix socket instead of TCP port')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='Number of render workers (default: CPU count)')
+    parser.add_argument('-c', '--config-file', dest='config_file', action='append',
+                        help='Configuration file (can be used multiple times). Reloaded on SIGHUP or POST /reload.')
+    parser.add_argument('-E', '--extra-data-dir', dest='extra_data_dir', default=None,
+                        help='Path to extra data directory containing Stellarium star catalogues.')
+    parser.add_argument('-ld', '--limit-dso', dest='limit_deepsky', type=float, default=18.0,
+                        help='Faintest deepsky magnitude that can be requested (default: 18.0)')
+    parser.add_argument('--show-catalogs', dest='show_catalogs', default=None,
+                        help='Comma separated list of additional catalogs to show')
+    parser.add_argument('--force-messier', dest='force_messier', action='store_true', default=False)
+    parser.add_argument('--force-asterisms', dest='force_asterisms', action='store_true', default=False)
+    parser.add_argument('--force-unknown', dest='force_unknown', action='store_true', default=False)
+    parser.add_argument('--no-mmap', dest='mmap_star_catalog', action='store_false', default=True,
+                        help='Read star zones into private memory instead of memory mapping converted star cache')
+    parser.add_argument('--zone-cache-mb', dest='zone_cache_mb', type=float, default=None,
+                        help='Memory budget of star zones of each catalog level in MB (default: unlimited)')
+    parser.add_argument('--zone-cache-policy', dest='zone_cache_policy', choices=[p.value for p in ZoneCachePolicy],
+                        default=ZoneCachePolicy.LRU.value, help='Eviction policy of star zones (default: lru)')
+    parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                        help='Profile renders, statistics of render stages and counters are reported in /status')
+    parser.add_argument('--profile-jsonl', dest='profile_jsonl', default=None,
+                        help='Append profile of each render as JSON line to file (implies --profile)')
+    parser.add_argument('--profile-samples', dest='profile_samples', type=int, default=DEFAULT_MAX_SAMPLES,
+                        help='Number of last renders aggregated in profile statistics (default: {})'
+                        .format(DEFAULT_MAX_SAMPLES))
+    parser.add_argument('--coalesce-draw-calls', dest='coalesce_draw_calls', action='store_true', default=False,
+                        help='Merge consecutive lines of the same style to one path and drop repeated state changes')
+    parser.add_argument('--prewarm-text-metrics', dest='prewarm_text_metrics', action='store_true', default=False,
+                        help='Measure labels of deepsky objects and stars on startup')
+    return parser.parse_args(argv)
+
+
+def _resolve_config_files(config_files):
+    from .. import get_data
+
+    resolved = []
+    for config_file in config_files or []:
+        installed_config_file = get_data(config_file)
+        if not installed_config_file.endswith('.conf'):
+            installed_config_file += '.conf'
+        if os.path.isfile(installed_config_file):
+            resolved.append(installed_config_file)
+        elif os.path.isfile(config_file):
+            resolved.append(config_file)
+        else:
+            raise FileNotFoundError(config_file)
+    return resolved
+
+
+def serve_main(argv=None):
+    from .. import get_catalogs_dir
+
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+    try:
+        config_files = _resolve_config_files(args.config_file)
+    except FileNotFoundError as e:
+        print(_('Config file(s) not found: {}').format(e))
+        return -1
+
+    tm = time.perf_counter()
+    used_catalogs = UsedCatalogs(get_catalogs_dir(),
+                                 extra_star_data_dir=args.extra_data_dir,
+                                 limit_magnitude_deepsky=args.limit_deepsky,
+                                 force_messier=args.force_messier,
+                                 force_asterisms=args.force_asterisms,
+                                 force_unknown=args.force_unknown,
+                                 show_catalogs=args.show_catalogs.split(',') if args.show_catalogs else None,
+                                 mmap_star_catalog=args.mmap_star_catalog)
+    if args.zone_cache_mb is not None:
+        used_catalogs.star_catalog.set_zone_cache_policy(int(args.zone_cache_mb * 1024 * 1024),
+                                                         ZoneCachePolicy(args.zone_cache_policy))
+    print(_('Catalogs loaded in {:.1f} ms').format((time.perf_counter() - tm) * 1000.0), flush=True)
+
+    profiler = None
+    if args.profile or args.profile_jsonl:
+        profiler = RenderProfiler(jsonl=args.profile_jsonl, max_samples=args.profile_samples)
+
+    service = ChartRenderService(used_catalogs, config_files, workers=args.workers, profiler=profiler,
+                                 coalesce_draw_calls=args.coalesce_draw_calls)
+    if args.prewarm_text_metrics:
+        tm = time.perf_counter()
+        service.prewarm_text_metrics()
+        print(_('Text metrics prewarmed in {:.1f} ms').format((time.perf_counter() - tm) * 1000.0), flush=True)
+
+    if args.socket_path:
+        server = RenderUnixHTTPServer(args.socket_path, service)
+        print(_('Serving on unix socket {} with {} workers').format(args.socket_path, service.workers), flush=True)
+    else:
+        server = RenderHTTPServer((args.host, args.port), service)
+        print(_('Serving on http://{}:{} with {} workers').format(args.host, args.port, service.workers), flush=True)
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=service.reload_config, daemon=True).start())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        if args.socket_path and os.path.exists(args.socket_path):
+            os.unlink(args.socket_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(serve_main())
@@ -21,17 +21,12 @@ from dataclasses import dataclass
 from enum import Enum
 from typing import Optional, Dict, Any
 from datetime import datetime, timezone
-from skyfield.api import load
-from skyfield.data import mpc
-from skyfield.constants import GM_SUN_Pitjeva_2005_km3_s2 as GM_SUN
 
 from .solar_system import get_solsys_bodies, get_planet_moons
 from ..trajectory import build_trajectory
-from ..i18n import install_translator
+from ..astro.timescale import get_timescale
+from ..i18n import _
 
-_ = install_translator()
-
-skyfield_ts = load.timescale()
 
 
 class TargetType(str, Enum):
@@ -407,6 +402,7 @@ def _load_mpc_comets_df(mpc_comets_file: str | None):
     If mpc_comets_file is provided, load from local file.
     Otherwise try Skyfield's default MPC comets source (network).
     """
+    from skyfield.data import mpc
     if mpc_comets_file:
         try:
             with open(mpc_comets_file, "rb") as f:
@@ -477,6 +473,9 @@ def resolve_comet(source: str, *, dt_utc: datetime, traj_from: datetime, traj_to
     Resolve comet by MPC designation, return:
       (name, ra_rad, dec_rad, trajectory_list)
     """
+    from skyfield.api import load
+    from skyfield.constants import GM_SUN_Pitjeva_2005_km3_s2 as GM_SUN
+    from skyfield.data import mpc
     if dt_utc is None:
         return None
 
@@ -493,14 +492,14 @@ def resolve_comet(source: str, *, dt_utc: datetime, traj_from: datetime, traj_to
         sun = eph["sun"]
         earth = eph["earth"]
         # Same approach as czsky: heliocentric orbit body relative to Sun
-        body = sun + mpc.comet_orbit(row, skyfield_ts, GM_SUN)
+        body = sun + mpc.comet_orbit(row, get_timescale(), GM_SUN)
     except Exception as e:
         print(_(f"Failed to build comet orbit for '{source}': {e}"))
         return None
 
     # Current position at dt_utc
     try:
-        t_now = skyfield_ts.from_datetime(dt_utc)
+        t_now = get_timescale().from_datetime(dt_utc)
         ra_ang, dec_ang, _ = earth.at(t_now).observe(body).radec()
         ra_rad = float(ra_ang.radians)
         dec_rad = float(dec_ang.radians)
@@ -513,7 +512,7 @@ def resolve_comet(source: str, *, dt_utc: datetime, traj_from: datetime, traj_to
         traj = build_trajectory(
             dt_from=traj_from,
             dt_to=traj_to,
-            ts=skyfield_ts,
+            ts=get_timescale(),
             earth=earth,
             body=body,
             is_comet=True,
@@ -539,6 +538,7 @@ def _load_mpc_minor_planets_df(mpc_minor_planets_file: str | None):
     Load MPCORB dataframe using Skyfield.
     Requires a local file (recommended: MPCORB.9999.DAT).
     """
+    from skyfield.data import mpc
     if not mpc_minor_planets_file:
         return None
     try:
@@ -619,6 +619,9 @@ def resolve_minor_planet(
       (name, ra_rad, dec_rad, trajectories)
     trajectories is a list of trajectory-lists (same as comets).
     """
+    from skyfield.api import load
+    from skyfield.constants import GM_SUN_Pitjeva_2005_km3_s2 as GM_SUN
+    from skyfield.data import mpc
     if dt_utc is None:
         return None
 
@@ -634,7 +637,7 @@ def resolve_minor_planet(
         eph = load("de421.bsp")
         sun = eph["sun"]
         earth = eph["earth"]
-        ts = skyfield_ts
+        ts = get_timescale()
 
         # MPCORB orbit relative to the Sun, same approach as czsky.
         body = sun + mpc.mpcorb_orbit(row, ts, GM_SUN)
@@ -644,7 +647,7 @@ def resolve_minor_planet(
 
     # Position at dt_utc
     try:
-        t_now = skyfield_ts.from_datetime(dt_utc)
+        t_now = get_timescale().from_datetime(dt_utc)
         ra_ang, dec_ang, _ = earth.at(t_now).observe(body).radec()
         ra_rad = float(ra_ang.radians)
         dec_rad = float(dec_ang.radians)
@@ -659,7 +662,7 @@ def resolve_minor_planet(
             traj = build_trajectory(
                 dt_from=traj_from,
                 dt_to=traj_to,
-                ts=skyfield_ts,
+                ts=get_timescale(),
                 earth=earth,
                 body=body,
                 is_comet=False,
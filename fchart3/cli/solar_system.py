@@ -22,15 +22,12 @@ from datetime import datetime, timezone
 from typing import Optional
 
 import numpy as np
-from skyfield.api import load, Topos
-from skyfield.magnitudelib import planetary_magnitude
 
 import fchart3
+from ..astro.timescale import get_timescale
 
 UTC = timezone.utc
 
-skyfield_ts = load.timescale()
-
 # Remote SPK kernels for major moons (same as in czsky helper)
 MAR099S_BSP = "https://naif.jpl.nasa.gov/pub/naif/generic_kernels/spk/satellites/mar099s.bsp"
 JUP365_BSP = "https://naif.jpl.nasa.gov/pub/naif/generic_kernels/spk/satellites/jup365.bsp"
@@ -222,6 +219,7 @@ def _planetographic_orientation(body_name: str, t, ra: float, dec: float, astrom
 
 
 def _get_de421():
+    from skyfield.api import load
     # Skyfield caches download locally; subsequent calls are fast.
     return load("de421.bsp")
 
@@ -250,11 +248,13 @@ def create_solar_system_body_obj(
         observer_elevation: float = 0.0,
 ):
     """Create fchart3.SolarSystemBodyObject for a given enum at time t."""
+    from skyfield.api import Topos
+    from skyfield.magnitudelib import planetary_magnitude
     if body_enum == fchart3.SolarSystemBody.EARTH:
         return None
 
     if t is None:
-        ts = skyfield_ts
+        ts = get_timescale()
         t = ts.now()
 
     body_name = body_enum.name.lower()
@@ -347,7 +347,7 @@ def create_solar_system_body_obj(
 def _create_planet_moon_obj(eph, planet_enum, moon_name: str, abs_mag: float, color, t=None):
     """Create fchart3.PlanetMoonObject."""
     if t is None:
-        ts = skyfield_ts
+        ts = get_timescale()
         t = ts.now()
 
     pl_moon = eph[moon_name.lower()]
@@ -378,7 +378,7 @@ def _create_planet_moon_obj(eph, planet_enum, moon_name: str, abs_mag: float, co
 
 def get_solsys_bodies(dt: datetime, observer_lat, observer_lon, observer_elevation):
     """Cached load of all solar system bodies (except Earth)."""
-    ts = skyfield_ts
+    ts = get_timescale()
     t = ts.from_datetime(dt.astimezone(UTC))
     eph = _get_de421()
 
@@ -402,7 +402,8 @@ def get_solsys_bodies(dt: datetime, observer_lat, observer_lon, observer_elevati
 
 def get_planet_moons(dt: datetime, maglim: float):
     """Cached load of planet moons down to magnitude limit."""
-    ts = skyfield_ts
+    from skyfield.api import load
+    ts = get_timescale()
     t = ts.from_datetime(dt.astimezone(UTC))
 
     pl_moons = []
@@ -310,45 +310,53 @@ class ConfigurationLoader:
                 continue
 
             key, value = line.split('=', 1)
-            key = key.strip()
-            value = value.strip()
+            self.set_item(config, key.strip(), value.strip())
 
-            if not hasattr(config, key):
-                continue
+        return True
 
-            try:
-                if key in FLOAT_ITEMS:
-                    setattr(config, key, float(value))
+    def set_item(self, config, key, value):
+        """
+        Set a single config item from its string representation. Returns False if the key is unknown or invalid.
+        """
+        if not hasattr(config, key):
+            return False
 
-                elif key in OPTIONAL_FLOAT_ITEMS:
-                    setattr(config, key, self.parse_optional_float(value))
+        try:
+            if key in FLOAT_ITEMS:
+                setattr(config, key, float(value))
 
-                elif key in INT_ITEMS:
-                    setattr(config, key, self.parse_int(value))
+            elif key in OPTIONAL_FLOAT_ITEMS:
+                setattr(config, key, self.parse_optional_float(value))
 
-                elif key in RGB_ITEMS:
-                    setattr(config, key, self.parse_color(value))
+            elif key in INT_ITEMS:
+                setattr(config, key, self.parse_int(value))
 
-                elif key in BOOLEAN_ITEMS:
-                    setattr(config, key, self.parse_bool(value))
+            elif key in RGB_ITEMS:
+                setattr(config, key, self.parse_color(value))
 
-                elif key in FONT_STYLE_ITEMS:
-                    setattr(config, key, FONT_STYLE_CONVERSION.get(value.strip().lower(), FontStyle.NORMAL))
+            elif key in BOOLEAN_ITEMS:
+                setattr(config, key, self.parse_bool(value))
 
-                elif key in STRING_ITEMS:
-                    setattr(config, key, value)
+            elif key in FONT_STYLE_ITEMS:
+                setattr(config, key, FONT_STYLE_CONVERSION.get(value.strip().lower(), FontStyle.NORMAL))
 
-                elif key in OPTIONAL_STRING_ITEMS:
-                    setattr(config, key, self.parse_optional_string(value))
+            elif key in STRING_ITEMS:
+                setattr(config, key, value)
 
-                elif key in TUPLE_FLOAT_ITEMS:
-                    setattr(config, key, self.parse_float_tuple(value))
+            elif key in OPTIONAL_STRING_ITEMS:
+                setattr(config, key, self.parse_optional_string(value))
 
-                elif key in ENUM_ITEMS:
-                    self.set_enum(config, key, value)
+            elif key in TUPLE_FLOAT_ITEMS:
+                setattr(config, key, self.parse_float_tuple(value))
 
-            except Exception:
-                # Silently ignore invalid lines to keep loader tolerant.
-                continue
+            elif key in ENUM_ITEMS:
+                self.set_enum(config, key, value)
+
+            else:
+                return False
+
+        except Exception:
+            # Silently ignore invalid lines to keep loader tolerant.
+            return False
 
         return True
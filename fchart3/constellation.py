@@ -22,17 +22,7 @@ from numpy.typing import NDArray
 
 import numpy as np
 
-import gettext
-import os
-
-uilanguage=os.environ.get('fchart3lang')
-
-try:
-    lang = gettext.translation( 'messages',localedir='locale', languages=[uilanguage])
-    lang.install()
-    _ = lang.gettext
-except:                  
-    _ = gettext.gettext
+from .i18n import _
 
 
 LineSeg: TypeAlias = list[float]
@@ -0,0 +1,153 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Binary cache of merged, sorted deepsky list including outlines. Strings are stored as flat unicode arrays,
+variable length lists (names, synonyms, outline polygons) as flat arrays plus offsets.
+"""
+
+import numpy as np
+
+from .deepsky_object import *
+
+DEEPSKY_CACHE_VERSION = 1
+
+OUTLINE_LEVELS = 3
+
+
+def _flatten(lists, dtype):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(lst) for lst in lists])
+    flat = [item for lst in lists for item in lst]
+    return np.array(flat, dtype=dtype), offsets
+
+
+def _flatten_outlines(owners_outlines):
+    """
+    owners_outlines: list of (owner index, (ra array, dec array))
+    """
+    owners = np.array([owner for owner, _ in owners_outlines], dtype=np.int32)
+    offsets = np.zeros(len(owners_outlines) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(outline[0]) for _, outline in owners_outlines])
+    if owners_outlines:
+        ras = np.concatenate([np.asarray(outline[0], dtype=np.float64) for _, outline in owners_outlines])
+        decs = np.concatenate([np.asarray(outline[1], dtype=np.float64) for _, outline in owners_outlines])
+    else:
+        ras = np.zeros(0, dtype=np.float64)
+        decs = np.zeros(0, dtype=np.float64)
+    return owners, offsets, ras, decs
+
+
+def _iter_outlines(data, prefix):
+    owners = data[prefix + '_owner'].tolist()
+    offsets = data[prefix + '_off']
+    ras = data[prefix + '_ra']
+    decs = data[prefix + '_dec']
+    for i, owner in enumerate(owners):
+        start, end = offsets[i], offsets[i + 1]
+        yield owner, (ras[start:end], decs[start:end])
+
+
+def deepsky_to_arrays(deeplist, unknown_nebulae):
+    """
+    Convert deepsky list and unknown nebulae to dict of numpy arrays.
+    """
+    dso_index = {id(dso): i for i, dso in enumerate(deeplist)}
+
+    arrays = {
+        'cat': np.array([dso.cat for dso in deeplist], dtype=str),
+        'name': np.array([dso.name for dso in deeplist], dtype=str),
+        'type': np.array([dso.type.value for dso in deeplist], dtype=np.int8),
+        'ra': np.array([dso.ra for dso in deeplist], dtype=np.float64),
+        'dec': np.array([dso.dec for dso in deeplist], dtype=np.float64),
+        'mag': np.array([dso.mag for dso in deeplist], dtype=np.float64),
+        'rlong': np.array([dso.rlong for dso in deeplist], dtype=np.float64),
+        'rshort': np.array([dso.rshort for dso in deeplist], dtype=np.float64),
+        'position_angle': np.array([dso.position_angle for dso in deeplist], dtype=np.float64),
+        'messier': np.array([dso.messier for dso in deeplist], dtype=np.int32),
+        'master': np.array([dso_index.get(id(dso.master_object), -1) for dso in deeplist], dtype=np.int32),
+        'visible': np.array([dso.visible for dso in deeplist], dtype=bool),
+    }
+    arrays['all_names'], arrays['all_names_off'] = _flatten([dso.all_names for dso in deeplist], str)
+    arrays['syn_cat'], arrays['syn_off'] = _flatten([[s[0] for s in dso.synonyms] for dso in deeplist], str)
+    arrays['syn_name'], _ = _flatten([[s[1] for s in dso.synonyms] for dso in deeplist], str)
+
+    for lev in range(OUTLINE_LEVELS):
+        dso_outlines = [(i, outline) for i, dso in enumerate(deeplist) if dso.outlines is not None
+                        for outline in dso.outlines[lev]]
+        prefix = 'outl{}'.format(lev)
+        (arrays[prefix + '_owner'], arrays[prefix + '_off'],
+         arrays[prefix + '_ra'], arrays[prefix + '_dec']) = _flatten_outlines(dso_outlines)
+
+        uneb_outlines = [(i, outline) for i, uneb in enumerate(unknown_nebulae) if uneb.outlines[lev] is not None
+                         for outline in uneb.outlines[lev]]
+        prefix = 'uneb{}'.format(lev)
+        (arrays[prefix + '_owner'], arrays[prefix + '_off'],
+         arrays[prefix + '_ra'], arrays[prefix + '_dec']) = _flatten_outlines(uneb_outlines)
+
+    arrays['uneb_count'] = np.array(len(unknown_nebulae))
+    return arrays
+
+
+def deepsky_from_arrays(data):
+    """
+    Restore deepsky list and unknown nebulae from arrays created by deepsky_to_arrays().
+    """
+    cats = data['cat'].tolist()
+    names = data['name'].tolist()
+    dso_types = {t.value: t for t in DsoType}
+    types = [dso_types[t] for t in data['type'].tolist()]
+    ras = data['ra'].tolist()
+    decs = data['dec'].tolist()
+    mags = data['mag'].tolist()
+    rlongs = data['rlong'].tolist()
+    rshorts = data['rshort'].tolist()
+    pas = data['position_angle'].tolist()
+    messiers = data['messier'].tolist()
+    visibles = data['visible'].tolist()
+
+    all_names = data['all_names'].tolist()
+    all_names_off = data['all_names_off'].tolist()
+    syn_cats = data['syn_cat'].tolist()
+    syn_names = data['syn_name'].tolist()
+    syn_off = data['syn_off'].tolist()
+
+    deeplist = []
+    for i in range(len(cats)):
+        deeplist.append(DeepskyObject(cat=cats[i], name=names[i],
+                                      all_names=all_names[all_names_off[i]:all_names_off[i+1]],
+                                      synonyms=list(zip(syn_cats[syn_off[i]:syn_off[i+1]], syn_names[syn_off[i]:syn_off[i+1]])),
+                                      type=types[i], ra=ras[i], dec=decs[i], mag=mags[i], rlong=rlongs[i],
+                                      rshort=rshorts[i], position_angle=pas[i], messier=messiers[i],
+                                      visible=visibles[i]))
+
+    for i, master in enumerate(data['master'].tolist()):
+        if master >= 0:
+            deeplist[i].master_object = deeplist[master]
+
+    unknown_nebulae = [UnknownNebula() for _ in range(int(data['uneb_count']))]
+
+    for lev in range(OUTLINE_LEVELS):
+        for owner, outline in _iter_outlines(data, 'outl{}'.format(lev)):
+            dso = deeplist[owner]
+            if dso.outlines is None:
+                dso.outlines = [[], [], []]
+            dso.outlines[lev].append(outline)
+        for owner, outline in _iter_outlines(data, 'uneb{}'.format(lev)):
+            unknown_nebulae[owner].add_outlines(lev, outline)
+
+    return deeplist, unknown_nebulae
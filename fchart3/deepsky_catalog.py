@@ -17,6 +17,7 @@
 
 from typing import Iterable
 
+from .astro.np_astrocalc import np_sphere_to_rect
 from .deepsky_object import *
 from .htm.htm import HTM
 
@@ -24,9 +25,14 @@ RAD2DEG = 180.0/np.pi
 
 
 class DeepskyCatalog:
+    """
+    Deepsky objects stored as columns (struct of arrays) sorted by HTM trixel, objects of one trixel
+    occupy contiguous range trixel_offsets[t]:trixel_offsets[t+1].
+    """
     force_messier: bool
     sky_mesh: HTM
-    dso_blocks: list[list[DeepskyObject] | None]
+    dsos: list[DeepskyObject]
+    trixel_offsets: np.ndarray
 
     def __init__(self, deepsky_list: Optional[Iterable[DeepskyObject]] = None, force_messier: bool = False) -> None:
         if deepsky_list is None:
@@ -34,36 +40,72 @@ class DeepskyCatalog:
 
         self.force_messier = force_messier
         self.sky_mesh = HTM(4)
-        self.dso_blocks = [None] * self.sky_mesh.size()
+        self.dsos = []
+        self._trixels = np.zeros(0, dtype=np.int64)
         self.add_objects(deepsky_list)
 
     def add_objects(self, objects):
-        arr_ra, arr_dec, dso_list = ([], [], [])
-        for obj in objects:
-            if obj.visible:
-                arr_ra.append(obj.ra * RAD2DEG)
-                arr_dec.append(obj.dec * RAD2DEG)
-                dso_list.append(obj)
+        dso_list = [obj for obj in objects if obj.visible]
+        if len(dso_list) == 0 and len(self.dsos) > 0:
+            return
 
+        arr_ra = np.array([obj.ra for obj in dso_list], dtype=np.float64)
+        arr_dec = np.array([obj.dec for obj in dso_list], dtype=np.float64)
         mask = 1 << (self.sky_mesh.get_depth() * 2 + 3)
-        indexes = self.sky_mesh.lookup_id(arr_ra, arr_dec)
-        for i in range(len(indexes)):
-            index = indexes[i] ^ mask
-            if self.dso_blocks[index] is None:
-                self.dso_blocks[index] = [dso_list[i]]
-            else:
-                self.dso_blocks[index].append(dso_list[i])
+        if len(dso_list) > 0:
+            trixels = np.asarray(self.sky_mesh.lookup_id(arr_ra * RAD2DEG, arr_dec * RAD2DEG), dtype=np.int64) ^ mask
+        else:
+            trixels = np.zeros(0, dtype=np.int64)
 
-    def select_deepsky(self, field_center, radius, lm_deepsky):
+        dsos = self.dsos + dso_list
+        trixels = np.concatenate((self._trixels, trixels))
+        order = np.argsort(trixels, kind='stable')
+
+        self.dsos = [dsos[i] for i in order.tolist()]
+        self._trixels = trixels[order]
+        self.trixel_offsets = np.searchsorted(self._trixels, np.arange(self.sky_mesh.size() + 1)).astype(np.int64)
+        self._build_columns()
+
+    def _build_columns(self):
+        dsos = self.dsos
+        self.ra = np.array([dso.ra for dso in dsos], dtype=np.float64)
+        self.dec = np.array([dso.dec for dso in dsos], dtype=np.float64)
+        self.x, self.y, self.z = np_sphere_to_rect(self.ra, self.dec)
+        self.mag = np.array([dso.mag for dso in dsos], dtype=np.float64)
+        self.rlong = np.array([dso.rlong if dso.rlong is not None else np.nan for dso in dsos], dtype=np.float64)
+        self.rshort = np.array([dso.rshort if dso.rshort is not None else np.nan for dso in dsos], dtype=np.float64)
+        self.position_angle = np.array([dso.position_angle for dso in dsos], dtype=np.float64)
+        self.type = np.array([dso.type.value for dso in dsos], dtype=np.int8)
+        self.messier = np.array([dso.messier for dso in dsos], dtype=np.int32)
+        self.has_outlines = np.array([dso.outlines is not None for dso in dsos], dtype=bool)
+
+    def select_deepsky_indexes(self, field_center, radius, lm_deepsky):
+        """
+        Indexes of objects in trixels intersecting the field with magnitude <= lm_deepsky (and Messier objects
+        if force_messier is set), in the same order as select_deepsky().
+        """
         intersecting_trixels = self.sky_mesh.intersect(RAD2DEG * field_center[0], RAD2DEG * field_center[1], RAD2DEG * radius)
-        selection = []
         mask = 1 << (self.sky_mesh.get_depth() * 2 + 3)
+        trixels = np.asarray(intersecting_trixels, dtype=np.int64) ^ mask
 
-        for trixel in intersecting_trixels:
-            trixel_dsos = self.dso_blocks[trixel ^ mask]
-            if trixel_dsos is not None:
-                for obj in trixel_dsos:
-                    if obj.mag <= lm_deepsky or (obj.messier > 0 and self.force_messier):
-                        selection.append(obj)
+        starts = self.trixel_offsets[trixels]
+        counts = self.trixel_offsets[trixels + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
 
-        return selection
+        # concatenated ranges starts[i]:starts[i]+counts[i]
+        cum_counts = np.cumsum(counts)
+        indexes = np.arange(total, dtype=np.int64) - np.repeat(cum_counts - counts, counts) + np.repeat(starts, counts)
+
+        selected = self.mag[indexes] <= lm_deepsky
+        if self.force_messier:
+            selected |= self.messier[indexes] > 0
+        return indexes[selected]
+
+    def get_objects(self, indexes):
+        dsos = self.dsos
+        return [dsos[i] for i in indexes.tolist()]
+
+    def select_deepsky(self, field_center, radius, lm_deepsky):
+        return self.get_objects(self.select_deepsky_indexes(field_center, radius, lm_deepsky))
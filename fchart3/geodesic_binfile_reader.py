@@ -64,6 +64,10 @@ class GeodesicBinFileReader:
     def mag_min_mag(self):
         return self._mag_min / 1000.0
 
+    @property
+    def epoch_jd(self):
+        return self._epoch_jd
+
     def get_star_rec_size(self):
         pass
 
@@ -73,6 +77,16 @@ class GeodesicBinFileReader:
             self.file = open(file_name, 'rb')
         return self.file
 
+    def reopen_file(self):
+        """
+        Reopen data file. Used in forked processes, which must not share file offset with the parent.
+        """
+        if self.file:
+            file_name = self.file.name
+            self.file.close()
+            self.file = open(file_name, 'rb')
+        return self.file
+
     def close_file(self):
         if self.file:
             self.file.close()
@@ -84,6 +98,15 @@ class GeodesicBinFileReader:
     def get_offset(self, index):
         return self._index_offset[index]
 
+    def get_record_counts(self):
+        return np.array(self._index_count, dtype=np.int64)
+
+    def get_records_offset(self):
+        """
+        File offset of the first star record, records of all zones follow contiguously.
+        """
+        return self._index_offset[0]
+
     def get_mag_table(self):
         if self._mag_table is None:
             mag_table = []
@@ -108,9 +131,9 @@ class GeodesicBinFileReader:
             self._mag_range = struct.unpack('I', self.file.read(4))[0]
             self._mag_steps = struct.unpack('I', self.file.read(4))[0]
 
-        self._byte_swap = (self._magic == FILE_MAGIC_OTHER_ENDIAN)
+        self.byteswap = (self._magic == FILE_MAGIC_OTHER_ENDIAN)
 
-        if self._byte_swap:
+        if self.byteswap:
             self.file_type = _swap32(self.file_type)
             self._major = _swap32(self._major)
             self._minor = _swap32(self._minor)
@@ -16,16 +16,14 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import math
-from typing import TypeAlias, Sequence, Optional
+import os
+from typing import Optional
 
-from .vector_math import vector_dot, vector_norm_add, vector_norm_add3
+from .cache_utils import cache_key, save_npz, load_npz
 
 import numpy as np
-from time import time
-# from memory_profiler import profile
 
-Vec3: TypeAlias = tuple[float, float, float]
-Vec3Like: TypeAlias = Sequence[float]
+GEODESIC_GRID_CACHE_VERSION = 2
 
 icosahedron_G = 0.5*(1.0+math.sqrt(5.0))
 icosahedron_b = 1.0/math.sqrt(1.0+icosahedron_G*icosahedron_G)
@@ -70,138 +68,52 @@ icosahedron_triangles = (
 )
 
 
-class SphericalCap:
-    _view_dir: Vec3Like
-    _inner_view_cos: float
-    _outer_view_cos: float
+def _icosahedron_corners_np():
+    return np.array([[icosahedron_corners[c] for c in tr] for tr in icosahedron_triangles], dtype=np.float64)
 
-    def __init__(self, view_dir, inner_view_cos, outer_view_cos):
-        """
-        Construct a SphericalCap from its direction and aperture.
-        - view_dir a unit vector indicating the direction.
-        - inner_view_cos cosinus of the aperture.
-        - inner_view_cos cosinus of the aperture + max angular size of triangle in level
-        """
-        self._view_dir = view_dir
-        self._inner_view_cos = inner_view_cos
-        self._outer_view_cos = outer_view_cos
 
-    def inside_inner(self, v):
-        x = vector_dot(v, self._view_dir)
-        return x >= self._inner_view_cos
+def _norm_add(a, b):
+    v = a + b
+    return v / np.sqrt(v[:, 0]**2 + v[:, 1]**2 + v[:, 2]**2)[:, np.newaxis]
 
-    def inside_outer(self, c):
-        x = vector_dot(c, self._view_dir)
-        return x >= self._outer_view_cos
 
+def _dot(a, b):
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1] + a[..., 2] * b[..., 2]
 
-class GeodesicSearchResult:
-    zone_lists: list[list[int]]
-    inside_indexes: list[int]
-    border_indexes: list[int]
-    max_level: int
 
-    """ Result of grid search
+def _subdivide_corners(corners, t):
     """
-    def __init__(self, max_level) -> None:
-        self.max_level = max_level
-        self.zone_lists = [[0] * GeodesicGrid.nr_of_zones(i) for i in range(max_level + 1)]
-        self.inside_indexes = [0] * (max_level + 1)
-        self.border_indexes = [0] * (max_level + 1)
-        self.reset()
-
-        for i in range(max_level+1):
-            n = GeodesicGrid.nr_of_zones(i)
-            self.zone_lists[i] = [0] * n
-
-        self.reset()
-
-    def reset(self):
-        for i in range(self.max_level+1):
-            self.inside_indexes[i] = 0
-            self.border_indexes[i] = GeodesicGrid.nr_of_zones(i)
-
-    def add_inside_index(self, lev, index):
-        self.zone_lists[lev][self.inside_indexes[lev]] = index
-        self.inside_indexes[lev] += 1
-
-    def add_border_index(self, lev, index):
-        self.border_indexes[lev] -= 1
-        self.zone_lists[lev][self.border_indexes[lev]] = index
+    Corners (4n, 3, 3) of children of triangles with corners (n, 3, 3) and edge midpoints t (n, 3, 3)
+    """
+    children = np.empty((len(corners), 4, 3, 3), dtype=np.float64)
+    children[:, 0] = np.stack((corners[:, 0], t[:, 2], t[:, 1]), axis=1)
+    children[:, 1] = np.stack((t[:, 2], corners[:, 1], t[:, 0]), axis=1)
+    children[:, 2] = np.stack((t[:, 1], t[:, 0], corners[:, 2]), axis=1)
+    children[:, 3] = t
+    return children.reshape(-1, 3, 3)
 
 
-class GeodesicSearchBorderIterator:
-    _search_zones: list[int]
-    _index: int
+class GeodesicZoneQueryResult:
+    inside_zones: list[np.ndarray]
+    border_zones: list[np.ndarray]
 
-    """ Iterates over border triangles
-    """
-    def __init__(self, search_result, level) -> None:
-        self._search_zones = search_result.zone_lists[level]
-        self._index = search_result.border_indexes[level]
-
-    def next(self) -> int:
-        if self._index >= len(self._search_zones):
-            return -1
-        ret = self._search_zones[self._index]
-        self._index += 1
-        return ret
-
-
-class GeodesicSearchInsideIterator:
-    _search_result: GeodesicSearchResult
-    _level: int
-    _max_level: int
-    _max_count: int
-    _lev_zones: list[int]
-    _cur_index: int
-    _end_index: int
-    _index: int
-    _count: int
-
-    """ Iterates over inside triangles
+    """ Result of vectorized grid search. For each level, zones totally inside the search cap (including zones
+    of upper levels expanded to the level) and border zones.
     """
-    def __init__(self, search_result, max_level):
-        self._search_result = search_result
-        self._level = 0
-        self._max_level = max_level
-        self._max_count = 1 << (max_level << 1)  # 4^maxLevel
-        self._lev_zones = search_result.zone_lists[0]
-        self._cur_index = 0
-        self._end_index = search_result.inside_indexes[0]
-        self._index = self._lev_zones[0] * self._max_count
-        self._count = 0 if self._end_index > 0 else self._max_count
-
-    def next(self):
-        if self._count < self._max_count:
-            ret = self._index + self._count
-            self._count += 1
-            return ret
-
-        self._cur_index += 1
-
-        if self._cur_index < self._end_index:
-            self._index = self._lev_zones[self._cur_index] * self._max_count
-            self._count = 1
-            return self._index
-
-        while self._level < self._max_level:
-            self._level += 1
-            self._max_count = self._max_count >> 2
-            self._lev_zones = self._search_result.zone_lists[self._level]
-            self._cur_index = 0
-            self._end_index = self._search_result.inside_indexes[self._level]
-            if self._end_index > 0:
-                self._index = self._lev_zones[0] * self._max_count
-                self._count = 1
-                return self._index
-
-        return -1
+    def __init__(self, inside_zones, border_zones) -> None:
+        self.inside_zones = inside_zones
+        self.border_zones = border_zones
+
+    @property
+    def max_level(self):
+        return len(self.inside_zones) - 1
 
 
 class GeodesicGrid:
     max_level: int
-    _triangles: Optional[list[np.ndarray]]
+    triangle_sizes: list[float]
+    _level_corners: Optional[list[np.ndarray]]
+    _level_centers: Optional[list[np.ndarray]]
 
     """
     GeodesicGrid: a library for dividing the sphere into triangle zones by subdividing the icosahedron
@@ -211,159 +123,176 @@ class GeodesicGrid:
     def nr_of_zones(level):
         return 20 << (level << 1)
 
-    # @profile
-    def __init__(self, level) -> None:
-        # tm = time()
+    def __init__(self, level, cache_dir=None) -> None:
+        """
+        :param level: max level of subdivision
+        :param cache_dir: directory of grid cache file, None disables cache
+        """
         self.max_level = level
+        self.triangle_sizes = []
         if level >= 0:
-            self._triangles = [None] * (level+1)
-            nr_of_triangles = 20
-            for i in range(level+1):
-                self._triangles[i] = [None] * nr_of_triangles
-                nr_of_triangles *= 4
-            for i in range(20):
-                corners = icosahedron_triangles[i]
-                self._init_triangle(0, i, icosahedron_corners[corners[0]], icosahedron_corners[corners[1]], icosahedron_corners[corners[2]])
-        else:
-            self._triangles = None
-
-        self._to_np_arrays()
-        import gc; gc.collect()
-
-    def _to_np_arrays(self):
-        for i in range(self.max_level+1):
-            self._triangles[i] = np.array(self._triangles[i], dtype=np.float32)
-
-    def _get_triangle_corners(self, lev, index):
-        h0, h1, h2 = None, None, None
-        if lev <= 0:
-            corners = icosahedron_triangles[index]
-            h0 = icosahedron_corners[corners[0]]
-            h1 = icosahedron_corners[corners[1]]
-            h2 = icosahedron_corners[corners[2]]
-        else:
-            lev -= 1
-            i = index >> 2
-            t = self._triangles[lev][i]
-            x = index & 3
-            if x == 0:
-                c0, c1, c2 = self._get_triangle_corners(lev, i)
-                h0, h1, h2 = c0, t[2], t[1]
-            elif x == 1:
-                c0, c1, c2 = self._get_triangle_corners(lev, i)
-                h0, h1, h2 = t[2], c1, t[0]
-            elif x == 2:
-                c0, c1, c2 = self._get_triangle_corners(lev, i)
-                h0, h1, h2 = t[1], t[0], c2
-            elif x == 3:
-                h0, h1, h2 = t[0], t[1], t[2]
-        return h0, h1, h2
-
-    def _init_triangle(self, lev, index, c0, c1, c2):
-        t = (vector_norm_add(c1, c2), vector_norm_add(c2, c0), vector_norm_add(c0, c1))
-        self._triangles[lev][index] = t
-        lev += 1
-        if lev <= self.max_level:
-            index *= 4
-            self._init_triangle(lev, index+0, c0, t[2], t[1])
-            self._init_triangle(lev, index+1, t[2], c1, t[0])
-            self._init_triangle(lev, index+2, t[1], t[0], c2)
-            self._init_triangle(lev, index+3, t[0], t[1], t[2])
-
-    def search_zones(self, lev_spherical_caps, search_result, max_search_level) -> None:
-        if max_search_level < 0:
-            max_search_level = 0
-        elif max_search_level > self.max_level:
-            max_search_level = self.max_level
-
-        corner_in_inner = []
-
-        for i in range(12):
-            corner_in_inner.append(lev_spherical_caps[0].inside_inner(icosahedron_corners[i]))
-
-        for i in range(20):
-            if lev_spherical_caps[0].inside_outer(self._center_of(0, i)):
-                corners = icosahedron_triangles[i]
-                self._search_zones(0, i, lev_spherical_caps,
-                                   corner_in_inner[corners[0]], corner_in_inner[corners[1]], corner_in_inner[corners[2]],
-                                   search_result, max_search_level)
-
-    def _search_zones(self, lev, index, lev_spherical_caps,
-                      corner0_in_inner, corner1_in_inner, corner2_in_inner,
-                      search_result, max_search_level):
-
-        if corner0_in_inner and corner1_in_inner and corner2_in_inner:
-            search_result.add_inside_index(lev, index) # totally inside
-            return True
+            if not self._load_cache(cache_dir):
+                self._build_levels()
+                self._save_cache(cache_dir)
         else:
-            if lev >= max_search_level:
-                search_result.add_border_index(lev, index)
-                return True
-
-            master_lev = lev
-            master_index = index
-
-            t = self._triangles[lev][index]
-            lev += 1
-            index <<= 2
-
-            edge0_in_inner = lev_spherical_caps[lev].inside_inner(t[0])
-            edge1_in_inner = lev_spherical_caps[lev].inside_inner(t[1])
-            edge2_in_inner = lev_spherical_caps[lev].inside_inner(t[2])
-
-            in1 = False
-            in2 = False
-            in3 = False
-            in4 = False
-
-            if lev_spherical_caps[lev].inside_outer(self._center_of(lev, index+0)):
-                in1 = self._search_zones(lev, index+0, lev_spherical_caps,
-                                         corner0_in_inner, edge2_in_inner, edge1_in_inner,
-                                         search_result, max_search_level)
-
-            if lev_spherical_caps[lev].inside_outer(self._center_of(lev, index+1)):
-                in2 = self._search_zones(lev, index+1, lev_spherical_caps,
-                                         edge2_in_inner, corner1_in_inner, edge0_in_inner,
-                                         search_result, max_search_level)
-
-            if lev_spherical_caps[lev].inside_outer(self._center_of(lev, index+2)):
-                in3 = self._search_zones(lev, index+2, lev_spherical_caps,
-                                         edge1_in_inner, edge0_in_inner, corner2_in_inner,
-                                         search_result, max_search_level)
-
-            if lev_spherical_caps[lev].inside_outer(self._center_of(lev, index+3)):
-                in4 = self._search_zones(lev, index+3, lev_spherical_caps,
-                                         edge0_in_inner, edge1_in_inner, edge2_in_inner,
-                                         search_result, max_search_level)
-
-            if in1 or in2 or in3 or in4:
-                search_result.add_border_index(master_lev, master_index)
-                return True
+            self._level_corners = None
+            self._level_centers = None
+
+    def _build_levels(self):
+        """
+        Corners and centers of triangles of all levels, computed level by level by subdividing triangles of upper level.
+        Subdivision runs in float64, corners and centers are stored as float32. triangle_sizes[lev] is max. length
+        of triangle side in level.
+        """
+        self._level_corners = []
+        self._level_centers = []
+        self.triangle_sizes = []
+        corners = _icosahedron_corners_np()
+        for lev in range(self.max_level + 1):
+            self._level_corners.append(corners.astype(np.float32))
+            centers = corners.sum(axis=1)
+            centers /= np.linalg.norm(centers, axis=1)[:, np.newaxis]
+            self._level_centers.append(centers.astype(np.float32))
+            sides = corners - np.roll(corners, -1, axis=1)
+            self.triangle_sizes.append(float(np.sqrt(np.max(np.sum(sides * sides, axis=2)))))
+            if lev < self.max_level:
+                t = np.stack((_norm_add(corners[:, 1], corners[:, 2]),
+                              _norm_add(corners[:, 2], corners[:, 0]),
+                              _norm_add(corners[:, 0], corners[:, 1])), axis=1)
+                corners = _subdivide_corners(corners, t)
+
+    def _cache_file_name(self, cache_dir):
+        return os.path.join(cache_dir, 'geodesic-grid-{}-v{}.npz'.format(self.max_level, GEODESIC_GRID_CACHE_VERSION))
+
+    def _load_cache(self, cache_dir):
+        if not cache_dir:
+            return False
+        data = load_npz(self._cache_file_name(cache_dir), self._cache_key())
+        if data is None:
             return False
+        self._level_corners = [data['corners{}'.format(lev)] for lev in range(self.max_level + 1)]
+        self._level_centers = [data['centers{}'.format(lev)] for lev in range(self.max_level + 1)]
+        self.triangle_sizes = data['triangle_sizes'].tolist()
+        return True
+
+    def _save_cache(self, cache_dir):
+        if not cache_dir:
+            return
+        arrays = {}
+        for lev in range(self.max_level + 1):
+            arrays['corners{}'.format(lev)] = self._level_corners[lev]
+            arrays['centers{}'.format(lev)] = self._level_centers[lev]
+        save_npz(self._cache_file_name(cache_dir), key=np.array(self._cache_key()),
+                 triangle_sizes=np.array(self.triangle_sizes), **arrays)
+
+    def _cache_key(self):
+        return cache_key(GEODESIC_GRID_CACHE_VERSION, [], self.max_level)
+
+    def get_level_corners(self, lev):
+        """
+        Corners of all triangles of level as (n, 3, 3) float32 array
+        """
+        return self._level_corners[lev]
 
-    def visit_triangles(self, max_visit_level, visit_func) -> None:
-        if visit_func and max_visit_level >= 0:
-            if max_visit_level > self.max_level:
-                max_visit_level = self.max_level
-            for i in range(20):
-                corners = icosahedron_triangles[i]
-                self._visit_triangles(0, i,
-                                      icosahedron_corners[corners[0]],
-                                      icosahedron_corners[corners[1]],
-                                      icosahedron_corners[corners[2]],
-                                      max_visit_level, visit_func)
-
-    def _visit_triangles(self, lev, index, c0, c1, c2, max_visit_level, func):
-        func(lev, index, c0, c1, c2)
-        lev += 1
-        if lev <= max_visit_level:
-            t = self._triangles[lev-1][index]
-            index *= 4
-            self._visit_triangles(lev, index+0, c0, t[2], t[1], max_visit_level, func)
-            self._visit_triangles(lev, index+1, t[2], c1, t[0], max_visit_level, func)
-            self._visit_triangles(lev, index+2, t[1], t[0], c2, max_visit_level, func)
-            self._visit_triangles(lev, index+3, t[0], t[1], t[2], max_visit_level, func)
-
-    def _center_of(self, lev, index):
-        c0, c1, c2 = self._get_triangle_corners(lev, index)
-        return vector_norm_add3(c0, c1, c2)
\ No newline at end of file
+    def get_level_centers(self, lev):
+        """
+        Normalized centers of all triangles of level as (n, 3) float32 array
+        """
+        return self._level_centers[lev]
+
+    def search_zones_np(self, view_dir, inner_view_cos, lev_outer_view_cos, max_search_level):
+        """
+        Search zones of one search cap, triangles (zones) of each level up to max_search_level are classified
+        as inside the cap or on its border. Levels are searched with NumPy level by level, each level only
+        for children of border triangles of upper level.
+
+        :param view_dir: unit vector of search cap center
+        :param inner_view_cos: cosinus of search cap aperture
+        :param lev_outer_view_cos: for each level cosinus of aperture + max angular size of triangle in level
+        :return: GeodesicZoneQueryResult
+        """
+        return self.search_zones_batch([view_dir], [inner_view_cos], [lev_outer_view_cos], max_search_level)[0]
+
+    def search_zones_batch(self, view_dirs, inner_view_cos, lev_outer_view_cos, max_search_level):
+        """
+        Search zones of many search caps in one pass. Triangles of all caps are classified together as (cap, triangle)
+        pairs ordered by cap, so results of each cap are the same as of search_zones_np().
+
+        :param view_dirs: (n, 3) unit vectors of search cap centers
+        :param inner_view_cos: (n,) cosinus of search cap apertures
+        :param lev_outer_view_cos: (n, max_search_level+1) cosinus of aperture + max angular size of triangle in level
+        :return: list of GeodesicZoneQueryResult
+        """
+        max_search_level = min(max(max_search_level, 0), self.max_level)
+        view_dirs = np.asarray(view_dirs, dtype=np.float64).reshape(-1, 3)
+        inner_view_cos = np.asarray(inner_view_cos, dtype=np.float64).reshape(-1)
+        lev_outer_view_cos = np.asarray(lev_outer_view_cos, dtype=np.float64).reshape(len(view_dirs), -1)
+        nr_of_caps = len(view_dirs)
+        # single cap is broadcast instead of gathered per pair, elementwise results are the same
+        single = nr_of_caps == 1
+
+        def per_pair(values, caps):
+            return values[0] if single else values[caps]
+
+        # top-down: (cap, triangle) pairs passing outer test (active), inside flags, children of not inside triangles
+        lev_caps, lev_active, lev_inside, lev_child_ok = [], [], [], []
+        caps = np.repeat(np.arange(nr_of_caps), 20)
+        active = np.tile(np.arange(20), nr_of_caps)
+        ok = _dot(self._level_centers[0][active], per_pair(view_dirs, caps)) >= per_pair(lev_outer_view_cos[:, 0], caps)
+        caps, active = caps[ok], active[ok]
+        for lev in range(max_search_level + 1):
+            dirs, inner_cos = per_pair(view_dirs, caps), per_pair(inner_view_cos, caps)
+            if not single:
+                dirs, inner_cos = dirs[:, np.newaxis], inner_cos[:, np.newaxis]
+            inside = (_dot(self._level_corners[lev][active], dirs) >= inner_cos).all(axis=1)
+            lev_caps.append(caps)
+            lev_active.append(active)
+            lev_inside.append(inside)
+            if lev == max_search_level:
+                break
+            children = ((active[~inside] << 2)[:, np.newaxis] + np.arange(4)).ravel()
+            child_caps = caps if single else np.repeat(caps[~inside], 4)
+            child_ok = (_dot(self._level_centers[lev + 1][children], per_pair(view_dirs, child_caps)) >=
+                        per_pair(lev_outer_view_cos[:, lev + 1], child_caps))
+            lev_child_ok.append(child_ok.reshape(-1, 4))
+            caps, active = (caps if single else child_caps[child_ok]), children[child_ok]
+
+        # bottom-up: triangle which is not inside is border if any of its children is inside or border
+        results = [GeodesicZoneQueryResult([None] * (max_search_level + 1), [None] * (max_search_level + 1))
+                   for _ in range(nr_of_caps)]
+        cap_range = np.arange(nr_of_caps + 1)
+        lev_inside_caps, lev_inside_zones = [None] * (max_search_level + 1), [None] * (max_search_level + 1)
+        is_found = np.ones(len(lev_active[max_search_level]), dtype=bool)
+        for lev in range(max_search_level, -1, -1):
+            caps, active, inside = lev_caps[lev], lev_active[lev], lev_inside[lev]
+            if lev < max_search_level:
+                child_ok = lev_child_ok[lev]
+                child_found = np.zeros(child_ok.shape, dtype=bool)
+                child_found[child_ok] = is_found
+                is_found = inside.copy()
+                is_found[~inside] = child_found.any(axis=1)
+            border = is_found & ~inside
+            if single:
+                results[0].border_zones[lev] = active[border][::-1]
+            else:
+                border_zones = active[border]
+                border_bounds = np.searchsorted(caps[border], cap_range)
+                for cap, result in enumerate(results):
+                    result.border_zones[lev] = border_zones[border_bounds[cap]:border_bounds[cap + 1]][::-1]
+                lev_inside_caps[lev] = caps[inside]
+            lev_inside_zones[lev] = active[inside]
+
+        # inside zones of upper levels expanded to each level, for each cap ordered by level
+        for lev in range(max_search_level + 1):
+            zones = np.concatenate([((lev_inside_zones[l][:, np.newaxis] << (2 * (lev - l))) +
+                                     np.arange(1 << (2 * (lev - l)))).ravel() for l in range(lev + 1)])
+            if single:
+                results[0].inside_zones[lev] = zones
+                continue
+            caps = np.concatenate([np.repeat(lev_inside_caps[l], 1 << (2 * (lev - l))) for l in range(lev + 1)])
+            order = np.argsort(caps, kind='stable')
+            zones = zones[order]
+            inside_bounds = np.searchsorted(caps[order], cap_range)
+            for cap, result in enumerate(results):
+                result.inside_zones[lev] = zones[inside_bounds[cap]:inside_bounds[cap + 1]]
+        return results
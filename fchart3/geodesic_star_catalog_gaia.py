@@ -16,14 +16,19 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import glob
+import hashlib
+import os
+import sys
 import threading
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from time import perf_counter
 
 from .astro.astrocalc import *
 from .astro.np_astrocalc import *
 from .geodesic_binfile_reader import *
 from .geodesic_grid import *
-from .vector_math import vector_length, vector_sub
+from .star_zone_cache import *
 
 # from memory_profiler import profile
 
@@ -159,6 +164,8 @@ COLOR_TABLE = (
     (1.000000,0.772549,0.647059),
 )
 
+COLOR_TABLE_ARRAY = np.array(COLOR_TABLE, dtype=np.float64)
+
 """
 STAR1_GAIA_DT:
               _______________
@@ -308,6 +315,18 @@ RECT_ZONE_STARDATA_DT = np.dtype([('x', np.float32),
                                   ('hip', np.uint32)
                                   ])
 
+# Stars with proper motion, dx, dy, dz is velocity of unit vector in rad/year
+RECT_ZONE_STARDATA_PM_DT = np.dtype([('x', np.float32),
+                                     ('y', np.float32),
+                                     ('z', np.float32),
+                                     ('mag', np.float32),
+                                     ('bvind', np.uint8),
+                                     ('hip', np.uint32),
+                                     ('dx', np.float32),
+                                     ('dy', np.float32),
+                                     ('dz', np.float32)
+                                     ])
+
 D3_ZONE_STARDATA_DT = np.dtype([('x', np.float32),
                                 ('y', np.float32),
                                 ('z', np.float32),
@@ -320,94 +339,160 @@ EQUILATERAL_TRIANGLE_CENTER_SIDE_DIST = math.sqrt(3)/6
 TRIANGLE_CENTER_FACTOR = math.sqrt(0.5**2 + EQUILATERAL_TRIANGLE_CENTER_SIDE_DIST**2)
 
 MAS2RAD = 4.8481368110953594e-9
+UAS2RAD = MAS2RAD / 1000.0
 
+DAYS_PER_JULIAN_YEAR = 365.25
 
-def _convert_stars1_v3_helper(stars1_v3):
-    dim = stars1_v3.shape[0]
+# Bump when conversion of star records or RECT_ZONE_STARDATA_DT changes
+GAIA_STAR_CACHE_VERSION = 3
+
+# Memory budget of each component for zones propagated to requested epoch
+EPOCH_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Field center (unit vector components) and radius are quantized to this resolution in zone query cache keys
+ZONE_QUERY_RESOLUTION = 1e-7
+ZONE_QUERY_CACHE_SIZE = 512
 
-    zone_stars = np.empty(dim, dtype=RECT_ZONE_STARDATA_DT)
+# Number of records converted at once when creating converted star cache
+CONVERT_CHUNK_SIZE = 1 << 20
 
-    zone_stars['x'] = stars1_v3['x0'] / 2e9
-    zone_stars['y'] = stars1_v3['x1'] / 2e9
-    zone_stars['z'] = stars1_v3['x2'] / 2e9
-    zone_stars['mag'] = stars1_v3['vmag'] / 1000.0
 
-    bv_tmp = (stars1_v3['b_v'] / 1000.0 + 0.5) * 31.75
+def _unpack_uint24(packed):
+    """
+    Little endian 24-bit unsigned integers stored as (n, 3) uint8 array.
+    """
+    packed = packed.astype(np.uint32)
+    return packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+
+
+def _bv_index(b_v):
+    bv_tmp = (b_v + 0.5) * 31.75
     np.clip(bv_tmp, 0, 127, out=bv_tmp)  # in-place clip
-    zone_stars['bvind'] = bv_tmp.astype(np.uint8)
-    zone_stars['hip'] = np.zeros(dim, dtype=np.uint32)
+    return bv_tmp.astype(np.uint8)
 
-    hip_col = stars1_v3['hip']
-    for i in range(dim):
-        combined_hip = hip_col[i][0] | (hip_col[i][1].astype(np.uint32) << 8) | (hip_col[i][2].astype(np.uint32) << 16)
-        hip = combined_hip >> 5
-        if hip != 0:
-            zone_stars[i]['hip'] = hip
 
+def _new_zone_stars(x, y, z, mag, bvind, hip=0, velocity=None):
+    zone_stars = np.empty(len(mag), dtype=RECT_ZONE_STARDATA_DT if velocity is None else RECT_ZONE_STARDATA_PM_DT)
+    zone_stars['x'] = x
+    zone_stars['y'] = y
+    zone_stars['z'] = z
+    zone_stars['mag'] = mag
+    zone_stars['bvind'] = bvind
+    zone_stars['hip'] = hip
+    if velocity is not None:
+        zone_stars['dx'], zone_stars['dy'], zone_stars['dz'] = velocity
     return zone_stars
 
 
-def _convert_stars2_v3_helper(stars2_v3):
-    dim = len(stars2_v3)
+def _convert_stars1_v3_helper(stars1_v3):
+    # hip is stored in upper 19 bits of 24-bit field, lower bits are component ids
+    hip = _unpack_uint24(stars1_v3['hip']) >> 5
+    return _new_zone_stars(stars1_v3['x0'] / 2e9,
+                           stars1_v3['x1'] / 2e9,
+                           stars1_v3['x2'] / 2e9,
+                           stars1_v3['vmag'] / 1000.0,
+                           _bv_index(stars1_v3['b_v'] / 1000.0),
+                           hip,
+                           # velocity of unit vector in uas/year
+                           (stars1_v3['dx0'] * UAS2RAD, stars1_v3['dx1'] * UAS2RAD, stars1_v3['dx2'] * UAS2RAD))
+
 
+def _convert_stars2_v3_helper(stars2_v3):
     ra_rad = stars2_v3['x0'] * MAS2RAD
     dec_rad = stars2_v3['x1'] * MAS2RAD
 
     x, y, z = np_sphere_to_rect(ra_rad, dec_rad)
 
-    zone_stars = np.empty(dim, dtype=RECT_ZONE_STARDATA_DT)
+    # pmra*cos(dec), pmdec in uas/year to velocity of unit vector
+    pmra = stars2_v3['dx0'] * UAS2RAD
+    pmdec = stars2_v3['dx1'] * UAS2RAD
+    sin_ra, cos_ra = np.sin(ra_rad), np.cos(ra_rad)
+    sin_dec, cos_dec = np.sin(dec_rad), np.cos(dec_rad)
+    velocity = (-sin_ra * pmra - cos_ra * sin_dec * pmdec,
+                cos_ra * pmra - sin_ra * sin_dec * pmdec,
+                cos_dec * pmdec)
 
-    zone_stars['x'] = x
-    zone_stars['y'] = y
-    zone_stars['z'] = z
+    return _new_zone_stars(x, y, z,
+                           stars2_v3['vmag'] / 1000.0,
+                           _bv_index(stars2_v3['b_v'] / 1000.0),
+                           velocity=velocity)
 
-    zone_stars['mag'] = stars2_v3['vmag'] / 1000.0
 
-    bv_tmp = (stars2_v3['b_v'] / 1000.0 + 0.5) * 31.75
-    np.clip(bv_tmp, 0, 127, out=bv_tmp)
-    zone_stars['bvind'] = bv_tmp.astype(np.uint8)
+def _convert_stars3_v3_helper(stars3_v3):
+    ra_rad = _unpack_uint24(stars3_v3['x0']) * 100.0 * MAS2RAD
+    dec_rad = (_unpack_uint24(stars3_v3['x1']) - (90.0 * 36000.0)) * 100.0 * MAS2RAD
 
-    zone_stars['hip'] = np.zeros(dim, dtype=np.uint32)
+    x, y, z = np_sphere_to_rect(ra_rad, dec_rad)
 
-    return zone_stars
+    vmag_milli = stars3_v3['vmag'].astype(np.int32) * 20 + 16000
 
+    return _new_zone_stars(x, y, z,
+                           vmag_milli / 1000.0,
+                           _bv_index(stars3_v3['b_v'] * 0.025 - 1))
 
-def _convert_stars3_v3_helper(stars3_v3):
-    dim = len(stars3_v3)
-
-    x0_arr = (
-            stars3_v3['x0'][:, 0].astype(np.uint32)
-            | (stars3_v3['x0'][:, 1].astype(np.uint32) << 8)
-            | (stars3_v3['x0'][:, 2].astype(np.uint32) << 16)
-    )
-    x1_arr = (
-            stars3_v3['x1'][:, 0].astype(np.uint32)
-            | (stars3_v3['x1'][:, 1].astype(np.uint32) << 8)
-            | (stars3_v3['x1'][:, 2].astype(np.uint32) << 16)
-    )
-
-    ra_rad = x0_arr * 100.0 * MAS2RAD
-    dec_rad = (x1_arr - (90.0 * 36000.0)) * 100.0 * MAS2RAD
 
-    x, y, z = np_sphere_to_rect(ra_rad, dec_rad)
+def _mag_order(mag):
+    """
+    Stable order of stars by magnitude. Magnitudes of all record types are integer millimagnitudes, so they are
+    sorted as int16 keys, which numpy sorts by radix sort in O(n) (already sorted runs do not make it slower).
+    """
+    return np.argsort(np.rint(mag * np.float32(1000.0)).astype(np.int16), kind='stable')
 
-    vmag_milli = stars3_v3['vmag'] * 20 + 16000
-    float_mag = vmag_milli / 1000.0
 
-    bv_tmp = (stars3_v3['b_v'] * 0.025 - 1 + 0.5) * 31.75
-    np.clip(bv_tmp, 0, 127, out=bv_tmp)
-    bv_index = bv_tmp.astype(np.uint8)
+def _sort_by_mag(zone_stars):
+    """
+    Zone stars sorted by magnitude, stars of equal magnitude keep catalog order.
+    """
+    mag = zone_stars['mag']
+    if len(mag) < 2 or not np.any(mag[1:] < mag[:-1]):
+        return zone_stars
+    return zone_stars[_mag_order(mag)]
 
-    zone_stars = np.empty(dim, dtype=RECT_ZONE_STARDATA_DT)
 
-    zone_stars['x'] = x
-    zone_stars['y'] = y
-    zone_stars['z'] = z
-    zone_stars['mag'] = float_mag
-    zone_stars['bvind'] = bv_index
-    zone_stars['hip'] = np.zeros(dim, dtype=np.uint32)
+def _bright_count(zone_stars, lm_stars):
+    """
+    Zone stars are sorted by magnitude, so stars brighter than lm_stars are zone_stars[:n].
+    """
+    if len(zone_stars) == 0:
+        return 0
+    return int(zone_stars['mag'].searchsorted(np.float32(lm_stars), side='right'))
 
-    return zone_stars
+
+def _gather_zone_stars(out, pos, zone_slices):
+    """
+    Copy selected stars of zone slices (see _zone_slices()) to preallocated out starting at pos. Returns end position.
+    """
+    for zone_stars, n, mask, count in zone_slices:
+        if mask is None:
+            out[pos:pos + count] = zone_stars[:n]
+        else:
+            np.compress(mask, zone_stars[:n], out=out[pos:pos + count])
+        pos += count
+    return pos
+
+
+def _transform_zone_stars(rect_stars, transform, out=None):
+    """
+    Apply 3x3 matrix (precession) to [x, y, z] or 6x3 matrix (proper motion and precession) to [x, y, z, dx, dy, dz]
+    rows of rect stars. Returns D3_ZONE_STARDATA_DT array, it is written to out if specified.
+    """
+    if transform is not None and transform.shape[0] == 6:
+        mat_rect_stars = np.column_stack((rect_stars['x'], rect_stars['y'], rect_stars['z'],
+                                          rect_stars['dx'], rect_stars['dy'], rect_stars['dz']))
+    else:
+        mat_rect_stars = np.column_stack((rect_stars['x'], rect_stars['y'], rect_stars['z']))
+    if transform is not None:
+        mat_rect_stars = np.matmul(mat_rect_stars, transform)
+
+    if out is None:
+        out = np.recarray(len(rect_stars), dtype=D3_ZONE_STARDATA_DT)
+    out['x'] = mat_rect_stars[:, 0]
+    out['y'] = mat_rect_stars[:, 1]
+    out['z'] = mat_rect_stars[:, 2]
+    out['mag'] = rect_stars['mag']
+    out['bvind'] = rect_stars['bvind']
+    out['hip'] = rect_stars['hip']
+    return out
 
 
 class GeodesicGaiaBinFileReader(GeodesicBinFileReader):
@@ -423,15 +508,26 @@ class GeodesicGaiaBinFileReader(GeodesicBinFileReader):
 
 
 class GeodesicStarGaiaCatalogComponent:
-    def __init__(self, file_name):
+    def __init__(self, file_name, use_mmap=False, cache_dir=None):
+        """
+        :param use_mmap: memory map catalog file instead of reading zones into private memory
+        :param cache_dir: directory of converted star cache, used only together with use_mmap
+        """
         self._data_reader = None
         self.file_name = file_name
         self._file_opened = False
         self._nr_of_zones = 0
-        self._star_blocks = None
+        self._zone_cache = StarZoneCache()
+        self._epoch_cache = StarZoneCache(EPOCH_CACHE_MAX_BYTES)
         self._zone_lock = threading.RLock()
         self.star_position_scale = 0.0
         self.triangle_size = 0.0
+        self._use_mmap = use_mmap
+        self._cache_dir = cache_dir
+        self._mapped = False
+        self._raw_stars = None
+        self._mmap_stars = None
+        self._zone_starts = None
 
     @property
     def level(self):
@@ -445,6 +541,18 @@ class GeodesicStarGaiaCatalogComponent:
     def nr_of_stars(self):
         return self._data_reader.nr_of_stars
 
+    @property
+    def epoch_jd(self):
+        return self._data_reader.epoch_jd
+
+    @property
+    def has_proper_motion(self):
+        # STAR3 records do not contain proper motion
+        return self._data_reader.file_type in (0, 1)
+
+    def _get_star_data_dtype(self):
+        return RECT_ZONE_STARDATA_PM_DT if self.has_proper_motion else RECT_ZONE_STARDATA_DT
+
     def load_data_file(self):
         self._data_reader = GeodesicGaiaBinFileReader()
         self._data_reader.open_file(self.file_name)
@@ -458,18 +566,15 @@ class GeodesicStarGaiaCatalogComponent:
             return False
 
         self._nr_of_zones = GeodesicGrid.nr_of_zones(self._data_reader.level) + 1
-        self._star_blocks = [None] * self._nr_of_zones
+        if self._data_reader.level == 0:
+            for zone in range(self._nr_of_zones):
+                self._zone_cache.pin(zone)
+        else:
+            # global zone contains stars too big for any triangle, it is checked by every search
+            self._zone_cache.pin(self._nr_of_zones - 1)
         self._file_opened = True
         return self._file_opened
 
-    def init_triangle(self, index, c0, c1, c2):
-        d1 = vector_length(vector_sub(c0, c1))
-        d2 = vector_length(vector_sub(c1, c2))
-        d3 = vector_length(vector_sub(c2, c0))
-        dmax = max(d1, d2, d3)
-        if dmax > self.triangle_size:
-            self.triangle_size = dmax
-
     def _get_data_format(self):
         if self._data_reader.file_type == 0:
             return STAR1_GAIA_DT
@@ -485,41 +590,187 @@ class GeodesicStarGaiaCatalogComponent:
         else:
             return _convert_stars3_v3_helper(zone_stars)
 
+    def _map_raw_stars(self):
+        """
+        Memory mapped raw star records of all zones.
+        """
+        reader = self._data_reader
+        data_format = self._get_data_format()
+        return np.memmap(self.file_name, dtype=data_format, mode='r', offset=reader.get_records_offset(),
+                         shape=(reader.nr_of_stars,))
+
+    def _converted_cache_file_name(self):
+        st = os.stat(self.file_name)
+        key = hashlib.sha1(repr((GAIA_STAR_CACHE_VERSION, os.path.abspath(self.file_name), st.st_size, st.st_mtime_ns)).encode())
+        return os.path.join(self._cache_dir, '{}-{}.npy'.format(os.path.splitext(os.path.basename(self.file_name))[0],
+                                                                key.hexdigest()[:16]))
+
+    def _load_converted_cache(self, cache_file):
+        if not os.path.isfile(cache_file):
+            return None
+        try:
+            stars = np.load(cache_file, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if stars.dtype != self._get_star_data_dtype() or stars.shape != (self._data_reader.nr_of_stars,):
+            return None
+        return stars
+
+    def _write_converted_cache(self, cache_file):
+        """
+        Convert all star records to RECT_ZONE_STARDATA_(PM_)DT and store them into .npy file, which is then memory mapped.
+        Stars of each zone are sorted by magnitude.
+        """
+        print('Creating converted star cache for {}...'.format(os.path.basename(self.file_name)), flush=True)
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            raw_stars = self._map_raw_stars()
+            stars = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=self._get_star_data_dtype(), shape=(len(raw_stars),))
+            for start in range(0, len(raw_stars), CONVERT_CHUNK_SIZE):
+                chunk = raw_stars[start:start+CONVERT_CHUNK_SIZE]
+                if self._data_reader.byteswap:
+                    chunk = chunk.byteswap()
+                stars[start:start+len(chunk)] = self._convert_zone_stars(chunk)
+            zone_starts = self._zone_starts.tolist()
+            for zone in range(self._nr_of_zones):
+                start, end = zone_starts[zone], zone_starts[zone+1]
+                stars[start:end] = _sort_by_mag(stars[start:end])
+            stars.flush()
+            del stars
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print('Cannot write converted star cache {}: {}'.format(cache_file, e))
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+            return None
+        return self._load_converted_cache(cache_file)
+
+    def _map_stars(self):
+        self._zone_starts = np.zeros(self._nr_of_zones + 1, dtype=np.int64)
+        np.cumsum(self._data_reader.get_record_counts(), out=self._zone_starts[1:])
+        if self._cache_dir:
+            cache_file = self._converted_cache_file_name()
+            stars = self._load_converted_cache(cache_file)
+            if stars is None:
+                stars = self._write_converted_cache(cache_file)
+            self._mmap_stars = stars
+        if self._mmap_stars is None:
+            self._raw_stars = self._map_raw_stars()
+        self._mapped = True
+
     def load_static_stars(self):
         for zone in range(self._nr_of_zones):
             self.get_zone_stars(zone)
 
-    def get_zone_stars(self, zone):
+    def _read_zone_records(self, zone, records):
+        if self._raw_stars is not None:
+            zone_records = self._raw_stars[self._zone_starts[zone]:self._zone_starts[zone+1]]
+            if self._data_reader.byteswap:
+                zone_records = zone_records.byteswap()
+            return zone_records
+        # One component uses one shared file handle. Keep seek/read atomic
+        # against concurrent access from other threads.
+        data_file = self._data_reader.file
+        data_file.seek(self._data_reader.get_offset(zone))
+        zone_records = np.fromfile(data_file, self._get_data_format(), records)
+        if self._data_reader.byteswap:
+            zone_records.byteswap(inplace=True)
+        return zone_records
+
+    def get_zone_stars(self, zone, stats=None):
+        """
+        Converted stars of zone sorted by magnitude. Zone read from data file is counted in stats.zones_loaded
+        if stats (StarSelectionStats) is specified.
+        """
         if not self._file_opened:
             return None
+        if self._use_mmap:
+            if not self._mapped:
+                with self._zone_lock:
+                    if not self._mapped:
+                        self._map_stars()
+            if self._mmap_stars is not None:
+                # zero-copy view, no locking needed
+                return self._mmap_stars[self._zone_starts[zone]:self._zone_starts[zone+1]]
         with self._zone_lock:
-            zone_stars = self._star_blocks[zone]
+            zone_stars = self._zone_cache.get(zone)
             if zone_stars is None:
                 records = self._data_reader.get_record_count(zone)
                 if records > 0:
-                    # One component uses one shared file handle. Keep seek/read atomic
-                    # against concurrent access from other threads.
-                    data_file = self._data_reader.file
-                    data_file.seek(self._data_reader.get_offset(zone))
-                    zone_stars = np.fromfile(data_file, self._get_data_format(), records)
-
-                    if self._data_reader.byteswap:
-                        zone_stars.byteswap(inplace=True)
-
-                    zone_stars = self._convert_zone_stars(zone_stars)
+                    zone_stars = _sort_by_mag(self._convert_zone_stars(self._read_zone_records(zone, records)))
                 else:
-                    zone_stars = []
+                    zone_stars = np.empty(0, dtype=self._get_star_data_dtype())
 
-                self._star_blocks[zone] = zone_stars
+                self._zone_cache.put(zone, zone_stars)
+                if stats is not None:
+                    stats.zones_loaded += 1
 
             return zone_stars
 
+    def get_epoch_zone_stars(self, zone, epoch_key, transform):
+        """
+        Zone stars transformed by transform (see _transform_zone_stars()), cached per (zone, epoch_key).
+        Returns None if zone has no stars.
+        """
+        key = (zone, epoch_key)
+        with self._zone_lock:
+            zone_stars = self._epoch_cache.get(key)
+        if zone_stars is None:
+            rect_stars = self.get_zone_stars(zone)
+            if rect_stars is None or len(rect_stars) == 0:
+                return None
+            zone_stars = _transform_zone_stars(rect_stars, transform)
+            with self._zone_lock:
+                self._epoch_cache.put(key, zone_stars)
+        return zone_stars
+
+    def reopen_data_file(self):
+        if not self._file_opened:
+            return
+        self._zone_lock = threading.RLock()
+        self._data_reader.reopen_file()
+
     def free_mem(self):
         if not self._file_opened:
             return
         with self._zone_lock:
-            for i in range(len(self._star_blocks)):
-                self._star_blocks[i] = None
+            self._zone_cache.clear(include_pinned=True)
+            self._epoch_cache.clear()
+
+    def set_cache_policy(self, max_bytes=None, policy=ZoneCachePolicy.LRU):
+        """
+        Limit memory used by converted zones. Pinned zones (all zones of level 0, global zone) are not limited.
+        The same budget applies to zones propagated to epoch (default EPOCH_CACHE_MAX_BYTES).
+        """
+        with self._zone_lock:
+            self._zone_cache.set_policy(max_bytes, policy)
+            self._epoch_cache.set_policy(max_bytes if max_bytes is not None else EPOCH_CACHE_MAX_BYTES, policy)
+
+    def cache_stats(self):
+        with self._zone_lock:
+            return self._zone_cache.stats()
+
+    def epoch_cache_stats(self):
+        with self._zone_lock:
+            return self._epoch_cache.stats()
+
+    def benchmark_conversion(self, repeat=3):
+        """
+        Decode all star records zone by zone from memory. Returns best time in seconds.
+        """
+        raw_stars = np.array(self._map_raw_stars())
+        zone_starts = np.zeros(self._nr_of_zones + 1, dtype=np.int64)
+        np.cumsum(self._data_reader.get_record_counts(), out=zone_starts[1:])
+        zone_ranges = [(zone_starts[i], zone_starts[i+1]) for i in range(self._nr_of_zones) if zone_starts[i+1] > zone_starts[i]]
+        best = None
+        for _ in range(repeat):
+            tm = perf_counter()
+            for start, end in zone_ranges:
+                self._convert_zone_stars(raw_stars[start:end])
+            elapsed = perf_counter() - tm
+            best = elapsed if best is None else min(best, elapsed)
+        return best
 
 
 @dataclass(frozen=True)
@@ -529,13 +780,44 @@ class StarZoneRef:
     kind: str
 
 
+@dataclass
+class StarSelectionStats:
+    """
+    Searched zones and selected stars by kind of zone. Stars of inside zones are taken as whole zone slices,
+    stars of border and global zones are tested against the search cap. zones_loaded counts zones read from
+    data files by the selection (zone cache misses).
+    """
+    inside_zones: int = 0
+    border_zones: int = 0
+    global_zones: int = 0
+    zones_loaded: int = 0
+    inside_stars: int = 0
+    border_stars: int = 0
+    global_stars: int = 0
+
+    @property
+    def stars(self):
+        return self.inside_stars + self.border_stars + self.global_stars
+
+    def add(self, other):
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+
 class GeodesicStarGaiaCatalog():
     """
     Star catalog composed of GeodesicStarGaiaCatalogComponent. Each component represents one level of Geodesic tree.
     """
     # @profile
-    def __init__(self, data_dir, extra_data_dir):
+    def __init__(self, data_dir, extra_data_dir, use_mmap=False, cache_dir=None):
+        """
+        :param use_mmap: memory map catalog files, converted stars are stored in cache_dir and memory mapped too,
+                         so they are shared by all processes using the catalog
+        :param cache_dir: directory of converted star cache
+        """
         # tm = time()
+        self._use_mmap = use_mmap
+        self._cache_dir = cache_dir
         self._cat_components = []
         max_file_num = 8
         for i in range(max_file_num+1):
@@ -553,66 +835,94 @@ class GeodesicStarGaiaCatalog():
             self._cat_components.append(cat_comp)
 
         self._max_geodesic_grid_level = self._cat_components[-1].level
-        self._geodesic_grid = GeodesicGrid(self._max_geodesic_grid_level)
-        self._geodesic_grid.visit_triangles(self._max_geodesic_grid_level, self.init_triangle)
-        self._thread_local = threading.local()
+        self._geodesic_grid = GeodesicGrid(self._max_geodesic_grid_level, cache_dir)
+        for cat_comp in self._cat_components:
+            cat_comp.triangle_size = self._geodesic_grid.triangle_sizes[cat_comp.level]
+        # use asin() since it is chord on sphere
+        self._lev_triangle_radius = [2 * math.asin(TRIANGLE_CENTER_FACTOR * cat_comp.triangle_size)
+                                     for cat_comp in self._cat_components]
+        self._zone_query_cache = OrderedDict()
+        self._zone_query_cache_size = ZONE_QUERY_CACHE_SIZE
+        self._zone_query_lock = threading.Lock()
+        self._zone_query_hits = 0
+        self._zone_query_misses = 0
+        self._selection_stats = StarSelectionStats()
 
         if len(self._cat_components) > 0:
             self._cat_components[0].load_static_stars()
 
         # print("#################### Geodesic star catalog within {} s".format(str(time()-tm)), flush=True)
 
-    def _get_thread_search_result(self):
-        search_result = getattr(self._thread_local, 'search_result', None)
-        if search_result is None or search_result.max_level != self._max_geodesic_grid_level:
-            search_result = GeodesicSearchResult(self._max_geodesic_grid_level)
-            self._thread_local.search_result = search_result
-        else:
-            search_result.reset()
-        return search_result
-
     def _load_gsc_component(self, data_dir, file_regex):
         files = glob.glob(os.path.join(data_dir, file_regex))
         if len(files) > 0:
-            cat_comp = GeodesicStarGaiaCatalogComponent(files[0])
+            cat_comp = GeodesicStarGaiaCatalogComponent(files[0], self._use_mmap, self._cache_dir)
             if cat_comp.load_data_file():
                 return cat_comp
         return None
 
-    def _select_stars_from_zones(self, iterator, lev, lm_stars, field_rect3, cos_radius):
-        stars = []
-        zone = iterator.next()
-        while zone != -1:
-            zone_stars = self._cat_components[lev].get_zone_stars(zone)
-            # print('Level={} Zone={} Len={}'.format(lev, zone, len(zone_stars)))
-            selected_zone_stars = self._select_stars_from_zone(zone_stars, lm_stars, field_rect3, cos_radius)
-            if selected_zone_stars is not None:
-                stars.append(selected_zone_stars)
-            zone = iterator.next()
-        return stars
+    def _zone_slices(self, zones, cat_comp, lm_stars, field_rect3, cos_radius, epoch, whole_zones, stats):
+        """
+        Returns list of (zone_stars, n, mask, count) of zones with selected stars. Stars brighter than lm_stars are
+        zone_stars[:n], mask selects stars within search cap among them or is None if all n stars are selected
+        (whole_zones). If epoch is (epoch_key, transform), zone_stars are propagated to epoch, otherwise they are
+        rect stars in catalog epoch. Zones read from data files are counted in stats.
+        """
+        zone_slices = []
+        for zone in zones:
+            zone_stars = cat_comp.get_zone_stars(zone, stats)
+            if whole_zones:
+                mask = None
+                n = count = _bright_count(zone_stars, lm_stars)
+                if n == 0:
+                    continue
+            else:
+                mask = self._zone_selection_mask(zone_stars, lm_stars, field_rect3, cos_radius)
+                if mask is None:
+                    continue
+                n = len(mask)
+                count = int(np.count_nonzero(mask))
+            if epoch is not None:
+                zone_stars = cat_comp.get_epoch_zone_stars(zone, *epoch)
+            zone_slices.append((zone_stars, n, mask, count))
+        return zone_slices
+
+    def _zone_selection_mask(self, zone_stars, lm_stars, field_rect3, cos_radius):
+        """
+        Returns mask of stars within search cap among zone stars brighter than lm_stars (see _bright_count())
+        or None if no star is selected.
+        """
+        n = _bright_count(zone_stars, lm_stars)
+        if n > 0:
+            bright_stars = zone_stars[:n]
+            scal_dot = bright_stars['x'] * field_rect3[0] + bright_stars['y'] * field_rect3[1] + bright_stars['z'] * field_rect3[2]
+            mask = scal_dot > cos_radius
+            if mask.any():
+                return mask
+        return None
 
     def _select_stars_from_zone(self, zone_stars, lm_stars, field_rect3, cos_radius):
-        if len(zone_stars) > 0:
-            mag = zone_stars['mag']
-            scal_dot = zone_stars['x'] * field_rect3[0] + zone_stars['y'] * field_rect3[1] + zone_stars['z'] * field_rect3[2]
-            zone_stars = zone_stars[np.logical_and(mag <= lm_stars, scal_dot > cos_radius)]
-            if len(zone_stars) > 0:
-                return zone_stars
-        return None
+        mask = self._zone_selection_mask(zone_stars, lm_stars, field_rect3, cos_radius)
+        return zone_stars[:len(mask)][mask] if mask is not None else None
 
-    def _select_stars_from_zone_mag(self, zone_stars, lm_stars):
-        if len(zone_stars) == 0:
-            return []
-        mag = zone_stars['mag']
-        return zone_stars[mag <= lm_stars]
+    def _get_epoch(self, cat_comp, precession_matrix, jd):
+        """
+        Returns (epoch_key, transform) for propagation of zone stars to jd or None if jd is not specified.
+        Proper motion and precession are combined into one 6x3 matrix [[P], [years*P]].
+        """
+        if jd is None:
+            return None
+        transform = precession_matrix if precession_matrix is not None else np.identity(3)
+        if cat_comp.has_proper_motion:
+            years = (jd - cat_comp.epoch_jd) / DAYS_PER_JULIAN_YEAR
+            transform = np.vstack((transform, transform * years))
+        # proper motion and precession within one day are far below drawing resolution
+        return int(round(jd)), transform
 
     @property
     def max_geodesic_grid_level(self):
         return self._max_geodesic_grid_level
 
-    def init_triangle(self, lev, index, c0, c1, c2):
-        self._cat_components[lev].init_triangle(index, c0, c1, c2)
-
     def _max_search_level(self, lm_stars):
         max_search_level = -1
         for cat_comp in self._cat_components:
@@ -621,36 +931,85 @@ class GeodesicStarGaiaCatalog():
             max_search_level += 1
         return max_search_level
 
-    def _build_search_caps(self, field_rect3, radius, max_search_level):
-        lev_spherical_caps = []
-        for lev in range(max_search_level + 1):
-            radius_inner = radius
-            # use asin() since it is chord on sphere
-            triangle_radius = 2 * math.asin(TRIANGLE_CENTER_FACTOR * self._cat_components[lev].triangle_size)
-            radius_outer = triangle_radius + radius
-            lev_spherical_caps.append(SphericalCap(field_rect3, math.cos(radius_inner), math.cos(radius_outer)))
-        return lev_spherical_caps
+    @staticmethod
+    def _zone_query_key(field_rect3, radius, max_search_level):
+        return (round(field_rect3[0] / ZONE_QUERY_RESOLUTION), round(field_rect3[1] / ZONE_QUERY_RESOLUTION),
+                round(field_rect3[2] / ZONE_QUERY_RESOLUTION), round(radius / ZONE_QUERY_RESOLUTION), max_search_level)
+
+    def _get_cached_zone_query(self, key):
+        with self._zone_query_lock:
+            query_result = self._zone_query_cache.get(key)
+            if query_result is not None:
+                self._zone_query_cache.move_to_end(key)
+                self._zone_query_hits += 1
+                return query_result
+            self._zone_query_misses += 1
+        return None
+
+    def _put_cached_zone_query(self, key, query_result):
+        with self._zone_query_lock:
+            self._zone_query_cache[key] = query_result
+            if len(self._zone_query_cache) > self._zone_query_cache_size:
+                self._zone_query_cache.popitem(last=False)
+
+    def _search_zones(self, keys, max_search_level):
+        """
+        Search zones of quantized queries in one pass over geodesic grid.
+        """
+        view_dirs = np.array([key[:3] for key in keys], dtype=np.float64) * ZONE_QUERY_RESOLUTION
+        view_dirs /= np.linalg.norm(view_dirs, axis=1)[:, np.newaxis]
+        q_radius = np.array([key[3] for key in keys], dtype=np.float64) * ZONE_QUERY_RESOLUTION
+        lev_triangle_radius = np.array(self._lev_triangle_radius[:max_search_level + 1])
+        lev_outer_view_cos = np.cos(lev_triangle_radius + q_radius[:, np.newaxis])
+        return self._geodesic_grid.search_zones_batch(view_dirs, np.cos(q_radius), lev_outer_view_cos, max_search_level)
+
+    def _query_zones(self, field_rect3, radius, max_search_level):
+        """
+        Zones of search cap, memoized by quantized (center, radius, max_search_level). Search runs on the quantized
+        center and radius, so the result does not depend on the order of queries.
+        """
+        key = self._zone_query_key(field_rect3, radius, max_search_level)
+        query_result = self._get_cached_zone_query(key)
+        if query_result is None:
+            query_result = self._search_zones([key], max_search_level)[0]
+            self._put_cached_zone_query(key, query_result)
+        return query_result
+
+    def query_zones_batch(self, field_centers, radius, lm_stars):
+        """
+        Search zones of many fields (e.g. all pages of atlas) in one pass and store them in zone query cache,
+        so following select_stars() calls with the same field and radius skip the search. The cache grows to keep
+        all results of the batch besides ZONE_QUERY_CACHE_SIZE other queries.
+
+        :param field_centers: sequence of (ra, dec)
+        :param radius: field radius, scalar or sequence
+        :return: list of GeodesicZoneQueryResult or None if no catalog level is searched
+        """
+        max_search_level = self._max_search_level(lm_stars)
+        if max_search_level < 0:
+            return None
+        radii = np.broadcast_to(np.asarray(radius, dtype=np.float64), (len(field_centers),)).tolist()
+        keys = [self._zone_query_key(sphere_to_rect(ra, dec), r, max_search_level)
+                for (ra, dec), r in zip(field_centers, radii)]
+        with self._zone_query_lock:
+            self._zone_query_cache_size = max(self._zone_query_cache_size, len(set(keys)) + ZONE_QUERY_CACHE_SIZE)
+        results = [self._get_cached_zone_query(key) for key in keys]
+        missing = [i for i, query_result in enumerate(results) if query_result is None]
+        if missing:
+            for i, query_result in zip(missing, self._search_zones([keys[i] for i in missing], max_search_level)):
+                results[i] = query_result
+                self._put_cached_zone_query(keys[i], query_result)
+        return results
+
+    def zone_query_stats(self):
+        with self._zone_query_lock:
+            return {'hits': self._zone_query_hits, 'misses': self._zone_query_misses,
+                    'entries': len(self._zone_query_cache)}
 
     def _rect_to_eq_stars(self, rect_stars, precession_matrix):
         if rect_stars is None or len(rect_stars) == 0:
             return None
-        if precession_matrix is not None:
-            mat_rect_stars = np.column_stack((rect_stars['x'], rect_stars['y'], rect_stars['z']))
-            mat_rect_stars = np.matmul(mat_rect_stars, precession_matrix)
-        else:
-            mat_rect_stars = np.column_stack((rect_stars['x'], rect_stars['y'], rect_stars['z']))
-
-        return np.core.records.fromarrays(
-            [
-                mat_rect_stars[:, 0],  # x
-                mat_rect_stars[:, 1],  # y
-                mat_rect_stars[:, 2],  # z
-                rect_stars['mag'],
-                rect_stars['bvind'],
-                rect_stars['hip'],
-            ],
-            dtype=D3_ZONE_STARDATA_DT
-        )
+        return _transform_zone_stars(rect_stars, precession_matrix)
 
     def select_star_zones(self, field_center, radius, lm_stars):
         max_search_level = self._max_search_level(lm_stars)
@@ -659,31 +1018,22 @@ class GeodesicStarGaiaCatalog():
 
         field_rect3 = sphere_to_rect(field_center[0], field_center[1])
         cos_radius = math.cos(radius)
-        lev_spherical_caps = self._build_search_caps(field_rect3, radius, max_search_level)
-
-        search_result = self._get_thread_search_result()
-        self._geodesic_grid.search_zones(lev_spherical_caps, search_result, max_search_level)
+        query_result = self._query_zones(field_rect3, radius, max_search_level)
 
         zones = []
         seen = set()
         for lev in range(max_search_level + 1):
-            inside_iterator = GeodesicSearchInsideIterator(search_result, lev)
-            zone = inside_iterator.next()
-            while zone != -1:
-                key = (lev, int(zone))
+            for zone in query_result.inside_zones[lev].tolist():
+                key = (lev, zone)
                 if key not in seen:
-                    zones.append(StarZoneRef(level=lev, zone=int(zone), kind="inside"))
+                    zones.append(StarZoneRef(level=lev, zone=zone, kind="inside"))
                     seen.add(key)
-                zone = inside_iterator.next()
 
-            border_iterator = GeodesicSearchBorderIterator(search_result, lev)
-            zone = border_iterator.next()
-            while zone != -1:
-                key = (lev, int(zone))
+            for zone in query_result.border_zones[lev].tolist():
+                key = (lev, zone)
                 if key not in seen:
-                    zones.append(StarZoneRef(level=lev, zone=int(zone), kind="border"))
+                    zones.append(StarZoneRef(level=lev, zone=zone, kind="border"))
                     seen.add(key)
-                zone = border_iterator.next()
 
             global_zone = GeodesicGrid.nr_of_zones(lev)
             global_zone_stars = self._cat_components[lev].get_zone_stars(global_zone)
@@ -696,23 +1046,33 @@ class GeodesicStarGaiaCatalog():
         zones.sort(key=lambda z: (z.level, z.zone))
         return [{"level": z.level, "zone": z.zone, "kind": z.kind} for z in zones]
 
-    def select_zone_stars(self, level, zone, precession_matrix):
+    def select_zone_stars(self, level, zone, precession_matrix, jd=None):
         if level < 0 or level >= len(self._cat_components):
             return None
         max_zone = GeodesicGrid.nr_of_zones(level)
         if zone < 0 or zone > max_zone:
             return None
 
-        zone_stars = self._cat_components[level].get_zone_stars(zone)
-        return self._rect_to_eq_stars(zone_stars, precession_matrix)
+        cat_comp = self._cat_components[level]
+        epoch = self._get_epoch(cat_comp, precession_matrix, jd)
+        if epoch is not None:
+            return cat_comp.get_epoch_zone_stars(zone, *epoch)
+        return self._rect_to_eq_stars(cat_comp.get_zone_stars(zone), precession_matrix)
 
-    def select_stars(self, field_center, radius, lm_stars, precession_matrix):
+    def select_stars(self, field_center, radius, lm_stars, precession_matrix, jd=None, stats=None):
         """
         Return an array containing of items [[ra, dec, mag], [ra, dec, mag]...]
         for all stars in the field centered around field center with given radius,
         field center and radius.
+
+        If jd is specified, stars are propagated by proper motion to jd. Propagated and precessed zones
+        are cached per day of jd, so precession_matrix must correspond to jd.
+
+        Returned stars are sorted by magnitude. If stats (StarSelectionStats) is specified, counts of zones
+        and stars of this selection are added to it.
         """
-        tmp_arr = []
+        sel_stats = StarSelectionStats()
+        lev_slices = []
 
         max_search_level = self._max_search_level(lm_stars)
 
@@ -720,44 +1080,130 @@ class GeodesicStarGaiaCatalog():
             field_rect3 = sphere_to_rect(field_center[0], field_center[1])
 
             cos_radius = math.cos(radius)
-            lev_spherical_caps = self._build_search_caps(field_rect3, radius, max_search_level)
-
-            search_result = self._get_thread_search_result()
-            self._geodesic_grid.search_zones(lev_spherical_caps, search_result, max_search_level)
+            # triangle with all corners in cap is within cap only if the cap is convex (radius < 90deg)
+            whole_inside = cos_radius > 0
+            query_result = self._query_zones(field_rect3, radius, max_search_level)
 
             for lev in range(max_search_level + 1):
-                # print('Inside iterator')
-                inside_iterator = GeodesicSearchInsideIterator(search_result, lev)
-                stars = self._select_stars_from_zones(inside_iterator, lev, lm_stars, field_rect3, cos_radius)
-                if len(stars) > 0:
-                    tmp_arr.extend(stars)
-
-                # print('Border iterator')
-                border_iterator = GeodesicSearchBorderIterator(search_result, lev)
-                stars = self._select_stars_from_zones(border_iterator, lev, lm_stars, field_rect3, cos_radius)
-                if len(stars) > 0:
-                    tmp_arr.extend(stars)
-
-                glob_zone_stars = self._cat_components[lev].get_zone_stars(GeodesicGrid.nr_of_zones(lev))
-                sel_glob_zone_stars = self._select_stars_from_zone(glob_zone_stars, lm_stars, field_rect3, cos_radius)
-                if sel_glob_zone_stars is not None:
-                    tmp_arr.append(sel_glob_zone_stars)
-
-        rect_stars = np.concatenate(tmp_arr, axis=0) if len(tmp_arr) > 0 else None
-        return self._rect_to_eq_stars(rect_stars, precession_matrix)
+                cat_comp = self._cat_components[lev]
+                epoch = self._get_epoch(cat_comp, precession_matrix, jd)
+
+                inside_zones = query_result.inside_zones[lev].tolist()
+                border_zones = query_result.border_zones[lev].tolist()
+                inside = self._zone_slices(inside_zones, cat_comp, lm_stars, field_rect3, cos_radius, epoch,
+                                           whole_inside, sel_stats)
+                border = self._zone_slices(border_zones, cat_comp, lm_stars, field_rect3, cos_radius, epoch, False,
+                                           sel_stats)
+                global_slices = self._zone_slices((GeodesicGrid.nr_of_zones(lev),), cat_comp, lm_stars, field_rect3,
+                                                  cos_radius, epoch, False, sel_stats)
+
+                sel_stats.inside_zones += len(inside_zones)
+                sel_stats.border_zones += len(border_zones)
+                sel_stats.global_zones += 1
+                sel_stats.inside_stars += sum(zone_slice[3] for zone_slice in inside)
+                sel_stats.border_stars += sum(zone_slice[3] for zone_slice in border)
+                sel_stats.global_stars += sum(zone_slice[3] for zone_slice in global_slices)
+                lev_slices.append((inside + border + global_slices, epoch))
+
+        with self._zone_query_lock:
+            self._selection_stats.add(sel_stats)
+        if stats is not None:
+            stats.add(sel_stats)
+
+        if sel_stats.stars == 0:
+            return None
+
+        stars = np.empty(sel_stats.stars, dtype=D3_ZONE_STARDATA_DT)
+        pos = 0
+        for zone_slices, epoch in lev_slices:
+            if epoch is not None:
+                pos = _gather_zone_stars(stars, pos, zone_slices)
+            elif len(zone_slices) > 0:
+                # levels may differ in record dtype, transform them separately
+                rect_stars = np.empty(sum(zone_slice[3] for zone_slice in zone_slices), dtype=zone_slices[0][0].dtype)
+                _gather_zone_stars(rect_stars, 0, zone_slices)
+                _transform_zone_stars(rect_stars, precession_matrix, out=stars[pos:pos + len(rect_stars)])
+                pos += len(rect_stars)
+
+        # stars are in order of levels and zones, stars of equal magnitude keep it
+        return _sort_by_mag(stars)
+
+    def selection_stats(self):
+        """
+        Returns StarSelectionStats accumulated over all select_stars() calls
+        """
+        stats = StarSelectionStats()
+        with self._zone_query_lock:
+            stats.add(self._selection_stats)
+        return stats
+
+    def reopen_data_files(self):
+        """
+        Reopen catalog files after fork(), child processes must not share file offsets.
+        """
+        for cat_comp in self._cat_components:
+            cat_comp.reopen_data_file()
+        self._zone_query_lock = threading.Lock()
 
     def free_mem(self):
         for cat_comp in self._cat_components:
             if cat_comp.level > 0:
                 cat_comp.free_mem()
 
+    def set_zone_cache_policy(self, max_bytes=None, policy=ZoneCachePolicy.LRU, levels=None):
+        """
+        Set byte budget and eviction policy of zone cache of each component in levels (default: all levels > 0).
+        """
+        for cat_comp in self._cat_components:
+            if (levels is None and cat_comp.level > 0) or (levels is not None and cat_comp.level in levels):
+                cat_comp.set_cache_policy(max_bytes, policy)
+
+    def zone_cache_stats(self):
+        """
+        Returns dict level -> ZoneCacheStats
+        """
+        return {cat_comp.level: cat_comp.cache_stats() for cat_comp in self._cat_components}
+
+    def epoch_cache_stats(self):
+        """
+        Returns dict level -> ZoneCacheStats of zones propagated to epoch
+        """
+        return {cat_comp.level: cat_comp.epoch_cache_stats() for cat_comp in self._cat_components}
+
+    def benchmark_conversion(self, repeat=3):
+        """
+        Returns list of (level, number of stars, best decoding time in seconds) for each catalog component.
+        """
+        return [(cat_comp.level, cat_comp.nr_of_stars, cat_comp.benchmark_conversion(repeat))
+                for cat_comp in self._cat_components]
+
     def get_star_color(self, star):
         return COLOR_TABLE[star['bvind']]
 
+    def get_star_colors(self, stars):
+        """
+        Returns (n, 3) array of rgb colors of stars
+        """
+        return COLOR_TABLE_ARRAY[stars['bvind']]
+
 
 if __name__ == '__main__':
-    data_dir='./data/catalogs/'
-    tm = time()
-    cat = GeodesicStarGaiaCatalog(data_dir, None)
-    print("Loaded in : " + str(time()-tm) + "ms")
-    print("Done")
+    import argparse
+    from . import get_catalogs_dir
+
+    parser = argparse.ArgumentParser(description='Star catalog decoding benchmark')
+    parser.add_argument('data_dir', nargs='?', default=get_catalogs_dir())
+    parser.add_argument('--extra-data-dir', default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-rate', type=float, default=0.0, help='fail if any level decodes less stars/s')
+    args = parser.parse_args()
+
+    tm = perf_counter()
+    cat = GeodesicStarGaiaCatalog(args.data_dir, args.extra_data_dir)
+    print('Loaded in : {:.3f} s'.format(perf_counter()-tm))
+    failed = False
+    for level, nr_of_stars, elapsed in cat.benchmark_conversion(args.repeat):
+        rate = nr_of_stars / elapsed if elapsed > 0 else float('inf')
+        print('level {}: {} stars, {:.1f} ms, {:.0f} stars/s'.format(level, nr_of_stars, elapsed * 1000.0, rate))
+        failed = failed or rate < args.min_rate
+    sys.exit(1 if failed else 0)
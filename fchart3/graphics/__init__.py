@@ -15,8 +15,24 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import importlib
+
 from .graphics_interface import *
-from .graphics_cairo import CairoDrawing
-# from .graphics_skia import SkiaDrawing
-from .graphics_tikz import TikZDrawing
 from .mirroring_graphics import MirroringGraphics
+from .display_list import DisplayList, DisplayListGraphics
+
+# back-ends are imported on first use, importing cairo/skia costs more than the rest of fchart3
+_BACKENDS = {
+    'CairoDrawing': '.graphics_cairo',
+    'SkiaDrawing': '.graphics_skia',
+    'TikZDrawing': '.graphics_tikz',
+}
+
+
+def __getattr__(name):
+    module_name = _BACKENDS.get(name)
+    if module_name is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    backend = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = backend
+    return backend
@@ -0,0 +1,476 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Retained display list. DisplayListGraphics records draw calls of make_map() into DisplayList, which can be
+replayed to CairoDrawing, SkiaDrawing or TikZDrawing and saved to / loaded from npz file.
+
+Display list is kept in three flat arrays: opcodes (uint8), float arguments (float64) consumed by opcodes
+in order and strings (texts and font names, each distinct string stored once). Pen, fill, line width, dash
+and font changes which do not change the current state are not recorded (state is considered unknown
+after restore()).
+"""
+
+from array import array
+from enum import IntEnum
+
+import numpy as np
+
+from .graphics_interface import *
+
+DISPLAY_LIST_VERSION = 1
+
+DPI_IMG = 100.0
+DPMM_IMG = DPI_IMG/INCH
+
+# label width estimate in font size units if DisplayListGraphics has no metrics graphics
+TEXT_WIDTH_ESTIMATE = 0.5
+
+_UNKNOWN = object()
+
+
+class Op(IntEnum):
+    NEW = 1
+    FINISH = 2
+    CLEAR = 3
+    SET_BACKGROUND_RGB = 4
+    SET_LINEWIDTH = 5
+    SET_PEN_RGB = 6
+    SET_FILL_RGB = 7
+    SET_FILL_BACKGROUND = 8
+    SET_SOLID_LINE = 9
+    SET_DASHED_LINE = 10
+    SET_FONT = 11
+    SET_DEFAULT_FONT_SIZE = 12
+    SAVE = 13
+    RESTORE = 14
+    TRANSLATE = 15
+    ROTATE = 16
+    LINE = 17
+    RECTANGLE = 18
+    CIRCLE = 19
+    CIRCLES = 20
+    POLYGON = 21
+    POLYGONS_INDEXED = 22
+    POLYLINE = 23
+    ELLIPSE = 24
+    TEXT_RIGHT = 25
+    TEXT_LEFT = 26
+    TEXT_CENTRED = 27
+    BEGIN_PATH = 28
+    MOVE_TO = 29
+    ARC_TO = 30
+    ELLIPTIC_ARC_TO = 31
+    LINE_TO = 32
+    COMPLETE_PATH = 33
+    CLIP_PATH = 34
+    RESET_CLIP = 35
+    ANTIALIAS_ON = 36
+    ANTIALIAS_OFF = 37
+
+
+_DRAW_MODES = {mode.value: mode for mode in DrawMode}
+_FONT_STYLES = {style.value: style for style in FontStyle}
+
+# opcodes with fixed number of float arguments and no strings, replayed by calling method with the arguments
+_SIMPLE_OPS = {
+    Op.NEW: ('new', 0),
+    Op.FINISH: ('finish', 0),
+    Op.CLEAR: ('clear', 0),
+    Op.SET_LINEWIDTH: ('set_linewidth', 1),
+    Op.SET_FILL_BACKGROUND: ('set_fill_background', 0),
+    Op.SET_SOLID_LINE: ('set_solid_line', 0),
+    Op.SET_DASHED_LINE: ('set_dashed_line', 3),
+    Op.SET_DEFAULT_FONT_SIZE: ('set_default_font_size', 1),
+    Op.SAVE: ('save', 0),
+    Op.RESTORE: ('restore', 0),
+    Op.TRANSLATE: ('translate', 2),
+    Op.ROTATE: ('rotate', 1),
+    Op.LINE: ('line', 4),
+    Op.BEGIN_PATH: ('begin_path', 0),
+    Op.MOVE_TO: ('move_to', 2),
+    Op.ARC_TO: ('arc_to', 5),
+    Op.ELLIPTIC_ARC_TO: ('elliptic_arc_to', 6),
+    Op.LINE_TO: ('line_to', 2),
+    Op.RESET_CLIP: ('reset_clip', 0),
+    Op.ANTIALIAS_ON: ('antialias_on', 0),
+    Op.ANTIALIAS_OFF: ('antialias_off', 0),
+}
+
+# opcodes with fixed number of float arguments, last one is DrawMode
+_MODE_OPS = {
+    Op.RECTANGLE: ('rectangle', 4),
+    Op.CIRCLE: ('circle', 3),
+    Op.ELLIPSE: ('ellipse', 5),
+    Op.COMPLETE_PATH: ('complete_path', 0),
+}
+
+_TEXT_OPS = {
+    Op.TEXT_RIGHT: 'text_right',
+    Op.TEXT_LEFT: 'text_left',
+    Op.TEXT_CENTRED: 'text_centred',
+}
+
+
+class DisplayList:
+    """
+    Recorded draw calls of one drawing, see DisplayListGraphics.
+    """
+    def __init__(self, width, height, ops, floats, strings):
+        """
+        :param width: width of drawing in mm
+        :param height: height of drawing in mm
+        :param ops: uint8 array of Op values
+        :param floats: float64 array of arguments of ops
+        :param strings: list of strings referenced by index from floats
+        """
+        self.width = width
+        self.height = height
+        self.ops = np.asarray(ops, dtype=np.uint8)
+        self.floats = np.asarray(floats, dtype=np.float64)
+        self.strings = list(strings)
+
+    def __len__(self):
+        return len(self.ops)
+
+    @property
+    def nbytes(self):
+        return self.ops.nbytes + self.floats.nbytes + sum(len(s) for s in self.strings)
+
+    def replay(self, gfx):
+        """
+        Replay recorded draw calls to graphics of the same width and height (in mm). Graphics is created
+        by new() and finished by finish() if they were called during recording.
+        """
+        floats = self.floats.tolist()
+        strings = self.strings
+        pos = 0
+        for op in self.ops.tolist():
+            simple_op = _SIMPLE_OPS.get(op)
+            if simple_op is not None:
+                method_name, nargs = simple_op
+                getattr(gfx, method_name)(*floats[pos:pos+nargs])
+                pos += nargs
+            elif op in _MODE_OPS:
+                method_name, nargs = _MODE_OPS[op]
+                getattr(gfx, method_name)(*floats[pos:pos+nargs], _DRAW_MODES[int(floats[pos+nargs])])
+                pos += nargs + 1
+            elif op in _TEXT_OPS:
+                getattr(gfx, _TEXT_OPS[op])(floats[pos], floats[pos+1], strings[int(floats[pos+2])])
+                pos += 3
+            elif op == Op.SET_PEN_RGB:
+                gfx.set_pen_rgb(tuple(floats[pos:pos+3]))
+                pos += 3
+            elif op == Op.SET_FILL_RGB:
+                gfx.set_fill_rgb(tuple(floats[pos:pos+3]))
+                pos += 3
+            elif op == Op.SET_BACKGROUND_RGB:
+                has_rgb = floats[pos] > 0
+                gfx.set_background_rgb(tuple(floats[pos+1:pos+4]) if has_rgb else None)
+                pos += 4
+            elif op == Op.SET_FONT:
+                gfx.set_font(strings[int(floats[pos])], floats[pos+1], _FONT_STYLES[int(floats[pos+2])])
+                pos += 3
+            elif op == Op.CIRCLES:
+                n = int(floats[pos])
+                has_colors = floats[pos+1] > 0
+                mode = _DRAW_MODES[int(floats[pos+2])]
+                pos += 3
+                x, y, r = (self.floats[pos:pos+n], self.floats[pos+n:pos+2*n], self.floats[pos+2*n:pos+3*n])
+                pos += 3*n
+                colors = None
+                if has_colors:
+                    colors = self.floats[pos:pos+3*n].reshape(n, 3)
+                    pos += 3*n
+                gfx.circles(x, y, r, colors, mode)
+            elif op in (Op.POLYGON, Op.POLYLINE, Op.CLIP_PATH):
+                n = int(floats[pos])
+                vertices = [floats[i:i+2] for i in range(pos+1, pos+1+2*n, 2)]
+                pos += 1 + 2*n
+                if op == Op.POLYGON:
+                    gfx.polygon(vertices, _DRAW_MODES[int(floats[pos])])
+                    pos += 1
+                elif op == Op.POLYLINE:
+                    gfx.polyline(vertices)
+                else:
+                    gfx.clip_path(vertices)
+            elif op == Op.POLYGONS_INDEXED:
+                nverts, npolys, nindexes = int(floats[pos]), int(floats[pos+1]), int(floats[pos+2])
+                pos += 3
+                x, y = self.floats[pos:pos+nverts], self.floats[pos+nverts:pos+2*nverts]
+                pos += 2*nverts
+                offsets = self.floats[pos:pos+npolys+1].astype(np.int64)
+                pos += npolys + 1
+                indexes = self.floats[pos:pos+nindexes].astype(np.int64).tolist()
+                pos += nindexes
+                polygons = [indexes[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+                gfx.polygons_indexed(x, y, polygons, _DRAW_MODES[int(floats[pos])])
+                pos += 1
+            else:
+                raise ValueError('Unknown display list opcode {}'.format(op))
+
+    def save(self, fobj):
+        """
+        Save display list to npz file (file name or binary file object).
+        """
+        np.savez_compressed(fobj, version=np.array(DISPLAY_LIST_VERSION), size=np.array([self.width, self.height]),
+                            ops=self.ops, floats=self.floats, strings=np.array(self.strings, dtype=str))
+
+    @classmethod
+    def load(cls, fobj):
+        """
+        Load display list saved by save().
+        """
+        with np.load(fobj, allow_pickle=False) as data:
+            if int(data['version']) != DISPLAY_LIST_VERSION:
+                raise ValueError('Unsupported display list version {}'.format(int(data['version'])))
+            width, height = data['size'].tolist()
+            return cls(width, height, data['ops'], data['floats'], data['strings'].tolist())
+
+
+class DisplayListGraphics(GraphicsInterface):
+    """
+    GraphicsInterface recording draw calls into DisplayList. Text width is measured by metrics graphics
+    (e.g. in-memory SkiaDrawing or CairoDrawing of the same size), replay to another back-end can then
+    differ only in label placement. Without metrics graphics, text width is estimated from font size.
+    """
+    def __init__(self, width, height, metrics=None):
+        """
+        :param width: width in mm
+        :param height: height in mm
+        :param metrics: graphics used for text_width(), None means estimate
+        """
+        super().__init__(width, height)
+        self.metrics = metrics
+        self._ops = array('B')
+        self._floats = array('d')
+        self._strings = []
+        self._string_indexes = {}
+        self._state = {}
+
+    def display_list(self):
+        """
+        Returns DisplayList of recorded draw calls.
+        """
+        return DisplayList(self.gi_width, self.gi_height, np.frombuffer(self._ops, dtype=np.uint8).copy(),
+                           np.frombuffer(self._floats, dtype=np.float64).copy(), self._strings)
+
+    def _op(self, op, *args):
+        self._ops.append(op)
+        self._floats.extend(args)
+
+    def _string_index(self, s):
+        index = self._string_indexes.get(s)
+        if index is None:
+            index = len(self._strings)
+            self._strings.append(s)
+            self._string_indexes[s] = index
+        return index
+
+    def _state_changed(self, key, value):
+        """
+        True if value differs from recorded state, records new state.
+        """
+        if self._state.get(key, _UNKNOWN) == value:
+            return False
+        self._state[key] = value
+        return True
+
+    def new(self):
+        super().new()
+        # back-ends reset font and line width in new()
+        self._state.clear()
+        self._op(Op.NEW)
+        if self.metrics is not None:
+            self.metrics.new()
+
+    def finish(self):
+        self._op(Op.FINISH)
+
+    def clear(self):
+        self._op(Op.CLEAR)
+
+    def set_background_rgb(self, background_rgb):
+        super().set_background_rgb(background_rgb)
+        if background_rgb is None:
+            self._op(Op.SET_BACKGROUND_RGB, 0.0, 0.0, 0.0, 0.0)
+        else:
+            self._op(Op.SET_BACKGROUND_RGB, 1.0, *background_rgb)
+
+    def save(self):
+        super().save()
+        self._op(Op.SAVE)
+
+    def restore(self):
+        super().restore()
+        # back-ends do not restore all their state (e.g. stroke width of Skia paints), record next changes
+        self._state.clear()
+        self._op(Op.RESTORE)
+
+    def set_linewidth(self, linewidth):
+        super().set_linewidth(linewidth)
+        if self._state_changed('linewidth', float(linewidth)):
+            self._op(Op.SET_LINEWIDTH, linewidth)
+
+    def set_pen_rgb(self, pen_rgb):
+        super().set_pen_rgb(pen_rgb)
+        rgb = tuple(float(c) for c in pen_rgb[:3])
+        if self._state_changed('pen', rgb):
+            self._op(Op.SET_PEN_RGB, *rgb)
+
+    def set_fill_rgb(self, fill_rgb):
+        super().set_fill_rgb(fill_rgb)
+        rgb = tuple(float(c) for c in fill_rgb[:3])
+        if self._state_changed('fill', rgb):
+            self._op(Op.SET_FILL_RGB, *rgb)
+
+    def set_fill_background(self):
+        super().set_fill_background()
+        self._state.pop('fill', None)
+        self._op(Op.SET_FILL_BACKGROUND)
+
+    def set_solid_line(self):
+        super().set_solid_line()
+        if self._state_changed('dash', None):
+            self._op(Op.SET_SOLID_LINE)
+
+    def set_dashed_line(self, on, off, start=0.0):
+        super().set_dashed_line(on, off, start)
+        if self._state_changed('dash', (float(on), float(off), float(start))):
+            self._op(Op.SET_DASHED_LINE, on, off, start)
+
+    def set_font(self, font='Times-Roman', font_size=None, font_style=FontStyle.NORMAL):
+        super().set_font(font, font_size, font_style)
+        if self.metrics is not None:
+            self.metrics.set_font(font, self.gi_font_size, font_style)
+        font_state = (str(font), float(self.gi_font_size), font_style.value)
+        if self._state_changed('font', font_state):
+            self._op(Op.SET_FONT, self._string_index(font_state[0]), font_state[1], font_state[2])
+
+    def set_default_font_size(self, default_font_size):
+        super().set_default_font_size(default_font_size)
+        self._op(Op.SET_DEFAULT_FONT_SIZE, default_font_size)
+
+    def translate(self, dx, dy):
+        self._op(Op.TRANSLATE, dx, dy)
+
+    def rotate(self, angle):
+        self._op(Op.ROTATE, angle)
+
+    def line(self, x1, y1, x2, y2):
+        self._op(Op.LINE, x1, y1, x2, y2)
+
+    def rectangle(self, x, y, width, height, mode=DrawMode.BORDER):
+        self._op(Op.RECTANGLE, x, y, width, height, mode.value)
+
+    def circle(self, x, y, r, mode=DrawMode.BORDER):
+        self._op(Op.CIRCLE, x, y, r, mode.value)
+
+    def circles(self, x, y, r, colors=None, mode=DrawMode.FILL):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        r = np.asarray(r, dtype=np.float64)
+        if len(x) == 0:
+            return
+        self._op(Op.CIRCLES, len(x), 0.0 if colors is None else 1.0, mode.value)
+        self._floats.frombytes(x.tobytes())
+        self._floats.frombytes(y.tobytes())
+        self._floats.frombytes(r.tobytes())
+        if colors is not None:
+            self._floats.frombytes(np.asarray(colors, dtype=np.float64)[:, :3].tobytes())
+            # back-ends set pen/fill of each color bucket
+            self._state.pop('pen', None)
+            self._state.pop('fill', None)
+
+    def polygon(self, vertices, mode=DrawMode.BORDER):
+        self._op(Op.POLYGON, len(vertices))
+        self._floats.frombytes(np.asarray(vertices, dtype=np.float64).reshape(-1).tobytes())
+        self._floats.append(mode.value)
+
+    def polygons_indexed(self, x, y, polygons, mode=DrawMode.BORDER):
+        x = np.asarray(x, dtype=np.float64)
+        offsets = np.zeros(len(polygons) + 1, dtype=np.float64)
+        offsets[1:] = np.cumsum([len(polygon) for polygon in polygons])
+        self._op(Op.POLYGONS_INDEXED, len(x), len(polygons), offsets[-1])
+        self._floats.frombytes(x.tobytes())
+        self._floats.frombytes(np.asarray(y, dtype=np.float64).tobytes())
+        self._floats.frombytes(offsets.tobytes())
+        for polygon in polygons:
+            self._floats.extend(polygon)
+        self._floats.append(mode.value)
+
+    def polyline(self, vertices):
+        self._op(Op.POLYLINE, len(vertices))
+        self._floats.frombytes(np.asarray(vertices, dtype=np.float64).reshape(-1).tobytes())
+
+    def ellipse(self, x, y, rlong, rshort, position_angle, mode=DrawMode.BORDER):
+        self._op(Op.ELLIPSE, x, y, rlong, rshort, position_angle, mode.value)
+
+    def text_right(self, x, y, text):
+        self._op(Op.TEXT_RIGHT, x, y, self._string_index(text))
+
+    def text_left(self, x, y, text):
+        self._op(Op.TEXT_LEFT, x, y, self._string_index(text))
+
+    def text_centred(self, x, y, text):
+        self._op(Op.TEXT_CENTRED, x, y, self._string_index(text))
+
+    def text_width(self, text):
+        if self.metrics is not None:
+            return self.metrics.text_width(text)
+        return TEXT_WIDTH_ESTIMATE * self.gi_font_size * len(text)
+
+    def begin_path(self):
+        self._op(Op.BEGIN_PATH)
+
+    def move_to(self, x, y):
+        self._op(Op.MOVE_TO, x, y)
+
+    def arc_to(self, x, y, r, angle1, angle2):
+        self._op(Op.ARC_TO, x, y, r, angle1, angle2)
+
+    def elliptic_arc_to(self, x, y, rx, ry, angle1, angle2):
+        self._op(Op.ELLIPTIC_ARC_TO, x, y, rx, ry, angle1, angle2)
+
+    def line_to(self, x, y):
+        self._op(Op.LINE_TO, x, y)
+
+    def complete_path(self, mode=DrawMode.BORDER):
+        self._op(Op.COMPLETE_PATH, mode.value)
+
+    def clip_path(self, path):
+        self._op(Op.CLIP_PATH, len(path))
+        self._floats.frombytes(np.asarray(path, dtype=np.float64).reshape(-1).tobytes())
+
+    def reset_clip(self):
+        self._op(Op.RESET_CLIP)
+
+    def on_screen(self, x, y):
+        return x > -self.gi_width/2.0 and x < self.gi_width/2.0 and y > -self.gi_height/2.0 and y < self.gi_height/2.0
+
+    def to_pixel(self, x, y):
+        # same as raster back-ends
+        return int(x * DPMM_IMG + int(self.gi_width * DPMM_IMG)/2), int(y * DPMM_IMG + int(self.gi_height * DPMM_IMG)/2)
+
+    def antialias_on(self):
+        self._op(Op.ANTIALIAS_ON)
+
+    def antialias_off(self):
+        self._op(Op.ANTIALIAS_OFF)
+
+
+__all__ = ['DisplayList', 'DisplayListGraphics']
@@ -15,9 +15,11 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import io
 from math import pi
 
 import cairo
+import numpy as np
 import PIL.Image as Image
 
 from .graphics_interface import *
@@ -38,7 +40,7 @@ class CairoDrawing(GraphicsInterface):
     """
     def __init__(self, fobj, width, height, format='pdf', pixels=False, landscape=False, tolerance=None, jpg_quality=90, avif_quality=75, avif_speed=7):
         """
-        :param fobj: file object
+        :param fobj: file object, None means in-memory drawing, see to_bytes()
         :param width: width in mm
         :param height: height in mm
         :param format: format png/svg/jpg
@@ -51,7 +53,8 @@ class CairoDrawing(GraphicsInterface):
         """
         super().__init__((width / DPMM_IMG if pixels else width) , (height / DPMM_IMG if pixels else height))
 
-        self.fobj = fobj
+        self.in_memory = fobj is None
+        self.fobj = io.BytesIO() if self.in_memory else fobj
         self.format = format
         self.landscape = landscape
         self.surface = None
@@ -63,6 +66,8 @@ class CairoDrawing(GraphicsInterface):
         self.jpg_quality = jpg_quality
         self.avif_quality = avif_quality
         self.avif_speed = avif_speed
+        # metrics are hinted on image surfaces
+        self.text_metrics_kind = (type(self).__name__, self.format in ['png', 'jpg', 'avif'])
 
     def new(self):
         if self.format in ['png', 'jpg', 'avif']:
@@ -154,27 +159,57 @@ class CairoDrawing(GraphicsInterface):
         self.context.arc(x, -y, r, 0, 2.0*pi)
         self._draw_element(mode)
 
+    def _circles_same_color(self, x, y, r, mode):
+        context = self.context
+        for xx, yy, rr in zip(x.tolist(), (-y).tolist(), r.tolist()):
+            context.move_to(xx+rr, yy)
+            context.arc(xx, yy, rr, 0, 2.0*pi)
+        self._draw_element(mode)
+
     def polyline(self, vertices):
-        self.context.move_to(vertices[0][0], -vertices[0][1])
-        for i in range(1, len(vertices)):
-            self.context.line_to(vertices[i][0], -vertices[i][1])
+        self._append_vertices(vertices)
+        self._draw_element(DrawMode.BORDER)
+
+    def polylines(self, polylines):
+        arrays = polyline_arrays(polylines)
+        if arrays is not None:
+            points, starts = arrays
+            self._append_contours(points[:, 0], points[:, 1], starts)
+        else:
+            for vertices in polylines:
+                self._append_vertices(vertices)
         self._draw_element(DrawMode.BORDER)
 
     def polygon(self, vertices, mode=DrawMode.BORDER):
-        self.context.move_to(vertices[0][0], -vertices[0][1])
-        for i in range(1, len(vertices)):
-            self.context.line_to(vertices[i][0], -vertices[i][1])
+        self._append_vertices(vertices)
         self.context.close_path()
         self._draw_element(mode)
 
     def polygons_indexed(self, x, y, polygons, mode=DrawMode.BORDER):
-        for polygon in polygons:
-            self.context.move_to(x[polygon[0]], -y[polygon[0]])
-            for i in polygon[1:]:
-                self.context.line_to(x[i], -y[i])
+        indexes, starts = polygon_index_arrays(polygons)
+        self._append_contours(np.asarray(x)[indexes], np.asarray(y)[indexes], starts)
         self.context.close_path()
         self._draw_element(mode)
 
+    def _append_vertices(self, vertices):
+        line_to = self.context.line_to
+        self.context.move_to(vertices[0][0], -vertices[0][1])
+        for v in vertices[1:]:
+            line_to(v[0], -v[1])
+
+    def _append_contours(self, x, y, starts):
+        """
+        Append contours from flat vertex arrays to current path, contour i begins at vertex starts[i]. pycairo has
+        no bulk path API, coordinates are negated and converted to floats by NumPy before move_to()/line_to() calls.
+        """
+        move_to, line_to = self.context.move_to, self.context.line_to
+        xs, ys = np.asarray(x).tolist(), (-np.asarray(y)).tolist()
+        starts = np.asarray(starts).tolist()
+        for start, end in zip(starts, starts[1:] + [len(xs)]):
+            move_to(xs[start], ys[start])
+            for xx, yy in zip(xs[start + 1:end], ys[start + 1:end]):
+                line_to(xx, yy)
+
     def ellipse(self, x, y, rlong, rshort, posangle, mode=DrawMode.BORDER):
         self.context.save()
         scale = rshort/rlong
@@ -220,7 +255,7 @@ class CairoDrawing(GraphicsInterface):
         self.context.set_source_rgb(self.gi_pen_rgb[0], self.gi_pen_rgb[1], self.gi_pen_rgb[2])
         self.context.show_text(text)
 
-    def text_width(self, text):
+    def _measure_text(self, text):
         xbearing, ybearing, width, height, dx, dy = self.context.text_extents(text)
         return width
 
@@ -268,18 +303,33 @@ class CairoDrawing(GraphicsInterface):
         size = (self.surface.get_width(), self.surface.get_height())
         stride = self.surface.get_stride()
 
+        self.surface.flush()
+        # PIL decodes raw BGRX/BGRa directly from surface memory, no intermediate copy of the frame
         with self.surface.get_data() as memory:
             if format == cairo.Format.RGB24:
                 return Image.frombuffer(
-                    "RGB", size, memory.tobytes(),
+                    "RGB", size, memory,
                     'raw', "BGRX", stride)
             elif format == cairo.Format.ARGB32:
                 return Image.frombuffer(
-                    "RGBA", size, memory.tobytes(),
+                    "RGBA", size, memory,
                     'raw', "BGRa", stride)
             else:
                 raise NotImplementedError(repr(format))
 
+    def pixel_array(self):
+        if not isinstance(self.surface, cairo.ImageSurface):
+            return None
+        self.surface.flush()
+        # RGB24 is stored as BGRX, the unused byte is not defined
+        return np.ndarray(shape=(self.surface.get_height(), self.surface.get_width(), 4), dtype=np.uint8,
+                          buffer=self.surface.get_data(), strides=(self.surface.get_stride(), 4, 1))
+
+    def to_bytes(self):
+        if not self.in_memory:
+            raise ValueError('Drawing is written to file object, create CairoDrawing with fobj=None')
+        return self.fobj.getvalue()
+
     def begin_path(self):
         pass
 
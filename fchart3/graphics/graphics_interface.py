@@ -15,13 +15,29 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import threading
+from collections import OrderedDict
 from enum import Enum
+from itertools import chain
+
+import numpy as np
 
 INCH = 25.4
 DPI = 72.0
 DPMM = DPI/INCH
 POINT = 1.0/DPMM
 
+MIME_TYPES = {
+    'pdf': 'application/pdf',
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'jpg': 'image/jpeg',
+    'avif': 'image/avif',
+    'tikz': 'application/x-tex',
+}
+
+DEFAULT_TEXT_METRICS_CACHE_SIZE = 131072
+
 
 class DrawMode(Enum):
     """
@@ -41,6 +57,86 @@ class FontStyle(Enum):
     ITALIC_BOLD = 3
 
 
+def _color_runs(colors):
+    """
+    Split rgb colors into runs of equal consecutive colors. Yields (rgb, start, end), runs are in order of colors.
+    """
+    colors = np.asarray(colors, dtype=np.float64)
+    changes = (np.flatnonzero((colors[1:] != colors[:-1]).any(axis=1)) + 1).tolist()
+    for start, end in zip([0] + changes, changes + [len(colors)]):
+        yield tuple(colors[start].tolist()), start, end
+
+
+def polygon_index_arrays(polygons):
+    """
+    Flatten lists of vertex indexes. Returns (indexes, starts), indexes of non-empty polygon i begin
+    at starts[i] of flat indexes array.
+    """
+    lengths = np.fromiter(map(len, polygons), dtype=np.int64, count=len(polygons))
+    indexes = np.fromiter(chain.from_iterable(polygons), dtype=np.int64, count=int(lengths.sum()))
+    starts = np.cumsum(lengths) - lengths
+    return indexes, starts[lengths > 0]
+
+
+def polyline_arrays(polylines):
+    """
+    Flatten polylines (lists of (x, y) vertices). Returns (points, starts), points is (n, 2) array and polyline i
+    begins at starts[i], or None if vertices are not (x, y) pairs.
+    """
+    lengths = np.fromiter(map(len, polylines), dtype=np.int64, count=len(polylines))
+    coords = np.fromiter(chain.from_iterable(chain.from_iterable(polylines)), dtype=np.float64)
+    if len(coords) != 2 * lengths.sum():
+        return None
+    starts = np.cumsum(lengths) - lengths
+    return coords.reshape(-1, 2), starts[lengths > 0]
+
+
+class TextMetricsCache:
+    """
+    LRU cache of text widths keyed by (metrics kind, font, font size, font style, text). Shared by graphics
+    in the process (thread safe), metrics kind separates back-ends (and surfaces) measuring text differently.
+    """
+    def __init__(self, maxsize=DEFAULT_TEXT_METRICS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._widths = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # lookup is not locked, single OrderedDict operations are atomic, hits/misses are approximate in threads
+        width = self._widths.get(key)
+        if width is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            self._widths.move_to_end(key)
+        except KeyError:
+            pass  # evicted by other thread
+        return width
+
+    def put(self, key, width):
+        with self._lock:
+            self._widths[key] = width
+            self._widths.move_to_end(key)
+            if len(self._widths) > self.maxsize:
+                self._widths.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._widths.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._widths), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+TEXT_METRICS_CACHE = TextMetricsCache()
+
+
 def paper_A(n):
     """
     Returns (width, height) of ISO An paper in mm
@@ -64,6 +160,9 @@ class GraphicsInterface:
     gi_origin_y    vertical position of the user coordinate system relative
                    to the bottom left corner of the drawing.
     gi_stack       graphics state stack.
+
+    text_metrics        TextMetricsCache of text_width(), None disables caching
+    text_metrics_kind   part of cache key, graphics measuring text equally share it
     """
     def __init__(self, width, height):
         """
@@ -89,6 +188,9 @@ class GraphicsInterface:
         self.gi_stack = []
         self.gi_background_rgb = None
 
+        self.text_metrics = TEXT_METRICS_CACHE
+        self.text_metrics_kind = type(self).__name__
+
     def set_point_size(self, pointsize):
         self.pointsize = pointsize
         self.gi_font_size = 12*self.pointsize
@@ -235,6 +337,34 @@ class GraphicsInterface:
         """
         pass
 
+    def circles(self, x, y, r, colors=None, mode=DrawMode.FILL):
+        """
+        Draw circles with centers at (x[i],y[i]) and radii r[i] in order of arrays, overlapping circles keep
+        their order (e.g. stars sorted by magnitude). colors is None (current fill rgb, pen rgb in BORDER mode)
+        or rgb of each circle. Consecutive circles of the same color are drawn by one _circles_same_color() call.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        r = np.asarray(r, dtype=np.float64)
+        if len(x) == 0:
+            return
+        if colors is None:
+            self._circles_same_color(x, y, r, mode)
+            return
+        for rgb, start, end in _color_runs(colors):
+            if mode == DrawMode.BORDER:
+                self.set_pen_rgb(rgb)
+            else:
+                self.set_fill_rgb(rgb)
+            self._circles_same_color(x[start:end], y[start:end], r[start:end], mode)
+
+    def _circles_same_color(self, x, y, r, mode):
+        """
+        Draw circles using current colors. Derived classes should override it by batched implementation.
+        """
+        for xx, yy, rr in zip(x.tolist(), y.tolist(), r.tolist()):
+            self.circle(xx, yy, rr, mode)
+
     def polygon(self, vertices, mode=DrawMode.BORDER):
         """
         Draw a polygon with specified vertices
@@ -253,6 +383,14 @@ class GraphicsInterface:
         """
         pass
 
+    def polylines(self, polylines):
+        """
+        Draw several polylines (lists of vertices) using current pen. Derived classes should override it by
+        implementation stroking all polylines as one path.
+        """
+        for vertices in polylines:
+            self.polyline(vertices)
+
     def ellipse(self, x, y, rlong, rshort, position_angle, mode=DrawMode.BORDER):
         """
         Draw an ellipse with a center at (x,y) and long radius rlong and
@@ -281,10 +419,41 @@ class GraphicsInterface:
 
     def text_width(self, text):
         """
-        Text width in current font
+        Text width in current font. Widths are cached in text_metrics, derived classes implement _measure_text().
+        """
+        if self.text_metrics is None:
+            return self._measure_text(text)
+        key = (self.text_metrics_kind,) + self._text_metrics_font() + (text,)
+        width = self.text_metrics.get(key)
+        if width is None:
+            width = self._measure_text(text)
+            self.text_metrics.put(key, width)
+        return width
+
+    def _measure_text(self, text):
+        """
+        Measure text width in current font
         """
         pass
 
+    def _text_metrics_font(self):
+        """
+        Font used by _measure_text() as (font, font size, font style)
+        """
+        return self.gi_font, self.gi_font_size, self.gi_font_style
+
+    def prewarm_text_metrics(self, texts, fonts=None):
+        """
+        Measure texts in each of fonts [(font, font_size, font_style)] (current font if None) into text_metrics.
+        Graphics must be initialized by new().
+        """
+        current_font = (self.gi_font, self.gi_font_size, self.gi_font_style)
+        for font, font_size, font_style in fonts or [current_font]:
+            self.set_font(font, font_size, font_style)
+            for text in texts:
+                self.text_width(text)
+        self.set_font(*current_font)
+
     def begin_path(self):
         """
         Start a new path. This initializes the path drawing process.
@@ -331,6 +500,25 @@ class GraphicsInterface:
         """
         pass
 
+    def mime_type(self):
+        """
+        MIME type of finished drawing
+        """
+        return MIME_TYPES.get(getattr(self, 'format', None))
+
+    def to_bytes(self):
+        """
+        Finished drawing as bytes, available if drawing was created without file object (fobj=None).
+        """
+        raise NotImplementedError('{} does not support in-memory output'.format(type(self).__name__))
+
+    def pixel_array(self):
+        """
+        Pixels of raster drawing as numpy array (height, width, 4) of uint8 in BGRA order with premultiplied alpha.
+        The array shares memory with the drawing surface (no copy), returns None for vector formats.
+        """
+        return None
+
     def clip_path(self, path):
         """
         Clip path
@@ -384,3 +572,303 @@ class GraphicsInterface:
         if y < -self.gi_height/2:
             code |= 8
         return code
+
+
+_UNKNOWN = object()
+
+
+class CoalescingGraphics(GraphicsInterface):
+    """
+    Graphics forwarding drawing to other graphics (CairoDrawing, SkiaDrawing, TikZDrawing) with less calls.
+
+    State (pen, fill, line width, dash, font) is applied to the target just before a primitive needing it is drawn
+    and only if it differs from the state applied last time. Consecutive lines and polylines of the same pen, line
+    width and dash are collected, a line starting at the end of the previous one continues its polyline, and all
+    are stroked by one polylines() call when style changes or other primitive is drawn.
+    """
+    def __init__(self, graphics):
+        super().__init__(graphics.gi_width, graphics.gi_height)
+        self.graphics = graphics
+        self._applied = {}
+        self._paths = []
+        self._paths_key = None
+        self.stats = dict.fromkeys(('state_changes', 'state_changes_applied', 'strokes', 'strokes_drawn'), 0)
+
+    def __getattr__(self, name):
+        # attributes specific to the target (format, surface, ...), not called for attributes found in self
+        if name == 'graphics':
+            raise AttributeError(name)
+        return getattr(self.graphics, name)
+
+    def _apply(self, name, value):
+        if self._applied.get(name, _UNKNOWN) == value:
+            return
+        self._applied[name] = value
+        self.stats['state_changes_applied'] += 1
+        if name == 'pen':
+            self.graphics.set_pen_rgb(value)
+        elif name == 'fill':
+            self.graphics.set_fill_rgb(value)
+        elif name == 'linewidth':
+            self.graphics.set_linewidth(value)
+        elif name == 'dash':
+            if value is None:
+                self.graphics.set_solid_line()
+            else:
+                (on, off), start = value
+                self.graphics.set_dashed_line(on, off, start)
+        elif name == 'font':
+            self.graphics.set_font(*value)
+
+    def _sync(self, mode=DrawMode.BORDER):
+        if mode != DrawMode.FILL:
+            self._apply('pen', self.gi_pen_rgb)
+            self._apply('linewidth', self.gi_linewidth)
+            self._apply('dash', self.gi_dash_style)
+        if mode != DrawMode.BORDER:
+            self._apply('fill', self.gi_fill_rgb)
+
+    def _sync_text(self):
+        self._apply('pen', self.gi_pen_rgb)
+        self._apply('font', (self.gi_font, self.gi_font_size, self.gi_font_style))
+
+    def _add_stroke(self, vertices):
+        self.stats['strokes'] += 1
+        key = (self.gi_pen_rgb, self.gi_linewidth, self.gi_dash_style)
+        if key != self._paths_key:
+            self.flush()
+            self._paths_key = key
+        paths = self._paths
+        if paths and paths[-1][-1] == vertices[0]:
+            paths[-1].extend(vertices[1:])
+        else:
+            paths.append(vertices)
+
+    def flush(self):
+        """
+        Draw collected lines and polylines.
+        """
+        paths = self._paths
+        if not paths:
+            return
+        self._paths = []
+        pen, linewidth, dash = self._paths_key
+        self._apply('pen', pen)
+        self._apply('linewidth', linewidth)
+        self._apply('dash', dash)
+        if len(paths) == 1 and len(paths[0]) == 2:
+            (x1, y1), (x2, y2) = paths[0]
+            self.graphics.line(x1, y1, x2, y2)
+        else:
+            self.graphics.polylines(paths)
+        self.stats['strokes_drawn'] += 1
+
+    def _pull_state(self):
+        g = self.graphics
+        self.pointsize = g.pointsize
+        self.gi_pen_rgb = g.gi_pen_rgb
+        self.gi_fill_rgb = g.gi_fill_rgb
+        self.gi_linewidth = g.gi_linewidth
+        self.gi_dash_style = g.gi_dash_style
+        self.gi_font = g.gi_font
+        self.gi_font_size = g.gi_font_size
+        self.gi_font_style = g.gi_font_style
+        self.gi_default_font_size = g.gi_default_font_size
+
+    def new(self):
+        self._paths = []
+        self._paths_key = None
+        self.graphics.new()
+        # back-ends set their initial state in new(), it is taken over but not considered as applied
+        self._pull_state()
+        self._applied.clear()
+
+    def save(self):
+        self.flush()
+        super().save()
+        self.graphics.save()
+
+    def restore(self):
+        self.flush()
+        super().restore()
+        self.graphics.restore()
+        # back-ends do not restore all state (e.g. Skia paints), apply it again
+        self._applied.clear()
+
+    def set_dimensions(self, width, height):
+        super().set_dimensions(width, height)
+        self.graphics.set_dimensions(width, height)
+
+    def set_origin(self, origin_x, origin_y):
+        super().set_origin(origin_x, origin_y)
+        self.graphics.set_origin(origin_x, origin_y)
+
+    def set_linewidth(self, linewidth):
+        super().set_linewidth(linewidth)
+        self.stats['state_changes'] += 1
+
+    def set_pen_rgb(self, pen_rgb):
+        super().set_pen_rgb(pen_rgb)
+        self.stats['state_changes'] += 1
+
+    def set_fill_rgb(self, fill_rgb):
+        super().set_fill_rgb(fill_rgb)
+        self.stats['state_changes'] += 1
+
+    def set_fill_background(self):
+        super().set_fill_background()
+        self.stats['state_changes'] += 1
+
+    def set_solid_line(self):
+        super().set_solid_line()
+        self.stats['state_changes'] += 1
+
+    def set_dashed_line(self, on, off, start=0.0):
+        super().set_dashed_line(on, off, start)
+        self.stats['state_changes'] += 1
+
+    def set_font(self, font='Times-Roman', font_size=None, font_style=FontStyle.NORMAL):
+        super().set_font(font, font_size, font_style)
+        self.stats['state_changes'] += 1
+
+    def set_default_font_size(self, default_font_size):
+        super().set_default_font_size(default_font_size)
+        self.graphics.set_default_font_size(default_font_size)
+
+    def set_background_rgb(self, background_rgb):
+        super().set_background_rgb(background_rgb)
+        self.graphics.set_background_rgb(background_rgb)
+
+    def translate(self, dx, dy):
+        self.flush()
+        self.graphics.translate(dx, dy)
+
+    def rotate(self, angle):
+        self.flush()
+        self.graphics.rotate(angle)
+
+    def line(self, x1, y1, x2, y2):
+        self._add_stroke([(x1, y1), (x2, y2)])
+
+    def polyline(self, vertices):
+        if len(vertices) > 0:
+            self._add_stroke([(v[0], v[1]) for v in vertices])
+
+    def polylines(self, polylines):
+        for vertices in polylines:
+            self.polyline(vertices)
+
+    def rectangle(self, x, y, width, height, mode=DrawMode.BORDER):
+        self.flush()
+        self._sync(mode)
+        self.graphics.rectangle(x, y, width, height, mode)
+
+    def circle(self, x, y, r, mode=DrawMode.BORDER):
+        self.flush()
+        self._sync(mode)
+        self.graphics.circle(x, y, r, mode)
+
+    def circles(self, x, y, r, colors=None, mode=DrawMode.FILL):
+        self.flush()
+        self._sync(mode)
+        self.graphics.circles(x, y, r, colors, mode)
+        if colors is not None:
+            # target changed its pen/fill to colors of circles
+            if mode == DrawMode.BORDER:
+                self.gi_pen_rgb = self._applied['pen'] = self.graphics.gi_pen_rgb
+            else:
+                self.gi_fill_rgb = self._applied['fill'] = self.graphics.gi_fill_rgb
+
+    def polygon(self, vertices, mode=DrawMode.BORDER):
+        self.flush()
+        self._sync(mode)
+        self.graphics.polygon(vertices, mode)
+
+    def polygons_indexed(self, x, y, polygons, mode=DrawMode.BORDER):
+        self.flush()
+        self._sync(mode)
+        self.graphics.polygons_indexed(x, y, polygons, mode)
+
+    def ellipse(self, x, y, rlong, rshort, position_angle, mode=DrawMode.BORDER):
+        self.flush()
+        self._sync(mode)
+        self.graphics.ellipse(x, y, rlong, rshort, position_angle, mode)
+
+    def text_right(self, x, y, text):
+        self.flush()
+        self._sync_text()
+        self.graphics.text_right(x, y, text)
+
+    def text_left(self, x, y, text):
+        self.flush()
+        self._sync_text()
+        self.graphics.text_left(x, y, text)
+
+    def text_centred(self, x, y, text):
+        self.flush()
+        self._sync_text()
+        self.graphics.text_centred(x, y, text)
+
+    def text_width(self, text):
+        self._apply('font', (self.gi_font, self.gi_font_size, self.gi_font_style))
+        return self.graphics.text_width(text)
+
+    def begin_path(self):
+        self.flush()
+        self.graphics.begin_path()
+
+    def move_to(self, x, y):
+        self.flush()
+        self.graphics.move_to(x, y)
+
+    def arc_to(self, x, y, r, angle1, angle2):
+        self.graphics.arc_to(x, y, r, angle1, angle2)
+
+    def elliptic_arc_to(self, x, y, rx, ry, angle1, angle2):
+        self.graphics.elliptic_arc_to(x, y, rx, ry, angle1, angle2)
+
+    def line_to(self, x, y):
+        self.graphics.line_to(x, y)
+
+    def complete_path(self, mode=DrawMode.BORDER):
+        self._sync(mode)
+        self.graphics.complete_path(mode)
+
+    def finish(self):
+        self.flush()
+        self.graphics.finish()
+
+    def mime_type(self):
+        return self.graphics.mime_type()
+
+    def to_bytes(self):
+        return self.graphics.to_bytes()
+
+    def pixel_array(self):
+        return self.graphics.pixel_array()
+
+    def clip_path(self, path):
+        self.flush()
+        self.graphics.clip_path(path)
+
+    def reset_clip(self):
+        self.flush()
+        self.graphics.reset_clip()
+
+    def clear(self):
+        self.flush()
+        self.graphics.clear()
+
+    def on_screen(self, x, y):
+        return self.graphics.on_screen(x, y)
+
+    def to_pixel(self, x, y):
+        return self.graphics.to_pixel(x, y)
+
+    def antialias_on(self):
+        self.flush()
+        self.graphics.antialias_on()
+
+    def antialias_off(self):
+        self.flush()
+        self.graphics.antialias_off()
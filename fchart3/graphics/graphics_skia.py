@@ -15,7 +15,10 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import struct
+
 import skia
+import numpy as np
 from math import pi
 
 from .graphics_interface import *
@@ -39,6 +42,110 @@ def get_cached_typeface(font_name):
     return _TYPEFACE_CACHE[font_name]
 
 
+# serialized skia.Path read by Path.readFromMemory(): int32 version, point, conic and verb counts, float32 points
+# and uint8 verbs padded to 4 bytes
+_PATH_VERSION = 5
+_VERB_MOVE = 0
+_VERB_LINE = 1
+_VERB_CLOSE = 5
+
+# shorter paths are built faster by moveTo()/lineTo() calls
+_PATH_BUFFER_MIN_POINTS = 48
+
+_FIRST_CONTOUR = np.zeros(1, dtype=np.int64)
+
+_path_buffer_supported = None
+
+
+def _path_from_buffer(points, starts, close):
+    """
+    Build path from (n, 2) float32 points as one serialized path. Returns None if Skia does not read it.
+    """
+    n = len(points)
+    nverbs = n + 1 if close else n
+    verbs = np.full(nverbs + (-nverbs) % 4, _VERB_LINE, dtype=np.uint8)
+    verbs[starts] = _VERB_MOVE
+    if close:
+        verbs[n] = _VERB_CLOSE
+    data = b''.join((struct.pack('4i', _PATH_VERSION, n, 0, nverbs), points.tobytes(), verbs.tobytes()))
+    path = skia.Path()
+    if path.readFromMemory(data) != len(data):
+        return None
+    return path
+
+
+def _check_path_buffer():
+    """
+    Check once that serialized path layout matches the Skia version.
+    """
+    global _path_buffer_supported
+    if _path_buffer_supported is None:
+        points = np.array([[0, 0], [1, 0], [1, -1], [2, -2], [3, -2]], dtype=np.float32)
+        expected = skia.Path()
+        expected.moveTo(0, 0)
+        expected.lineTo(1, 0)
+        expected.lineTo(1, -1)
+        expected.moveTo(2, -2)
+        expected.lineTo(3, -2)
+        expected.close()
+        path = _path_from_buffer(points, [0, 3], True)
+        _path_buffer_supported = path is not None and path == expected
+    return _path_buffer_supported
+
+
+def _path_from_arrays(x, y, starts, close=False):
+    """
+    Build skia.Path of contours from flat vertex arrays, contour i begins at vertex starts[i]. close=True closes
+    the last contour. Long paths are passed to Skia in one buffer instead of lineTo() call per vertex.
+    """
+    n = len(x)
+    if n >= _PATH_BUFFER_MIN_POINTS and _check_path_buffer():
+        starts = np.asarray(starts)
+        # moveTo() replaces preceding move, drop single vertex contours followed by another contour
+        lone = np.flatnonzero(np.diff(starts) == 1)
+        if len(lone) > 0:
+            keep = np.ones(n, dtype=bool)
+            keep[starts[lone]] = False
+            x, y = np.asarray(x)[keep], np.asarray(y)[keep]
+            starts = np.delete(starts, lone)
+            starts = starts - np.searchsorted(np.flatnonzero(~keep), starts)
+            n = len(x)
+        points = np.empty((n, 2), dtype=np.float32)
+        points[:, 0] = x
+        np.negative(y, out=points[:, 1], casting='same_kind')
+        path = _path_from_buffer(points, starts, close)
+        if path is not None:
+            return path
+    path = skia.Path()
+    move_to, line_to = path.moveTo, path.lineTo
+    xs, ys = np.asarray(x).tolist(), (-np.asarray(y)).tolist()
+    starts = np.asarray(starts).tolist()
+    for start, end in zip(starts, starts[1:] + [n]):
+        move_to(xs[start], ys[start])
+        for xx, yy in zip(xs[start + 1:end], ys[start + 1:end]):
+            line_to(xx, yy)
+    if close:
+        path.close()
+    return path
+
+
+def _vertices_path(vertices, close):
+    """
+    Build skia.Path of single contour from list of (x, y) vertices.
+    """
+    if len(vertices) < _PATH_BUFFER_MIN_POINTS:
+        path = skia.Path()
+        path.moveTo(vertices[0][0], -vertices[0][1])
+        line_to = path.lineTo
+        for v in vertices[1:]:
+            line_to(v[0], -v[1])
+        if close:
+            path.close()
+        return path
+    points = np.asarray(vertices, dtype=np.float64)
+    return _path_from_arrays(points[:, 0], points[:, 1], _FIRST_CONTOUR, close)
+
+
 class SkiaDrawing(GraphicsInterface):
     """
     A SkiaDrawing - implement Graphics interface using Skia-Python
@@ -46,7 +153,7 @@ class SkiaDrawing(GraphicsInterface):
 
     def __init__(self, fobj, width, height, format='pdf', pixels=False, landscape=False, tolerance=None, jpg_quality=90):
         """
-        :param fobj: file object
+        :param fobj: file object, None means in-memory drawing, see to_bytes()
         :param width: width in mm
         :param height: height in mm
         :param format: format png/svg
@@ -56,11 +163,13 @@ class SkiaDrawing(GraphicsInterface):
         """
         super().__init__((width / DPMM_IMG if pixels else width) , (height / DPMM_IMG if pixels else height))
 
+        self.in_memory = fobj is None
         self.fobj = fobj
         self.format = format
         self.landscape = landscape
         self.surface = None
         self.canvas = None
+        self.data = None
         self.sfc_width = None
         self.sfc_height = None
         self.base_save_count = None
@@ -80,6 +189,8 @@ class SkiaDrawing(GraphicsInterface):
             self.canvas.translate(self.gi_origin_x, self.gi_origin_y)
             self.base_save_count = self.canvas.getSaveCount()
         else:
+            if self.in_memory:
+                self.fobj = skia.DynamicMemoryWStream()
             self.document = skia.PDF.MakeDocument(self.fobj)
             if self.landscape:
                 self.sfc_width, self.sfc_height = A4_HEIGHT_POINTS, A4_WIDTH_POINTS
@@ -101,6 +212,7 @@ class SkiaDrawing(GraphicsInterface):
         self.paint_dash = skia.Paint(AntiAlias=True)
         self.paint_text = skia.Paint(AntiAlias=True)
         self.font_default = None
+        self._font_key = None
         self.path = None
 
     def clear(self):
@@ -138,6 +250,7 @@ class SkiaDrawing(GraphicsInterface):
             except Exception:
                 tf = skia.Typeface('NotoSans-Regular')
             self.font_default = skia.Font(tf, self.gi_font_size)
+            self._font_key = (self.gi_font, self.gi_font_size, self.gi_font_style)
 
     def set_linewidth(self, linewidth):
         super().set_linewidth(linewidth)
@@ -167,24 +280,22 @@ class SkiaDrawing(GraphicsInterface):
         self._set_color_and_stroke_style(paint, mode)
         self.canvas.drawCircle(x, -y, r, paint)
 
+    def _circles_same_color(self, x, y, r, mode):
+        paint = self._get_paint()
+        self._set_color_and_stroke_style(paint, mode)
+        # drawCircle() is rasterized analytically, single path with many circles renders edges differently
+        draw_circle = self.canvas.drawCircle
+        for xx, yy, rr in zip(x.tolist(), (-y).tolist(), r.tolist()):
+            draw_circle(xx, yy, rr, paint)
+
     def polygon(self, vertices, mode=DrawMode.BORDER):
-        path = skia.Path()
-        path.moveTo(vertices[0][0], -vertices[0][1])
-        for v in vertices[1:]:
-            path.lineTo(v[0], -v[1])
-        path.close()
+        path = _vertices_path(vertices, True)
         self._set_color_and_stroke_style(self.paint_default, mode)
         self.canvas.drawPath(path, self.paint_default)
 
     def polygons_indexed(self, x, y, polygons, mode=DrawMode.BORDER):
-        path = skia.Path()
-        for poly in polygons:
-            if not poly:
-                continue
-            path.moveTo(x[poly[0]], -y[poly[0]])
-            for i in poly[1:]:
-                path.lineTo(x[i], -y[i])
-        path.close()
+        indexes, starts = polygon_index_arrays(polygons)
+        path = _path_from_arrays(np.asarray(x)[indexes], np.asarray(y)[indexes], starts, True)
 
         if mode == DrawMode.BORDER:
             paint = self._get_paint()
@@ -207,13 +318,25 @@ class SkiaDrawing(GraphicsInterface):
             self.canvas.drawPath(path, stroke)
 
     def polyline(self, vertices):
-        path = skia.Path()
-        path.moveTo(vertices[0][0], -vertices[0][1])
-        for v in vertices[1:]:
-            path.lineTo(v[0], -v[1])
+        path = _vertices_path(vertices, False)
         self._set_color_and_stroke_style(self.paint_default, DrawMode.BORDER)
         self.canvas.drawPath(path, self.paint_default)
 
+    def polylines(self, polylines):
+        arrays = polyline_arrays(polylines)
+        if arrays is not None:
+            points, starts = arrays
+            path = _path_from_arrays(points[:, 0], points[:, 1], starts)
+        else:
+            path = skia.Path()
+            for vertices in polylines:
+                path.moveTo(vertices[0][0], -vertices[0][1])
+                for v in vertices[1:]:
+                    path.lineTo(v[0], -v[1])
+        paint = self._get_paint()
+        self._set_color_and_stroke_style(paint, DrawMode.BORDER)
+        self.canvas.drawPath(path, paint)
+
     def ellipse(self,x,y,rlong,rshort, posangle, mode=DrawMode.BORDER):
         self.canvas.save()
         paint = self._get_paint()
@@ -229,18 +352,22 @@ class SkiaDrawing(GraphicsInterface):
         self.canvas.drawString(text, x, -y, self.font_default, self.paint_text)
 
     def text_left(self, x, y, text):
-        text_width = self.font_default.measureText(text)
+        text_width = self.text_width(text)
         self.paint_text.setColor4f(skia.Color4f(self.gi_pen_rgb[0], self.gi_pen_rgb[1], self.gi_pen_rgb[2]))
         self.canvas.drawString(text, x-text_width, -y, self.font_default, self.paint_text)
 
     def text_centred(self, x, y, text):
-        text_width = self.font_default.measureText(text)
+        text_width = self.text_width(text)
         self.paint_text.setColor4f(skia.Color4f(self.gi_pen_rgb[0], self.gi_pen_rgb[1], self.gi_pen_rgb[2]))
         self.canvas.drawString(text, x-text_width/2, -y, self.font_default, self.paint_text)
 
-    def text_width(self, text):
+    def _measure_text(self, text):
         return self.font_default.measureText(text)
 
+    def _text_metrics_font(self):
+        # font_default is not rebuilt if only font name or style changes
+        return self._font_key
+
     def translate(self, dx, dy):
         self.canvas.translate(dx, -dy)
 
@@ -332,7 +459,9 @@ class SkiaDrawing(GraphicsInterface):
             image = self.surface.makeImageSnapshot()
             fmt = skia.kPNG if self.format == 'png' else skia.kJPEG
             data = image.encodeToData(fmt, self.jpg_quality if self.format == 'jpg' else 100)
-            if hasattr(self.fobj, 'write'):
+            if self.in_memory:
+                self.data = data
+            elif hasattr(self.fobj, 'write'):
                 self.fobj.write(bytes(data))
             else:
                 with open(self.fobj, 'wb') as fw:
@@ -340,6 +469,22 @@ class SkiaDrawing(GraphicsInterface):
         else:
             self.document.endPage()
             self.document.close()
+            if self.in_memory:
+                self.data = self.fobj.detachAsData()
+
+    def to_bytes(self):
+        if not self.in_memory:
+            raise ValueError('Drawing is written to file object, create SkiaDrawing with fobj=None')
+        return bytes(self.data)
+
+    def pixel_array(self):
+        if self.format not in ['png', 'jpg']:
+            return None
+        pixmap = skia.Pixmap()
+        if not self.surface.peekPixels(pixmap):
+            return None
+        # array keeps reference to pixmap, pixels are N32 (BGRA on little endian) premultiplied
+        return np.asarray(pixmap)
 
     def on_screen(self, x, y):
         return x > -self.gi_width/2.0 and x < self.gi_width/2.0 and y > -self.gi_height/2.0  and y < self.gi_height/2.0
@@ -15,6 +15,7 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
+import io
 from math import pi
 
 from .graphics_interface import *
@@ -71,16 +72,21 @@ class TikZDrawing(GraphicsInterface):
     """
     def __init__(self, fobj, width, height, landscape=False):
         """
-        :param fobj: file object
+        :param fobj: file object, None means in-memory drawing, see to_bytes()
         :param width: width in mm
         :param height: height in mm
         :param landscape: True if orientation of page is landscape
         """
         super().__init__(width , height)
 
+        self.in_memory = fobj is None
+        self.format = 'tikz'
         if isinstance(fobj, str):
             self.close_fobj = True
             self.fobj = open(fobj, 'w')
+        elif self.in_memory:
+            self.fobj = io.StringIO()
+            self.close_fobj = False
         else:
             self.fobj = fobj
             self.close_fobj = False
@@ -161,6 +167,25 @@ class TikZDrawing(GraphicsInterface):
             self.fobj.write('\\filldraw[draw={{{}}},fill={{{}}}] ({:.3f}, {:.3f}) circle ({:.3f}cm);\n'
                             .format(pen, fill, _cm(x), _cm(y), _cm(r)))
 
+    def _circles_same_color(self, x, y, r, mode):
+        self._flush_scope()
+        # one path with circle per line, TeX input lines have limited length
+        tikz_circles = '\n'.join(['({:.3f},{:.3f}) circle ({:.3f}cm)'.format(_cm(xx), _cm(yy), _cm(rr))
+                                   for xx, yy, rr in zip(x.tolist(), y.tolist(), r.tolist())])
+        if mode == DrawMode.BORDER:
+            color = _to_tikz_color(self.gi_pen_rgb)
+            dashed = ',mydashed' if self.gi_dash_style is not None else ''
+            self.fobj.write('\\draw[line width={:.3f}mm{},draw={{{}}}]\n{};\n'
+                            .format(self.gi_linewidth, dashed, color, tikz_circles))
+        elif mode == DrawMode.FILL:
+            self.fobj.write('\\definecolor{{fcolor}}{{rgb}}{{{:.6f},{:.6f},{:.6f}}}\n'
+                            .format(self.gi_fill_rgb[0], self.gi_fill_rgb[1], self.gi_fill_rgb[2]))
+            self.fobj.write('\\filldraw[draw=fcolor,fill=fcolor]\n{};\n'.format(tikz_circles))
+        else:
+            pen = _to_tikz_color(self.gi_pen_rgb)
+            fill = _to_tikz_color(self.gi_fill_rgb)
+            self.fobj.write('\\filldraw[draw={{{}}},fill={{{}}}]\n{};\n'.format(pen, fill, tikz_circles))
+
     def polygon(self, vertices, mode=DrawMode.BORDER):
         self._flush_scope()
         tikz_vertices = ['({:.3f},{:.3f})'.format(_cm(v[0]), _cm(v[1])) for v in vertices]
@@ -190,6 +215,24 @@ class TikZDrawing(GraphicsInterface):
         else:
             self.fobj.write('\\draw[line width={:.3f}mm,mydashed,draw={{{}}}] {};\n'.format(self.gi_linewidth, pen, tikz_vertices))
 
+    def polylines(self, polylines):
+        self._flush_scope()
+        tikz_polylines = []
+        for vertices in polylines:
+            code = 15
+            for v in vertices:
+                code &= self.cohen_sutherland_encode(v[0], v[1])
+            if code != 0:
+                continue  # whole polyline is out of one side of the drawing
+            tikz_polylines.append(' -- '.join(['({:.3f},{:.3f})'.format(_cm(v[0]), _cm(v[1])) for v in vertices]))
+        if not tikz_polylines:
+            return
+        # one path with polyline per line, TeX input lines have limited length
+        pen = _to_tikz_color(self.gi_pen_rgb)
+        dashed = ',mydashed' if self.gi_dash_style is not None else ''
+        self.fobj.write('\\draw[line width={:.3f}mm{},draw={{{}}}]\n{};\n'
+                        .format(self.gi_linewidth, dashed, pen, '\n'.join(tikz_polylines)))
+
     def ellipse(self, x, y, rlong, rshort, posangle, mode=DrawMode.BORDER):
         self.save()
         self.translate(x, y)
@@ -264,6 +307,11 @@ class TikZDrawing(GraphicsInterface):
         if self.close_fobj:
             self.fobj.close()
 
+    def to_bytes(self):
+        if not self.in_memory:
+            raise ValueError('Drawing is written to file object, create TikZDrawing with fobj=None')
+        return self.fobj.getvalue().encode('utf-8')
+
     def on_screen(self, x, y):
         return x > -self.gi_width/2.0 and x < self.gi_width/2.0 and y > -self.gi_height/2.0  and y < self.gi_height/2.0
 
@@ -48,6 +48,9 @@ class MirroringGraphics:
     def circle(self, x, y, r, mode=DrawMode.BORDER):
         self.graphics.circle(x, y, r, mode)
 
+    def circles(self, x, y, r, colors=None, mode=DrawMode.FILL):
+        self.graphics.circles(x, y, r, colors, mode)
+
     def ellipse(self, x, y, rlong, rshort, position_angle, mode=DrawMode.BORDER):
         if self.mirror_x:
             position_angle = -position_angle + pi
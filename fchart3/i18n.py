@@ -17,38 +17,71 @@
 
 import gettext
 import os
+from collections.abc import Mapping
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Callable
 
 
-def get_translator(lang: Optional[str] = None) -> Callable[[str], str]:
-    """
-    Return a gettext-like function '_' for the requested language.
-    Uses fallback=True so it never crashes if translations are missing.
-    """
-    lang = (lang or os.environ.get("fchart3lang") or "").strip() or None
-    localedir = Path(__file__).resolve().parent / "locale"
+def _resolve_lang(lang: Optional[str]) -> Optional[str]:
+    return (lang or os.environ.get("fchart3lang") or "").strip() or None
+
 
-    trans = gettext.translation(
+@lru_cache(maxsize=None)
+def _translation(lang: Optional[str]) -> gettext.NullTranslations:
+    localedir = Path(__file__).resolve().parent / "locale"
+    return gettext.translation(
         "messages",
         localedir=str(localedir),
         languages=[lang] if lang else None,
         fallback=True,
     )
-    return trans.gettext
+
+
+def get_translator(lang: Optional[str] = None) -> Callable[[str], str]:
+    """
+    Return a gettext-like function '_' for the requested language.
+    Uses fallback=True so it never crashes if translations are missing. Translations are cached per language.
+    """
+    return _translation(_resolve_lang(lang)).gettext
 
 
 def install_translator(lang: Optional[str] = None):
     """
     Install '_' into builtins for convenience across modules.
     """
-    _ = get_translator(lang)
-    gettext.install("messages")  # optional, but not enough alone for custom localedir
-    # Better: actually install the translation object
-    lang = (lang or os.environ.get("fchart3lang") or "").strip() or None
-    localedir = Path(__file__).resolve().parent / "locale"
-    trans = gettext.translation("messages", localedir=str(localedir),
-                                languages=[lang] if lang else None,
-                                fallback=True)
+    trans = _translation(_resolve_lang(lang))
     trans.install()
-    return trans.gettext
\ No newline at end of file
+    return trans.gettext
+
+
+def _(message: str) -> str:
+    """
+    Translate message to language given by 'fchart3lang' environment variable. Translator is created on first use,
+    so modules importing '_' do no work at import time.
+    """
+    return _translation(_resolve_lang(None)).gettext(message)
+
+
+def N_(message: str) -> str:
+    """
+    Mark message for translation (xgettext -kN_) without translating it, see TranslatedLabels.
+    """
+    return message
+
+
+class TranslatedLabels(Mapping):
+    """
+    Read-only mapping of labels marked by N_(), labels are translated by '_' on access.
+    """
+    def __init__(self, labels: dict[str, str]):
+        self._labels = labels
+
+    def __getitem__(self, key: str) -> str:
+        return _(self._labels[key])
+
+    def __iter__(self):
+        return iter(self._labels)
+
+    def __len__(self) -> int:
+        return len(self._labels)
@@ -0,0 +1,103 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Startup benchmark based on 'python -X importtime'.
+
+    python -m fchart3.importtime [--budget-ms MS] [--runs N] [--module fchart3]
+
+Imports the module in fresh interpreters, prints the best cumulative import time and the slowest imported
+modules, and exits with status 1 if the import takes longer than the budget.
+
+Budget: 'import fchart3' must stay under DEFAULT_BUDGET_MS (best of runs). About half of it is numpy, the rest
+is fchart3 itself. Graphics back-ends (cairo, skia), skyfield and translations are loaded on first use and must
+not appear in the report, importing them at module level is a regression.
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = 250
+DEFAULT_RUNS = 5
+DEFAULT_TOP = 15
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$')
+
+
+def measure_import(module, python=sys.executable):
+    """
+    Import module in fresh interpreter, return dict module -> (self us, cumulative us).
+    """
+    proc = subprocess.run([python, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError('import {} failed:\n{}'.format(module, proc.stderr))
+    times = {}
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m:
+            times[m.group(4)] = (int(m.group(1)), int(m.group(2)))
+    return times
+
+
+def best_of(module, runs, python=sys.executable):
+    """
+    Best (minimal) timing of each module over runs, the least noisy estimate on a busy machine.
+    """
+    best = {}
+    for _ in range(runs):
+        for name, (self_us, cum_us) in measure_import(module, python).items():
+            if name in best:
+                best[name] = (min(best[name][0], self_us), min(best[name][1], cum_us))
+            else:
+                best[name] = (self_us, cum_us)
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Measure startup (import) time of fchart3.')
+    ap.add_argument('--module', default='fchart3', help='Module to import (default: fchart3).')
+    ap.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                    help='Fail if import takes longer (default: {} ms).'.format(DEFAULT_BUDGET_MS))
+    ap.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Number of runs (default: {}).'.format(DEFAULT_RUNS))
+    ap.add_argument('--top', type=int, default=DEFAULT_TOP, help='Number of slowest modules to show.')
+    args = ap.parse_args(argv)
+
+    times = best_of(args.module, max(args.runs, 1))
+    if args.module not in times:
+        print('Module {} is already imported by interpreter startup.'.format(args.module))
+        return 1
+
+    print('Slowest modules (self ms / cumulative ms):')
+    for name, (self_us, cum_us) in sorted(times.items(), key=lambda t: t[1][0], reverse=True)[:args.top]:
+        print('  {:8.1f} {:8.1f}  {}'.format(self_us / 1000.0, cum_us / 1000.0, name))
+
+    total_ms = times[args.module][1] / 1000.0
+    print('import {}: {:.1f} ms (budget {:.0f} ms)'.format(args.module, total_ms, args.budget_ms))
+    if total_ms > args.budget_ms:
+        print('Import time budget exceeded.')
+        return 1
+    return 0
+
+
+__all__ = ['DEFAULT_BUDGET_MS', 'measure_import', 'best_of', 'main']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
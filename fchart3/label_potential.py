@@ -16,67 +16,237 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import math
+from time import perf_counter
 from typing import TypeAlias, Tuple, Sequence
 
 import numpy as np
-from numpy.typing import NDArray
+from numpy.typing import NDArray, ArrayLike
 
 DeepskyItem: TypeAlias = Tuple[object, float, float, float]
 
+# default cutoff radius relative to field radius
+LABEL_POTENTIAL_CUTOFF = 0.125
+
+INITIAL_CAPACITY = 256
+
+# max. number of query points x stored positions evaluated at once
+QUERY_CHUNK_ELEMENTS = 1 << 20
+
+# max. number of grid cells gathered at once for group of query points
+MAX_GATHER_CELLS = 16
+
+
+class _PositionBuffer:
+    """
+    Growable position/size arrays, capacity is doubled when full.
+    """
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.positions = np.empty((capacity, 2), dtype=np.float64)
+        self.sizes = np.empty((capacity,), dtype=np.float32)
+        self.count = 0
+
+    def append(self, positions, sizes):
+        n = len(sizes)
+        end = self.count + n
+        if end > len(self.sizes):
+            capacity = max(2 * len(self.sizes), end)
+            new_positions = np.empty((capacity, 2), dtype=np.float64)
+            new_sizes = np.empty((capacity,), dtype=np.float32)
+            new_positions[:self.count] = self.positions[:self.count]
+            new_sizes[:self.count] = self.sizes[:self.count]
+            self.positions, self.sizes = new_positions, new_sizes
+        self.positions[self.count:end] = positions
+        self.sizes[self.count:end] = sizes
+        self.count = end
+
 
 class LabelPotential:
+    """
+    Potential field of already placed labels and objects used to find the least crowded label position.
+    Positions are indexed in square grid of cells with cell size equal to cutoff_radius, contributions
+    of positions farther than cutoff_radius are neglected. If cutoff_radius is None, all positions contribute.
+    """
     field_radius: float
-    positions: NDArray[np.float32]
-    sizes: NDArray[np.float32]
+    cutoff_radius: float
+    labels_placed: int
 
-    def __init__(self, field_radius: float) -> None:
+    def __init__(self, field_radius: float, cutoff_radius: float = None) -> None:
         """
         field_radius in mm
-        deepskylist [(x,y,size), ...]  # note: code expects 4-tuple: (_, x, y, s)
-        x, y, size in mm
+        cutoff_radius in mm, None means no cutoff
         """
         self.field_radius = float(field_radius)
-        self.positions = np.empty((0, 2), dtype=np.float32)
-        self.sizes = np.empty((0,), dtype=np.float32)
+        self.cutoff_radius = float(cutoff_radius) if cutoff_radius is not None and cutoff_radius > 0 else None
+        self._all = _PositionBuffer()
+        self._cells = {}
+        self.labels_placed = 0
+
+    @property
+    def positions(self) -> NDArray[np.float64]:
+        return self._all.positions[:self._all.count]
+
+    @property
+    def sizes(self) -> NDArray[np.float32]:
+        return self._all.sizes[:self._all.count]
+
+    def _add(self, positions, sizes):
+        self._all.append(positions, sizes)
+        if self.cutoff_radius is None:
+            return
+        for cell, sel in self._group_by_cell(positions[:, 0], positions[:, 1]):
+            self._cell_buffer(cell).append(positions[sel], sizes[sel])
+
+    def _group_by_cell(self, xs, ys):
+        """
+        Returns list of (cell, indexes of points in cell)
+        """
+        cutoff = self.cutoff_radius
+        groups = {}
+        for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+            groups.setdefault((math.floor(x / cutoff), math.floor(y / cutoff)), []).append(i)
+        return list(groups.items())
+
+    def _cell_buffer(self, cell):
+        buf = self._cells.get(cell)
+        if buf is None:
+            buf = _PositionBuffer(16)
+            self._cells[cell] = buf
+        return buf
 
     def add_deepsky_list(self, deepskylist: Sequence[DeepskyItem]) -> None:
-        n_old = int(self.sizes.shape[0])
-        n_new = n_old + len(deepskylist)
-
-        newpos = np.zeros((n_new, 2), dtype=np.float32)
-        newsize = np.zeros((n_new,), dtype=np.float32)
-
-        newpos[:n_old, :] = self.positions
-        newsize[:n_old] = self.sizes
-
-        for i, item in enumerate(deepskylist):
-            _, x, y, s = item
+        """
+        deepskylist [(dso, x, y, size), ...], x, y, size in mm
+        """
+        n = len(deepskylist)
+        positions = np.empty((n, 2), dtype=np.float32)
+        sizes = np.empty((n,), dtype=np.float32)
+        for i, (_, x, y, s) in enumerate(deepskylist):
             if s <= 0:
                 s = 1.0
-            newsize[n_old + i] = np.float32(math.sqrt(float(s)))
-            newpos[n_old + i, :] = (float(x), float(y))
-
-        self.positions = newpos
-        self.sizes = newsize
+            sizes[i] = np.float32(math.sqrt(float(s)))
+            positions[i, :] = (float(x), float(y))
+        self._add(positions.astype(np.float64), sizes)
 
     def add_position(self, x: float, y: float, size: float) -> None:
-        self.positions = np.append(self.positions, [[float(x), float(y)]], axis=0)
-        self.sizes = np.append(self.sizes, np.float32(math.sqrt(float(size))))
+        self.labels_placed += 1
+        self._add(np.array([[float(x), float(y)]], dtype=np.float64),
+                  np.array([math.sqrt(float(size))], dtype=np.float32))
 
     def compute_potential(self, x: float, y: float, edge_opt: bool = False) -> float:
-        dx = self.positions[:, 0] - float(x)
-        dy = self.positions[:, 1] - float(y)
-        r2 = dx * dx + dy * dy
-
-        sr = (r2 + 0.1) ** (-1)
-        p = self.sizes * sr
+        return float(self.compute_potentials([x], [y], edge_opt)[0])
 
-        value = float(np.sum(p))
+    def compute_potentials(self, xs: ArrayLike, ys: ArrayLike, edge_opt: bool = False) -> NDArray[np.float64]:
+        """
+        Potential in each of points (xs[i], ys[i]), e.g. all candidate positions of one or more labels.
+        """
+        xs = np.asarray(xs, dtype=np.float64).reshape(-1)
+        ys = np.asarray(ys, dtype=np.float64).reshape(-1)
+        if self.cutoff_radius is None:
+            result = self._sum_potentials(xs, ys, self.positions, self.sizes)
+        else:
+            result = self._cutoff_potentials(xs, ys)
 
         if edge_opt:
             ss = float(np.sum(self.sizes))
-            r = math.hypot(float(x), float(y))
-            rf = (r - self.field_radius) ** (-3)
-            value += ss * rf
+            result = result + ss * np.power(np.hypot(xs, ys) - self.field_radius, -3)
+        return result
 
-        return value
+    def _cutoff_potentials(self, xs, ys):
+        """
+        Sum contributions from cells neighbouring the cells of query points. Nearby query points (e.g. candidate
+        positions of one label) share single gather of cells, distant ones are grouped by their cell.
+        """
+        result = np.zeros(len(xs))
+        if not self._cells or len(xs) == 0:
+            return result
+        cutoff = self.cutoff_radius
+        lxs, lys = xs.tolist(), ys.tolist()
+        cx1, cx2 = math.floor(min(lxs) / cutoff), math.floor(max(lxs) / cutoff)
+        cy1, cy2 = math.floor(min(lys) / cutoff), math.floor(max(lys) / cutoff)
+        if (cx2 - cx1 + 3) * (cy2 - cy1 + 3) <= MAX_GATHER_CELLS:
+            groups = [(cx1, cx2, cy1, cy2, None)]
+        else:
+            groups = [(cx, cx, cy, cy, sel) for (cx, cy), sel in self._group_by_cell(xs, ys)]
+
+        cutoff2 = cutoff * cutoff
+        cells = self._cells
+        for cx1, cx2, cy1, cy2, sel in groups:
+            bufs = []
+            for cy in range(cy1 - 1, cy2 + 2):
+                for cx in range(cx1 - 1, cx2 + 2):
+                    buf = cells.get((cx, cy))
+                    if buf is not None:
+                        bufs.append(buf)
+            if not bufs:
+                continue
+            if len(bufs) == 1:
+                positions = bufs[0].positions[:bufs[0].count]
+                sizes = bufs[0].sizes[:bufs[0].count]
+            else:
+                positions = np.concatenate([buf.positions[:buf.count] for buf in bufs])
+                sizes = np.concatenate([buf.sizes[:buf.count] for buf in bufs])
+            if sel is None:
+                result = self._sum_potentials(xs, ys, positions, sizes, cutoff2)
+            else:
+                result[sel] = self._sum_potentials(xs[sel], ys[sel], positions, sizes, cutoff2)
+        return result
+
+    @staticmethod
+    def _sum_potentials(xs, ys, positions, sizes, cutoff2=None):
+        n = len(sizes)
+        if n == 0:
+            return np.zeros(len(xs))
+        chunk = max(1, QUERY_CHUNK_ELEMENTS // n)
+        if len(xs) > chunk:
+            return np.concatenate([LabelPotential._sum_potentials(xs[i:i + chunk], ys[i:i + chunk], positions, sizes, cutoff2)
+                                   for i in range(0, len(xs), chunk)])
+        dx = positions[:, 0] - xs[:, np.newaxis]
+        dy = positions[:, 1] - ys[:, np.newaxis]
+        r2 = dx * dx + dy * dy
+        p = sizes * (r2 + 0.1) ** (-1)
+        if cutoff2 is not None:
+            p[r2 > cutoff2] = 0
+        return np.sum(p, axis=1)
+
+
+def benchmark_label_placement(nr_of_labels, field_radius=100.0, cutoff_radius=None, seed=0):
+    """
+    Place nr_of_labels labels of random objects in field in the way renderers do it (4 candidate positions,
+    least potential wins). Returns elapsed time in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    r = field_radius * np.sqrt(rng.random(nr_of_labels))
+    phi = 2 * np.pi * rng.random(nr_of_labels)
+    xs = (r * np.cos(phi)).tolist()
+    ys = (r * np.sin(phi)).tolist()
+    label_lengths = (5.0 + 10.0 * rng.random(nr_of_labels)).tolist()
+    offsets_x = np.array([1.0, -1.0, 1.0, -1.0])
+    offsets_y = np.array([-1.0, -1.0, 1.0, 1.0])
+
+    label_potential = LabelPotential(field_radius, cutoff_radius)
+    tm = perf_counter()
+    for x, y, label_length in zip(xs, ys, label_lengths):
+        cand_x = x + offsets_x * (1.0 + label_length / 2.0)
+        cand_y = y + offsets_y
+        pots = label_potential.compute_potentials(cand_x, cand_y)
+        best = int(np.argmin(pots))
+        label_potential.add_position(cand_x[best], cand_y[best], label_length)
+    return perf_counter() - tm
+
+
+__all__ = ['DeepskyItem', 'LABEL_POTENTIAL_CUTOFF', 'LabelPotential', 'benchmark_label_placement']
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Label placement benchmark')
+    parser.add_argument('--labels', type=int, nargs='+', default=[1000, 5000, 10000, 20000])
+    parser.add_argument('--field-radius', type=float, default=100.0)
+    parser.add_argument('--cutoff', type=float, default=20.0, help='cutoff radius in mm')
+    args = parser.parse_args()
+
+    for nr_of_labels in args.labels:
+        t_all = benchmark_label_placement(nr_of_labels, args.field_radius)
+        t_cutoff = benchmark_label_placement(nr_of_labels, args.field_radius, args.cutoff)
+        print('{} labels: no cutoff {:.3f} s, cutoff {:.1f} mm {:.3f} s'.format(nr_of_labels, t_all, args.cutoff, t_cutoff))
@@ -15,17 +15,19 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from collections import defaultdict, deque
+import os
+import threading
+from collections import defaultdict, deque, OrderedDict
 from time import time
 from typing import TypeAlias, Sequence
 from numpy.typing import NDArray
 
-from .i18n import install_translator
+from .i18n import _
 
+from .cache_utils import cache_key, save_npz, load_npz
 from .deepsky_object import *
 from .htm.htm import HTM
 
-_ = install_translator()
 
 Vec2: TypeAlias = tuple[float, float]
 RGB: TypeAlias = tuple[float, float, float]
@@ -36,6 +38,22 @@ Edge: TypeAlias = list[int]
 
 RAD2DEG = 180.0/np.pi
 
+VIEW_CACHE_SIZE = 8
+
+MILKYWAY_CACHE_VERSION = 1
+
+
+def polygons_to_arrays(polygons: Sequence[PolygonRGB]) -> tuple[NDArray[np.int32], NDArray[np.int64], NDArray[np.float64]]:
+    """
+    Flatten polygons [(polygon, rgb), ...] to (vertex indices, offsets of polygons, rgb array of shape (n, 3)),
+    vertices of i-th polygon are indices[offsets[i]:offsets[i+1]].
+    """
+    offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(polygon) for polygon, _ in polygons])
+    indices = np.fromiter((i for polygon, _ in polygons for i in polygon), dtype=np.int32, count=offsets[-1])
+    rgb = np.array([rgb for _, rgb in polygons], dtype=np.float64).reshape(-1, 3)
+    return indices, offsets, rgb
+
 
 def import_milky_way(filename):
     milkyway_file = open(filename, 'r')
@@ -67,27 +85,103 @@ class EnhancedMilkyWay:
     polygon_center_blocks: list[list[int] | None]
     opti_polygon_center_blocks: list[list[int] | None]
 
-    mw_points: Optional[NDArray[np.float32]]          # shape (N,2)
-    mw_polygons: list[tuple[list[int], RGB]]          # [(polygon, rgb), ...]
-    mw_opti_polygons: Optional[list[tuple[list[int], RGB]]]
+    mw_points: Optional[NDArray[np.float64]]          # shape (N,2)
 
     def __init__(self, milkyway_filename, optim_max_col_diff=None):
-        self.sky_mesh = HTM(4)
-        self.polygon_center_blocks = [None] * self.sky_mesh.size()
-        self.opti_polygon_center_blocks = [None] * self.sky_mesh.size()
-        self.mw_points = None
-        self.mw_polygons = []
-        self.mw_opti_polygons = None
+        self._init_state()
         tm = time()
         self._add_polygons(milkyway_filename)
+        self._polygon_arrays = polygons_to_arrays(self._mw_polygons)
         tmp = time() - tm
         if optim_max_col_diff is not None and optim_max_col_diff > 0 and optim_max_col_diff < 1.0:
             self._create_opti_polygons(optim_max_col_diff)
+            self._opti_polygon_arrays = polygons_to_arrays(self._mw_opti_polygons)
             print(_("Enhanced milky way initialized within {}s. Optimized polygons={}, total polygons={}".format(tmp, len(self.mw_opti_polygons), len(self.mw_polygons))), flush=True)
 
         else:
             print(_("Enhanced milky way initialized within {}s. Total polygons={}".format(tmp, len(self.mw_polygons))), flush=True)
 
+    def _init_state(self) -> None:
+        self.sky_mesh = HTM(4)
+        self.polygon_center_blocks = [None] * self.sky_mesh.size()
+        self.opti_polygon_center_blocks = [None] * self.sky_mesh.size()
+        self.mw_points = None
+        self._mw_polygons = None
+        self._mw_opti_polygons = None
+        self._polygon_arrays = None
+        self._opti_polygon_arrays = None
+        self._polygon_blocks = None
+        self._opti_polygon_blocks = None
+        self._view_cache = OrderedDict()
+        self._view_cache_lock = threading.Lock()
+
+    @classmethod
+    def from_arrays(cls, data) -> 'EnhancedMilkyWay':
+        """
+        Restore enhanced milky way from arrays created by to_arrays().
+        """
+        emw = cls.__new__(cls)
+        emw._init_state()
+        emw.mw_points = np.array(data['points'])
+        emw._polygon_arrays = (np.array(data['poly_idx']), np.array(data['poly_off']), np.array(data['poly_rgb']))
+        emw._polygon_blocks = np.array(data['poly_block'])
+        emw.polygon_center_blocks = emw._block_lists(emw._polygon_blocks)
+        if 'opti_idx' in data:
+            emw._opti_polygon_arrays = (np.array(data['opti_idx']), np.array(data['opti_off']), np.array(data['opti_rgb']))
+            emw._opti_polygon_blocks = np.array(data['opti_block'])
+            emw.opti_polygon_center_blocks = emw._block_lists(emw._opti_polygon_blocks)
+        return emw
+
+    def to_arrays(self) -> dict[str, NDArray]:
+        """
+        Points, flattened polygons, optimized polygons and HTM blocks of polygon centers as dict of numpy arrays.
+        """
+        arrays = {'points': self.mw_points, 'poly_block': self._polygon_blocks}
+        arrays['poly_idx'], arrays['poly_off'], arrays['poly_rgb'] = self._polygon_arrays
+        if self._opti_polygon_arrays is not None:
+            arrays['opti_block'] = self._opti_polygon_blocks
+            arrays['opti_idx'], arrays['opti_off'], arrays['opti_rgb'] = self._opti_polygon_arrays
+        return arrays
+
+    @property
+    def mw_polygons(self) -> list[tuple[list[int], RGB]]:
+        """
+        [(polygon, rgb), ...]
+        """
+        if self._mw_polygons is None:
+            self._mw_polygons = self._arrays_to_polygons(self._polygon_arrays)
+        return self._mw_polygons
+
+    @property
+    def mw_opti_polygons(self) -> Optional[list[tuple[list[int], RGB]]]:
+        if self._mw_opti_polygons is None and self._opti_polygon_arrays is not None:
+            self._mw_opti_polygons = self._arrays_to_polygons(self._opti_polygon_arrays)
+        return self._mw_opti_polygons
+
+    @staticmethod
+    def _arrays_to_polygons(polygon_arrays) -> list[tuple[list[int], RGB]]:
+        indices, offsets, rgb = polygon_arrays
+        indices = indices.tolist()
+        offsets = offsets.tolist()
+        return [[indices[offsets[i]:offsets[i+1]], tuple(col)] for i, col in enumerate(rgb.tolist())]
+
+    def _center_blocks(self, arr_ra: Sequence[float], arr_dec: Sequence[float]) -> NDArray[np.int32]:
+        """
+        Index of HTM block for each polygon center
+        """
+        mask = 1 << (self.sky_mesh.get_depth() * 2 + 3)
+        indexes = self.sky_mesh.lookup_id(arr_ra, arr_dec)
+        return np.array([index ^ mask for index in indexes], dtype=np.int32)
+
+    def _block_lists(self, blocks: NDArray[np.int32]) -> list[list[int] | None]:
+        center_blocks = [None] * self.sky_mesh.size()
+        for poly_index, index in enumerate(blocks.tolist()):
+            if center_blocks[index] is None:
+                center_blocks[index] = [poly_index]
+            else:
+                center_blocks[index].append(poly_index)
+        return center_blocks
+
     def _radec_from_img(self, point: str) -> tuple[float, float]:
         x, y = point.split(',')
         x, y = int(x), int(y)
@@ -101,8 +195,9 @@ class EnhancedMilkyWay:
         milkyway_file.close()
 
         mw_radec = []
-        arr_ra, arr_dec, poly_index = ([], [], [])
+        arr_ra, arr_dec = ([], [])
         index_map = {}
+        self._mw_polygons = []
 
         cur_index = 0
 
@@ -123,10 +218,6 @@ class EnhancedMilkyWay:
                 if point_index is None:
                     ra, dec = self._radec_from_img(items[i])
                     mw_radec.append((ra, dec,))
-                    if self.mw_points is None:
-                        self.mw_points = np.array([[ra, dec]])
-                    else:
-                        self.mw_points = np.append(self.mw_points, [[ra, dec]], axis=0)
                     index_map[items[i]] = cur_index
                     point_index = cur_index
                     cur_index += 1
@@ -138,7 +229,6 @@ class EnhancedMilkyWay:
 
             arr_ra.append(sum_ra * RAD2DEG / n_points)
             arr_dec.append(sum_dec * RAD2DEG / n_points)
-            poly_index.append(len(self.mw_polygons))
 
             r, g, b = items[-1][4:-1].split(',')
 
@@ -146,24 +236,18 @@ class EnhancedMilkyWay:
             g = int(g) / 255.0
             b = int(b) / 255.0
 
-            self.mw_polygons.append([polygon, (r, g, b)])
+            self._mw_polygons.append([polygon, (r, g, b)])
 
-        mask = 1 << (self.sky_mesh.get_depth() * 2 + 3)
-        indexes = self.sky_mesh.lookup_id(arr_ra, arr_dec)
-        for i in range(len(indexes)):
-            index = indexes[i] ^ mask
-            if self.polygon_center_blocks[index] is None:
-                self.polygon_center_blocks[index] = [poly_index[i]]
-            else:
-                self.polygon_center_blocks[index].append(poly_index[i])
+        self.mw_points = np.array(mw_radec, dtype=np.float64).reshape(-1, 2)
+        self._polygon_blocks = self._center_blocks(arr_ra, arr_dec)
+        self.polygon_center_blocks = self._block_lists(self._polygon_blocks)
 
     def _create_opti_polygons(self, max_col_diff: float) -> None:
-        self.mw_opti_polygons = self._merge_polygons(self.mw_polygons, max_col_diff)
-        self.mw_opti_polygons = self._merge_polygons(self.mw_opti_polygons, max_col_diff)
-        self.mw_opti_polygons = self._merge_polygons(self.mw_opti_polygons, max_col_diff)
-        arr_ra, arr_dec, poly_index = ([], [], [])
-        ind = 0
-        for polygon, _ in self.mw_opti_polygons:
+        opti_polygons = self._merge_polygons(self._mw_polygons, max_col_diff)
+        opti_polygons = self._merge_polygons(opti_polygons, max_col_diff)
+        self._mw_opti_polygons = self._merge_polygons(opti_polygons, max_col_diff)
+        arr_ra, arr_dec = ([], [])
+        for polygon, _ in self._mw_opti_polygons:
             sum_ra = 0.0
             sum_dec = 0.0
             for point_ind in polygon:
@@ -171,17 +255,9 @@ class EnhancedMilkyWay:
                 sum_dec += self.mw_points[point_ind][1]
             arr_ra.append(sum_ra * RAD2DEG / len(polygon))
             arr_dec.append(sum_dec * RAD2DEG / len(polygon))
-            poly_index.append(ind)
-            ind += 1
 
-        mask = 1 << (self.sky_mesh.get_depth() * 2 + 3)
-        indexes = self.sky_mesh.lookup_id(arr_ra, arr_dec)
-        for i in range(len(indexes)):
-            index = indexes[i] ^ mask
-            if self.opti_polygon_center_blocks[index] is None:
-                self.opti_polygon_center_blocks[index] = [poly_index[i]]
-            else:
-                self.opti_polygon_center_blocks[index].append(poly_index[i])
+        self._opti_polygon_blocks = self._center_blocks(arr_ra, arr_dec)
+        self.opti_polygon_center_blocks = self._block_lists(self._opti_polygon_blocks)
 
     def _merge_polygons(self, polygons: list[tuple[list[int], RGB]], max_col_diff: float) -> list[tuple[list[int], RGB]]:
         merges = 0
@@ -359,3 +435,69 @@ class EnhancedMilkyWay:
                 selection.extend(trixel_polygons)
 
         return selection
+
+    def polygon_arrays(self, optimized: bool = False) -> Optional[tuple[NDArray[np.int32], NDArray[np.int64], NDArray[np.float64]]]:
+        """
+        Polygons (or optimized polygons) flattened by polygons_to_arrays(), None if optimized polygons were not created.
+        """
+        return self._opti_polygon_arrays if optimized else self._polygon_arrays
+
+    def get_view_cache(self, key):
+        """
+        Returns value stored by put_view_cache() for key (e.g. polygons projected for a view) or None.
+        """
+        with self._view_cache_lock:
+            value = self._view_cache.get(key)
+            if value is not None:
+                self._view_cache.move_to_end(key)
+            return value
+
+    def put_view_cache(self, key, value) -> None:
+        with self._view_cache_lock:
+            self._view_cache[key] = value
+            if len(self._view_cache) > VIEW_CACHE_SIZE:
+                self._view_cache.popitem(last=False)
+
+
+def _opti_col_diff(optim_max_col_diff):
+    if optim_max_col_diff is not None and 0 < optim_max_col_diff < 1.0:
+        return float(optim_max_col_diff)
+    return None
+
+
+def enhanced_milky_way_cache_file(milkyway_filename, optim_max_col_diff, cache_dir):
+    """
+    Returns (cache file, cache key) of enhanced milky way dataset and optim_max_col_diff.
+    """
+    key = cache_key(MILKYWAY_CACHE_VERSION, [milkyway_filename], _opti_col_diff(optim_max_col_diff))
+    name = os.path.splitext(os.path.basename(milkyway_filename))[0]
+    return os.path.join(cache_dir, '{}-{}.npz'.format(name, key[:16])), key
+
+
+def build_enhanced_milky_way_cache(milkyway_filename, optim_max_col_diff, cache_dir):
+    """
+    Parse enhanced milky way dataset, merge optimized polygons and write them to binary cache.
+    Returns (EnhancedMilkyWay, cache file or None if it was not written).
+    """
+    cache_file, key = enhanced_milky_way_cache_file(milkyway_filename, optim_max_col_diff, cache_dir)
+    enhanced_milky_way = EnhancedMilkyWay(milkyway_filename, _opti_col_diff(optim_max_col_diff))
+    if not save_npz(cache_file, key=np.array(key), **enhanced_milky_way.to_arrays()):
+        cache_file = None
+    return enhanced_milky_way, cache_file
+
+
+def load_enhanced_milky_way(milkyway_filename, optim_max_col_diff=None, cache_dir=None):
+    """
+    Load enhanced milky way from binary cache in cache_dir, the cache is built if it does not exist.
+    Without cache_dir the dataset is parsed.
+    """
+    if not cache_dir:
+        return EnhancedMilkyWay(milkyway_filename, optim_max_col_diff)
+    cache_file, key = enhanced_milky_way_cache_file(milkyway_filename, optim_max_col_diff, cache_dir)
+    data = load_npz(cache_file, key)
+    if data is not None:
+        try:
+            return EnhancedMilkyWay.from_arrays(data)
+        finally:
+            data.close()
+    return build_enhanced_milky_way_cache(milkyway_filename, optim_max_col_diff, cache_dir)[0]
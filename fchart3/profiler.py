@@ -0,0 +1,211 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""
+Instrumentation of SkymapEngine.make_map(). Engine and renderers report nested stages (e.g. render.stars.select)
+and counters (e.g. stars.drawn) to a profiler, NULL_PROFILER ignores them.
+"""
+
+import json
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict
+
+import numpy as np
+
+DEFAULT_MAX_SAMPLES = 10000
+
+
+@dataclass
+class RenderProfile:
+    """
+    Profile of one make_map() call. Stage durations are in seconds, memory deltas (with track_memory) in bytes
+    of Python/NumPy allocations traced by tracemalloc.
+    """
+    info: dict = field(default_factory=dict)
+    total: float = 0.0
+    stages: dict = field(default_factory=dict)
+    counters: dict = field(default_factory=dict)
+    memory: dict = field(default_factory=dict)
+    peak_memory: int = None
+
+    def to_json(self):
+        return json.dumps(asdict(self), default=str)
+
+
+class NullProfiler:
+    """
+    Profiler doing nothing, default of SkymapEngine.
+    """
+    enabled = False
+
+    def begin_render(self, **info):
+        pass
+
+    def end_render(self):
+        return None
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class RenderProfiler(NullProfiler):
+    """
+    Collects RenderProfile of each render and aggregates stage durations and counters across renders.
+    Aggregates keep the last max_samples values of each stage and counter, so long-running processes
+    use bounded memory. One profiler can be shared by engines rendering in several threads, each thread
+    profiles its own render.
+    """
+    enabled = True
+
+    def __init__(self, jsonl=None, track_memory=False, keep_profiles=False, max_samples=DEFAULT_MAX_SAMPLES):
+        """
+        :param jsonl: file name or text file object, profile of each render is appended as one JSON line
+        :param track_memory: record memory delta of stages and peak memory of renders (starts tracemalloc)
+        :param keep_profiles: keep RenderProfile of all renders in profiles
+        :param max_samples: number of last samples of each stage and counter used by summary() and histogram()
+        """
+        self._jsonl = jsonl
+        self.track_memory = track_memory
+        self.keep_profiles = keep_profiles
+        self.max_samples = max_samples
+        self.profiles = []
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _current(self):
+        return getattr(self._local, 'profile', None)
+
+    def begin_render(self, **info):
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._local.mem_start = tracemalloc.get_traced_memory()[0]
+        self._local.profile = RenderProfile(info=info)
+        self._local.stack = []
+        self._local.start = time.perf_counter()
+
+    def end_render(self):
+        profile = self._current()
+        if profile is None:
+            return None
+        profile.total = time.perf_counter() - self._local.start
+        if self.track_memory:
+            profile.peak_memory = tracemalloc.get_traced_memory()[1] - self._local.mem_start
+        self._local.profile = None
+
+        with self._lock:
+            self._add_sample('total', profile.total)
+            for name, duration in profile.stages.items():
+                self._add_sample(name, duration)
+            for name, value in profile.counters.items():
+                self._add_sample(name, value)
+            if self.keep_profiles:
+                self.profiles.append(profile)
+            if self._jsonl is not None:
+                self._write_jsonl(profile)
+        return profile
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure duration of the block, nested stages are named 'parent.name'. Stage entered several times
+        during one render accumulates.
+        """
+        profile = self._current()
+        if profile is None:
+            yield
+            return
+        stack = self._local.stack
+        full_name = stack[-1] + '.' + name if stack else name
+        stack.append(full_name)
+        mem_start = tracemalloc.get_traced_memory()[0] if self.track_memory else 0
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            profile.stages[full_name] = profile.stages.get(full_name, 0.0) + time.perf_counter() - t0
+            if self.track_memory:
+                mem_delta = tracemalloc.get_traced_memory()[0] - mem_start
+                profile.memory[full_name] = profile.memory.get(full_name, 0) + mem_delta
+            stack.pop()
+
+    def count(self, name, value=1):
+        profile = self._current()
+        if profile is not None:
+            profile.counters[name] = profile.counters.get(name, 0) + value
+
+    def _add_sample(self, name, value):
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples[name] = deque(maxlen=self.max_samples)
+        samples.append(value)
+
+    def _write_jsonl(self, profile):
+        if isinstance(self._jsonl, str):
+            with open(self._jsonl, 'a') as f:
+                f.write(profile.to_json() + '\n')
+        else:
+            self._jsonl.write(profile.to_json() + '\n')
+            self._jsonl.flush()
+
+    def names(self):
+        with self._lock:
+            return list(self._samples)
+
+    def samples(self, name):
+        with self._lock:
+            return np.array(self._samples.get(name, []), dtype=np.float64)
+
+    def histogram(self, name, bins=10):
+        """
+        Histogram of stage durations or counter values across renders, returns (counts, bin_edges) of np.histogram.
+        """
+        return np.histogram(self.samples(name), bins=bins)
+
+    def summary(self):
+        """
+        Statistics of all stages and counters across last max_samples renders:
+        {name: {count, mean, p50, p90, p99, max}}.
+        """
+        with self._lock:
+            samples = {name: np.array(values, dtype=np.float64) for name, values in self._samples.items()}
+        result = {}
+        for name, values in samples.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            result[name] = {'count': len(values), 'mean': float(values.mean()), 'p50': float(p50), 'p90': float(p90),
+                            'p99': float(p99), 'max': float(values.max())}
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self.profiles.clear()
+
+
+__all__ = ['DEFAULT_MAX_SAMPLES', 'RenderProfile', 'NullProfiler', 'NULL_PROFILER', 'RenderProfiler']
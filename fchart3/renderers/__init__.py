@@ -18,7 +18,7 @@
 from .base_renderer import BaseRenderer, interp_magnitude_to_radius
 from .arrow_renderer import ArrowRenderer
 from .contellations_renderer import ConstellationsRenderer
-from .deepsky_renderer import DeepskyRenderer
+from .deepsky_renderer import DeepskyRenderer, dso_label_texts
 from .extras_renderer import ExtrasRenderer
 from .grid_renderer import GridRenderer
 from .highlights_renderer import HighlightsRenderer
@@ -26,5 +26,5 @@ from .horizon_renderer import HorizonRenderer
 from .milkyway_renderer import MilkyWayRenderer
 from .nebulae_outlines_renderer import NebulaeOutlinesRenderer
 from .planets_renderer import PlanetsRenderer
-from .stars_renderer import StarsRenderer
+from .stars_renderer import StarsRenderer, bsc_label_texts
 from .trajectory_renderer import TrajectoryRenderer
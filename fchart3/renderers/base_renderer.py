@@ -84,17 +84,12 @@ class BaseRenderer:
         return label_pos_list
 
     def find_min_labelpos(self, state, labelpos_list, label_length, favour_right=False, favour_index=-1):
-        pot = float('inf')
-        result = 0
-
-        for labelpos_index, (pos1, pos2, pos3) in enumerate(labelpos_list):
-            x2, y2 = pos2
-            pot1 = state.label_potential.compute_potential(x2, y2)
-            if favour_index == labelpos_index:
-                pot1 *= 0.6
-            if pot1 < pot:
-                pot = pot1
-                result = labelpos_index
+        xs = [pos2[0] for _, pos2, _ in labelpos_list]
+        ys = [pos2[1] for _, pos2, _ in labelpos_list]
+        pots = state.label_potential.compute_potentials(xs, ys)
+        if 0 <= favour_index < len(pots):
+            pots[favour_index] *= 0.6
+        result = int(np.argmin(pots))
 
         lx, ly = labelpos_list[result][1]
         state.label_potential.add_position(lx, ly, label_length)
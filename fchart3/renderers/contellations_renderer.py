@@ -25,6 +25,9 @@ from .base_renderer import BaseRenderer
 
 class ConstellationsRenderer(BaseRenderer):
     def draw(self, ctx, state):
+        # constellation catalog is loaded on first access
+        if not ctx.cfg.show_constellation_borders and not ctx.cfg.show_constellation_shapes:
+            return
         if ctx.used_catalogs.constell_catalog is not None:
             if ctx.cfg.show_constellation_borders:
                 self.draw_constellations_boundaries(ctx, ctx.used_catalogs.constell_catalog)
@@ -18,12 +18,19 @@
 import numpy as np
 import math
 
-from ..astro.np_astrocalc import np_rect_to_sphere
+from ..astro.np_astrocalc import np_rect_to_sphere, np_sphere_to_rect
 from ..deepsky_object import DsoType
 
 from .base_renderer import BaseRenderer, SQRT2
 
 
+def dso_label_texts(deeplist, limit_mag):
+    """
+    Distinct labels of deepsky objects brighter than limit_mag, e.g. to prewarm text metrics.
+    """
+    return sorted({dso.label() for dso in deeplist if dso.mag <= limit_mag})
+
+
 class DeepskyRenderer(BaseRenderer):
     def draw(self, ctx, state):
         gfx = ctx.gfx
@@ -31,7 +38,12 @@ class DeepskyRenderer(BaseRenderer):
         if not cfg.show_deepsky or ctx.used_catalogs.deepsky_catalog is None:
             return
 
-        deepsky_list = ctx.used_catalogs.deepsky_catalog.select_deepsky(ctx.center_equatorial, ctx.field_size, ctx.lm_deepsky)
+        prof = ctx.profiler
+        deepsky_catalog = ctx.used_catalogs.deepsky_catalog
+        with prof.stage('select'):
+            dso_indexes = deepsky_catalog.select_deepsky_indexes(ctx.center_equatorial, ctx.field_size, ctx.lm_deepsky)
+            dso_indexes = dso_indexes[np.argsort(deepsky_catalog.mag[dso_indexes], kind='stable')]
+            deepsky_list = deepsky_catalog.get_objects(dso_indexes)
         deepsky_list_set = set(deepsky_list)
 
         filtered_showing_dsos = []
@@ -56,11 +68,17 @@ class DeepskyRenderer(BaseRenderer):
                     if dso in dso_hide_filter_set:
                         dso_hide_filter_set.remove(dso)
 
-        deepsky_list.sort(key=lambda x: x.mag)
         deepsky_list_ext = []
 
         all_dsos = deepsky_list + filtered_showing_dsos
-        self.calc_deepsky_list_ext(ctx, deepsky_list_ext, all_dsos)
+        with prof.stage('project'):
+            ra, dec, rlong = (deepsky_catalog.ra[dso_indexes], deepsky_catalog.dec[dso_indexes], deepsky_catalog.rlong[dso_indexes])
+            if filtered_showing_dsos:
+                ext_ra, ext_dec, ext_rlong = self._dso_columns(filtered_showing_dsos)
+                ra, dec, rlong = np.concatenate((ra, ext_ra)), np.concatenate((dec, ext_dec)), np.concatenate((rlong, ext_rlong))
+            self.calc_deepsky_list_ext(ctx, deepsky_list_ext, all_dsos, (ra, dec, rlong))
+        prof.count('dso.selected', len(all_dsos))
+        prof.count('dso.visible', len(deepsky_list_ext))
 
         state.label_potential.add_deepsky_list(deepsky_list_ext)
 
@@ -75,112 +93,122 @@ class DeepskyRenderer(BaseRenderer):
                         state.picked_dso = dso
                         pick_min_r = r
 
-        for dso, x, y, rlong in deepsky_list_ext:
-            if dso in dso_hide_filter_set:
-                continue
+        with prof.stage('draw'):
+            for dso, x, y, rlong in deepsky_list_ext:
+                if dso in dso_hide_filter_set:
+                    continue
+                prof.count('dso.drawn')
 
-            label = dso.label()
-            primary_label = dso.primary_label()
+                label = dso.label()
+                primary_label = dso.primary_label()
 
-            if cfg.show_dso_mag and dso.mag is not None and dso.mag != -100 and dso.mag < 30:
-                label_mag = f'{dso.mag:.1f}'
-            else:
-                label_mag = None
-
-            if ctx.dso_highlights:
-                for dso_highlight in ctx.dso_highlights:
-                    if dso in dso_highlight.dsos:
-                        self.draw_dso_highlight(ctx, state, x, y, rlong, label, dso_highlight, state.visible_objects_collector)
-                        break
-
-            rlong = dso.rlong if dso.rlong is not None else ctx.min_radius
-            rshort = dso.rshort if dso.rshort is not None else ctx.min_radius
-            if rlong == 0:
-                rlong = rshort
-            elif rshort == 0:
-                rshort = rlong
-            rlong = rlong*ctx.drawing_scale
-            rshort = rshort*ctx.drawing_scale
-            posangle = dso.position_angle+ctx.transf.direction_dtheta(dso.ra, dso.dec)+0.5*np.pi
-
-            if rlong <= ctx.min_radius:
-                rshort *= ctx.min_radius/rlong
-                rlong = ctx.min_radius
-
-            label_ext = None
-            if dso == state.picked_dso and dso.mag < 30.0:
-                label_mag = f'{dso.mag:.2f}m'
-
-            label_length = gfx.text_width(label)
-
-            if dso.type == DsoType.G:
-                labelpos_list = self.galaxy_labelpos(ctx, x, y, rlong, rshort, posangle, label_length)
-            elif dso.type == DsoType.N:
-                labelpos_list = self.diffuse_nebula_labelpos(ctx, x, y, 2.0*rlong, 2.0*rshort, posangle, label_length)
-            elif dso.type in [DsoType.PN, DsoType.OC, DsoType.GC, DsoType.SNR, DsoType.GALCL]:
-                labelpos_list = self.circular_object_labelpos(ctx, x, y, rlong, label_length)
-            elif dso.type == DsoType.STARS:
-                labelpos_list = self.asterism_labelpos(ctx, x, y, rlong, label_length)
-            else:
-                labelpos_list = self.unknown_object_labelpos(ctx, x, y, rlong, label_length)
-
-            labelpos = self.find_min_labelpos(state, labelpos_list, label_length)
-
-            if dso.type == DsoType.G:
-                self.galaxy(ctx, x, y, rlong, rshort, posangle, dso.mag, label, label_mag, label_ext, labelpos)
-            elif dso.type == DsoType.N:
-                has_outlines = False
-                if cfg.show_nebula_outlines and dso.outlines is not None and rlong > ctx.min_radius:
-                    has_outlines = self.draw_dso_outlines(ctx, dso, x, y, rlong, rshort, posangle, label, label_ext, labelpos)
-                if not has_outlines:
-                    self.diffuse_nebula(ctx, x, y, 2.0*rlong, 2.0*rshort, posangle, label, label_mag, label_ext, labelpos)
-            elif dso.type == DsoType.PN:
-                self.planetary_nebula(ctx, x, y, rlong, label, label_mag, label_ext, labelpos)
-            elif dso.type == DsoType.OC:
-                if cfg.show_nebula_outlines and dso.outlines is not None:
-                    self.draw_dso_outlines(ctx, dso, x, y, rlong, rshort)
-                self.open_cluster(ctx, x, y, rlong, label, label_mag, label_ext, labelpos)
-            elif dso.type == DsoType.GC:
-                self.globular_cluster(ctx, x, y, rlong, label, label_mag, label_ext, labelpos)
-            elif dso.type == DsoType.STARS:
-                self.asterism(ctx, x, y, rlong, label, label_ext, labelpos)
-            elif dso.type == DsoType.SNR:
-                self.supernova_remnant(ctx, x, y, rlong, label, label_ext, labelpos)
-            elif dso.type == DsoType.GALCL:
-                self.galaxy_cluster(ctx, x, y, rlong, label, label_ext, labelpos)
-            else:
-                self.unknown_object(ctx, x, y, rlong, label, label_ext, labelpos)
+                if cfg.show_dso_mag and dso.mag is not None and dso.mag != -100 and dso.mag < 30:
+                    label_mag = f'{dso.mag:.1f}'
+                else:
+                    label_mag = None
+
+                if ctx.dso_highlights:
+                    for dso_highlight in ctx.dso_highlights:
+                        if dso in dso_highlight.dsos:
+                            self.draw_dso_highlight(ctx, state, x, y, rlong, label, dso_highlight, state.visible_objects_collector)
+                            break
+
+                rlong = dso.rlong if dso.rlong is not None else ctx.min_radius
+                rshort = dso.rshort if dso.rshort is not None else ctx.min_radius
+                if rlong == 0:
+                    rlong = rshort
+                elif rshort == 0:
+                    rshort = rlong
+                rlong = rlong*ctx.drawing_scale
+                rshort = rshort*ctx.drawing_scale
+                posangle = dso.position_angle+ctx.transf.direction_dtheta(dso.ra, dso.dec)+0.5*np.pi
+
+                if rlong <= ctx.min_radius:
+                    rshort *= ctx.min_radius/rlong
+                    rlong = ctx.min_radius
+
+                label_ext = None
+                if dso == state.picked_dso and dso.mag < 30.0:
+                    label_mag = f'{dso.mag:.2f}m'
 
-            if self.collect_visible_object(ctx, state, x, y, rlong, primary_label):
-                if state.picked_dso == dso:
-                    pick_xp1, pick_yp1 = gfx.to_pixel(-pick_r, -pick_r)
-                    pick_xp2, pick_yp2 = gfx.to_pixel(pick_r, pick_r)
-                    pick_xp1, pick_yp1, pick_xp2, pick_yp2 = self.align_rect_coords(pick_xp1, pick_yp1, pick_xp2, pick_yp2)
-                    state.visible_objects_collector.append([rlong, primary_label.replace(' ', ''), pick_xp1, pick_yp1, pick_xp2, pick_yp2])
+                label_length = gfx.text_width(label)
+
+                if dso.type == DsoType.G:
+                    labelpos_list = self.galaxy_labelpos(ctx, x, y, rlong, rshort, posangle, label_length)
+                elif dso.type == DsoType.N:
+                    labelpos_list = self.diffuse_nebula_labelpos(ctx, x, y, 2.0*rlong, 2.0*rshort, posangle, label_length)
+                elif dso.type in [DsoType.PN, DsoType.OC, DsoType.GC, DsoType.SNR, DsoType.GALCL]:
+                    labelpos_list = self.circular_object_labelpos(ctx, x, y, rlong, label_length)
+                elif dso.type == DsoType.STARS:
+                    labelpos_list = self.asterism_labelpos(ctx, x, y, rlong, label_length)
+                else:
+                    labelpos_list = self.unknown_object_labelpos(ctx, x, y, rlong, label_length)
+
+                labelpos = self.find_min_labelpos(state, labelpos_list, label_length)
+
+                if dso.type == DsoType.G:
+                    self.galaxy(ctx, x, y, rlong, rshort, posangle, dso.mag, label, label_mag, label_ext, labelpos)
+                elif dso.type == DsoType.N:
+                    has_outlines = False
+                    if cfg.show_nebula_outlines and dso.outlines is not None and rlong > ctx.min_radius:
+                        has_outlines = self.draw_dso_outlines(ctx, dso, x, y, rlong, rshort, posangle, label, label_ext, labelpos)
+                    if not has_outlines:
+                        self.diffuse_nebula(ctx, x, y, 2.0*rlong, 2.0*rshort, posangle, label, label_mag, label_ext, labelpos)
+                elif dso.type == DsoType.PN:
+                    self.planetary_nebula(ctx, x, y, rlong, label, label_mag, label_ext, labelpos)
+                elif dso.type == DsoType.OC:
+                    if cfg.show_nebula_outlines and dso.outlines is not None:
+                        self.draw_dso_outlines(ctx, dso, x, y, rlong, rshort)
+                    self.open_cluster(ctx, x, y, rlong, label, label_mag, label_ext, labelpos)
+                elif dso.type == DsoType.GC:
+                    self.globular_cluster(ctx, x, y, rlong, label, label_mag, label_ext, labelpos)
+                elif dso.type == DsoType.STARS:
+                    self.asterism(ctx, x, y, rlong, label, label_ext, labelpos)
+                elif dso.type == DsoType.SNR:
+                    self.supernova_remnant(ctx, x, y, rlong, label, label_ext, labelpos)
+                elif dso.type == DsoType.GALCL:
+                    self.galaxy_cluster(ctx, x, y, rlong, label, label_ext, labelpos)
+                else:
+                    self.unknown_object(ctx, x, y, rlong, label, label_ext, labelpos)
+
+                if self.collect_visible_object(ctx, state, x, y, rlong, primary_label):
+                    if state.picked_dso == dso:
+                        pick_xp1, pick_yp1 = gfx.to_pixel(-pick_r, -pick_r)
+                        pick_xp2, pick_yp2 = gfx.to_pixel(pick_r, pick_r)
+                        pick_xp1, pick_yp1, pick_xp2, pick_yp2 = self.align_rect_coords(pick_xp1, pick_yp1, pick_xp2, pick_yp2)
+                        state.visible_objects_collector.append([rlong, primary_label.replace(' ', ''), pick_xp1, pick_yp1, pick_xp2, pick_yp2])
+
+    def _dso_columns(self, dso_list):
+        ra = np.array([dso.ra for dso in dso_list], dtype=np.float64)
+        dec = np.array([dso.dec for dso in dso_list], dtype=np.float64)
+        rlong = np.array([dso.rlong if dso.rlong is not None else np.nan for dso in dso_list], dtype=np.float64)
+        return ra, dec, rlong
+
+    def calc_deepsky_list_ext(self, ctx, deepsky_list_ext, dso_list, columns=None):
+        """
+        Append (dso, x, y, rlong) of visible objects to deepsky_list_ext. columns are (ra, dec, rlong) arrays
+        aligned with dso_list, they are created from dso_list if not provided.
+        """
+        if len(dso_list) == 0:
+            return
+        ra_ar, dec_ar, rlong_ar = columns if columns is not None else self._dso_columns(dso_list)
 
-    def calc_deepsky_list_ext(self, ctx, deepsky_list_ext, dso_list):
         if ctx.precession_matrix is not None:
-            mat_rect_dso = np.empty([len(dso_list), 3])
-            for i, dso in enumerate(dso_list):
-                mat_rect_dso[i] = [dso.x, dso.y, dso.z]
+            mat_rect_dso = np.column_stack(np_sphere_to_rect(ra_ar, dec_ar))
             mat_rect_dso = np.matmul(mat_rect_dso, ctx.precession_matrix)
-            ra_ar, dec_ar = np_rect_to_sphere(mat_rect_dso[:,[0]], mat_rect_dso[:,[1]], mat_rect_dso[:,[2]])
-        else:
-            ra_ar = np.array([dso.ra for dso in dso_list])
-            dec_ar = np.array([dso.dec for dso in dso_list])
+            ra_ar, dec_ar = np_rect_to_sphere(mat_rect_dso[:, 0], mat_rect_dso[:, 1], mat_rect_dso[:, 2])
 
         x, y, z = ctx.transf.np_equatorial_to_xyz(ra_ar, dec_ar)
-        nzopt = not ctx.transf.is_zoptim()
 
-        for i, dso in enumerate(dso_list):
-            if nzopt or z[i] > 0:
-                if dso.rlong is None:
-                    rlong = ctx.min_radius
-                else:
-                    rlong = dso.rlong*ctx.drawing_scale
-                    if rlong < ctx.min_radius:
-                        rlong = ctx.min_radius
-                deepsky_list_ext.append((dso, x[i], y[i], rlong))
+        # rlong None (nan) -> min_radius
+        rlong_ar = np.maximum(np.nan_to_num(rlong_ar * ctx.drawing_scale, nan=ctx.min_radius), ctx.min_radius)
+
+        if ctx.transf.is_zoptim():
+            visible = np.flatnonzero(z > 0)
+            deepsky_list_ext.extend(zip([dso_list[i] for i in visible.tolist()], x[visible].tolist(), y[visible].tolist(),
+                                        rlong_ar[visible].tolist()))
+        else:
+            deepsky_list_ext.extend(zip(dso_list, x.tolist(), y.tolist(), rlong_ar.tolist()))
 
     def draw_dso_outlines(self, ctx, dso, x, y, rlong, rshort, posangle=None, label=None, label_ext=None,  labelpos=None):
         lev_shift = 0
@@ -15,15 +15,10 @@
 #    along with this program; if not, write to the Free Software
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-from time import time
-
 import numpy as np
 
 from .base_renderer import BaseRenderer
 from ..graphics import DrawMode
-from ..i18n import install_translator
-
-_ = install_translator()
 
 
 class MilkyWayRenderer(BaseRenderer):
@@ -63,79 +58,91 @@ class MilkyWayRenderer(BaseRenderer):
 
     def draw_enhanced_milky_way(self, ctx, enhanced_milky_way, use_optimized_mw):
         gfx = ctx.gfx
-        cfg = ctx.cfg
 
         gfx.antialias_off()
 
-        tm = time()
-
-        mw_points = enhanced_milky_way.mw_points
+        fr_x1, fr_y1, fr_x2, fr_y2 = ctx.field_rect_mm
+        view_key = (use_optimized_mw, ctx.transf.view_key(), tuple(ctx.center_equatorial), ctx.field_size,
+                    (fr_x1, fr_y1, fr_x2, fr_y2), tuple(ctx.cfg.enhanced_milky_way_fade))
+        prof = ctx.profiler
+        projected = enhanced_milky_way.get_view_cache(view_key)
+        if projected is None:
+            with prof.stage('project'):
+                projected = self._project_enhanced_milky_way(ctx, enhanced_milky_way, use_optimized_mw)
+            enhanced_milky_way.put_view_cache(view_key, projected)
+        else:
+            prof.count('milkyway.view_cache_hits')
 
-        x, y, z = ctx.transf.np_equatorial_to_xyz(mw_points[:, 0], mw_points[:, 1])
+        x, y, buckets = projected
 
         gfx.set_linewidth(0)
-        fd = cfg.enhanced_milky_way_fade
-
-        if use_optimized_mw:
-            selected_polygons = enhanced_milky_way.select_opti_polygons(ctx.center_equatorial, ctx.field_size)
-        else:
-            selected_polygons = enhanced_milky_way.select_polygons(ctx.center_equatorial, ctx.field_size)
-
-        fr_x1, fr_y1, fr_x2, fr_y2 = ctx.field_rect_mm
 
         total_polygons = 0
-        zopt = ctx.transf.is_zoptim()
-        polygons = []
-        poly_buckets = [[] for _ in range(256)]
-        rgb_buckets = [None for _ in range(256)]
+        with prof.stage('draw'):
+            for rgb, bucket_polygons in buckets:
+                gfx.set_fill_rgb(rgb)
+                gfx.polygons_indexed(x, y, bucket_polygons, DrawMode.FILL)
+                total_polygons += len(bucket_polygons)
+        prof.count('milkyway.polygons', total_polygons)
 
-        for polygon_index in selected_polygons:
+        gfx.antialias_on()
+
+    def _project_enhanced_milky_way(self, ctx, enhanced_milky_way, use_optimized_mw):
+        """
+        Project vertices of polygons selected for the field and group visible polygons into 256 brightness buckets.
+        Returns (x, y, [(rgb, polygons), ...]) where polygons are lists of indexes into x, y.
+        """
+        with ctx.profiler.stage('select'):
             if use_optimized_mw:
-                polygon, rgb = enhanced_milky_way.mw_opti_polygons[polygon_index]
+                selected_polygons = enhanced_milky_way.select_opti_polygons(ctx.center_equatorial, ctx.field_size)
             else:
-                polygon, rgb = enhanced_milky_way.mw_polygons[polygon_index]
-
-            if zopt and np.min(z[polygon]) < 0:
-                continue
+                selected_polygons = enhanced_milky_way.select_polygons(ctx.center_equatorial, ctx.field_size)
+        ctx.profiler.count('milkyway.selected', len(selected_polygons))
 
-            px, py = x[polygon], y[polygon]
-            if (px.max() < fr_x1) or (px.min() > fr_x2) or (py.max() < fr_y1) or (py.min() > fr_y2):
-                continue
+        polygon_arrays = enhanced_milky_way.polygon_arrays(use_optimized_mw)
+        if len(selected_polygons) == 0 or polygon_arrays is None:
+            return np.zeros(0), np.zeros(0), []
 
-            polygons.append(polygon)
-            total_polygons += 1
+        poly_indices, poly_offsets, poly_rgb = polygon_arrays
+        selected = np.asarray(selected_polygons, dtype=np.int64)
 
-            r_f = fd[0] + rgb[0] * fd[1]
-            g_f = fd[2] + rgb[1] * fd[3]
-            b_f = fd[4] + rgb[2] * fd[5]
+        # flatten vertex indexes of selected polygons, polygon i is flat[sel_starts[i]:sel_starts[i]+lengths[i]]
+        starts = poly_offsets[selected]
+        lengths = poly_offsets[selected + 1] - starts
+        sel_starts = np.cumsum(lengths) - lengths
+        flat = np.repeat(starts - sel_starts, lengths) + np.arange(sel_starts[-1] + lengths[-1])
 
-            brightness = max(r_f, g_f, b_f)
-            bucket_index = int(round(brightness * 255))
-
-            if bucket_index < 0:
-                bucket_index = 0
-            elif bucket_index > 255:
-                bucket_index = 255
-
-            poly_buckets[bucket_index].append(polygon)
-            if rgb_buckets[bucket_index] is None:
-                rgb_buckets[bucket_index] = [r_f, g_f, b_f]
-            else:
-                rgb_buckets[bucket_index][0] += r_f
-                rgb_buckets[bucket_index][1] += g_f
-                rgb_buckets[bucket_index][2] += b_f
-
-        for i in range(256):
-            bucket_polygons = poly_buckets[i]
-
-            if not bucket_polygons:
-                continue
-            r = rgb_buckets[i][0] / len(bucket_polygons)
-            g = rgb_buckets[i][1] / len(bucket_polygons)
-            b = rgb_buckets[i][2] / len(bucket_polygons)
-            gfx.set_fill_rgb((r, g, b))
-            gfx.polygons_indexed(x, y, bucket_polygons, DrawMode.FILL)
+        # project each vertex only once, polygons index projected vertices by local index
+        vertices, local = np.unique(poly_indices[flat], return_inverse=True)
+        local = local.reshape(-1)
+        mw_points = enhanced_milky_way.mw_points
+        x, y, z = ctx.transf.np_equatorial_to_xyz(mw_points[vertices, 0], mw_points[vertices, 1])
 
-        gfx.antialias_on()
-        tmp = str(time()-tm)
-        print(_("Enhanced milky way draw within {} s. Total polygons={}".format(tmp, total_polygons)), flush=True)
+        fr_x1, fr_y1, fr_x2, fr_y2 = ctx.field_rect_mm
+        px, py = x[local], y[local]
+        visible = ~((np.maximum.reduceat(px, sel_starts) < fr_x1) | (np.minimum.reduceat(px, sel_starts) > fr_x2) |
+                    (np.maximum.reduceat(py, sel_starts) < fr_y1) | (np.minimum.reduceat(py, sel_starts) > fr_y2))
+        if ctx.transf.is_zoptim():
+            visible &= np.minimum.reduceat(z[local], sel_starts) >= 0
+
+        visible_idx = np.nonzero(visible)[0]
+        fd = ctx.cfg.enhanced_milky_way_fade
+        rgb = poly_rgb[selected[visible_idx]]
+        colors = np.column_stack((fd[0] + rgb[:, 0] * fd[1], fd[2] + rgb[:, 1] * fd[3], fd[4] + rgb[:, 2] * fd[5]))
+        bucket_indexes = np.clip(np.rint(colors.max(axis=1) * 255), 0, 255).astype(np.int64)
+
+        # polygons of bucket keep selection order
+        order = np.argsort(bucket_indexes, kind='stable')
+        bucket_indexes = bucket_indexes[order]
+        bucket_starts = np.flatnonzero(np.r_[True, bucket_indexes[1:] != bucket_indexes[:-1]]) if len(order) > 0 else order
+        bucket_ends = np.r_[bucket_starts[1:], len(order)]
+
+        local_list = local.tolist()
+        buckets = []
+        for b_start, b_end in zip(bucket_starts.tolist(), bucket_ends.tolist()):
+            bucket_order = order[b_start:b_end]
+            bucket_rgb = colors[bucket_order].sum(axis=0) / len(bucket_order)
+            bucket_polygons = [local_list[s:s + n] for s, n in zip(sel_starts[visible_idx[bucket_order]].tolist(),
+                                                               lengths[visible_idx[bucket_order]].tolist())]
+            buckets.append(((bucket_rgb[0].item(), bucket_rgb[1].item(), bucket_rgb[2].item()), bucket_polygons))
+        return x, y, buckets
@@ -20,7 +20,9 @@ from .base_renderer import BaseRenderer
 
 class NebulaeOutlinesRenderer(BaseRenderer):
     def draw(self, ctx, state):
-        if ctx.used_catalogs.unknown_nebulae is not None:
+        # same conditions as outlines of known nebulae drawn by DeepskyRenderer
+        cfg = ctx.cfg
+        if cfg.show_deepsky and cfg.show_nebula_outlines and ctx.used_catalogs.unknown_nebulae is not None:
             self.draw_unknown_nebulae(ctx, ctx.used_catalogs.unknown_nebulae)
 
     def draw_unknown_nebulae(self, ctx, unknown_nebulae):
@@ -17,6 +17,7 @@
 
 import numpy as np
 
+from ..geodesic_star_catalog_gaia import StarSelectionStats
 from ..graphics import DrawMode
 
 from .base_renderer import BaseRenderer
@@ -49,43 +50,70 @@ STAR_LABELS = {
 }
 
 
+def bsc_star_label(bsc_star, cfg):
+    """
+    Label of BSC star measured for label placement (greek letter or Flamsteed designation), empty if not labeled.
+    """
+    if isinstance(bsc_star, str):
+        return bsc_star
+    slabel = bsc_star.greek
+    if slabel:
+        return STAR_LABELS[slabel] + bsc_star.greek_no
+    if cfg.show_flamsteed:
+        slabel = bsc_star.flamsteed
+        if slabel and cfg.flamsteed_numbers_only:
+            slabel = slabel.split()[0]
+    return slabel
+
+
+def bsc_label_texts(bsc_hip_map, cfg):
+    """
+    Distinct labels of BSC stars, e.g. to prewarm text metrics.
+    """
+    return sorted({slabel for slabel in (bsc_star_label(bsc_star, cfg) for bsc_star in bsc_hip_map.values()) if slabel})
+
+
 class StarsRenderer(BaseRenderer):
     def draw(self, ctx, state):
         # Select and draw stars
         # print('Drawing stars...')
 
         if ctx.used_catalogs.star_catalog is not None:
-            self.draw_stars(ctx, state, ctx.used_catalogs.star_catalog, ctx.used_catalogs.bsc_hip_map)
+            # BSC stars are needed only for labels and picking, constellation catalog is loaded on first access
+            needs_bsc = ctx.cfg.show_star_labels or ctx.cfg.picker_radius > 0
+            self.draw_stars(ctx, state, ctx.used_catalogs.star_catalog, ctx.used_catalogs.bsc_hip_map if needs_bsc else None)
 
     def draw_stars(self, ctx, state, star_catalog, bsc_hip_map):
         gfx = ctx.gfx
         cfg = ctx.cfg
 
+        prof = ctx.profiler
+
         pick_r = cfg.picker_radius if cfg.picker_radius > 0 else 0
-        selection = star_catalog.select_stars(ctx.center_equatorial, ctx.field_size, ctx.lm_stars, ctx.precession_matrix)
+        with prof.stage('select'):
+            if prof.enabled:
+                sel_stats = StarSelectionStats()
+                selection = star_catalog.select_stars(ctx.center_equatorial, ctx.field_size, ctx.lm_stars,
+                                                      ctx.precession_matrix, jd=ctx.jd, stats=sel_stats)
+                prof.count('stars.selected', sel_stats.stars)
+                prof.count('stars.zones', sel_stats.inside_zones + sel_stats.border_zones + sel_stats.global_zones)
+                prof.count('stars.zones_loaded', sel_stats.zones_loaded)
+            else:
+                selection = star_catalog.select_stars(ctx.center_equatorial, ctx.field_size, ctx.lm_stars,
+                                                      ctx.precession_matrix, jd=ctx.jd)
         if selection is None or len(selection) == 0:
-            print('No stars found.')
             return
 
-        # print("Stars selection {} ms".format(str(time()-tm)), flush=True)
-        print('{} stars in map.'.format(selection.shape[0]))
-        var = str(round(max(selection['mag']), 2))
-        print(f'Faintest star : {var}')
-
-        # tm = time()
-        points_3d = np.column_stack([selection['x'],
-                                     selection['y'],
-                                     selection['z']])
-        x, y, _ = ctx.transf.np_unit3d_to_xy(points_3d)
+        with prof.stage('project'):
+            points_3d = np.column_stack([selection['x'],
+                                         selection['y'],
+                                         selection['z']])
+            x, y, _ = ctx.transf.np_unit3d_to_xy(points_3d)
 
-        # print("Stars view positioning {} ms".format(str(time()-tm)), flush=True)
-
-        mag = selection['mag']
-        hip = selection['hip']
-
-        indices = np.argsort(mag)
-        magsorted = mag[indices]
-        rsorted = self.magnitude_to_radius(ctx, magsorted)
+            # selection is sorted by magnitude
+            mag = selection['mag']
+            hip = selection['hip']
+            r = self.magnitude_to_radius(ctx, mag)
 
         if not cfg.star_colors:
             # gfx.set_pen_rgb((cfg.draw_color[0]/3, cfg.draw_color[0]/3, cfg.draw_color[0]/3))
@@ -93,40 +121,48 @@ class StarsRenderer(BaseRenderer):
 
         gfx.set_linewidth(0)
 
-        star_labels = []
-        star_mag_defs = []
-        pick_min_r = pick_r**2
-        x1, y1, x2, y2 = ctx.field_rect_mm
-        for i, index in enumerate(indices):
-            xx, yy, rr = (x[index].item(), y[index].item(), rsorted[i].item(),)
-            if (xx < x1-rr) or (xx > x2+rr) or (yy < y1-rr) or (yy > y2+rr):
-                continue
-            star_color = star_catalog.get_star_color(selection[index])
+        with prof.stage('draw'):
+            # cull stars outside of field rect
+            x1, y1, x2, y2 = ctx.field_rect_mm
+            visible = (x >= x1-r) & (x <= x2+r) & (y >= y1-r) & (y <= y2+r)
+            indices = np.nonzero(visible)[0]
+            xs, ys, rs = x[visible], y[visible], r[visible]
+
+            star_colors = star_catalog.get_star_colors(selection[indices]) if cfg.star_colors else None
             if cfg.show_star_circles:
-                self.star(ctx, xx, yy, rr, star_color)
-
-            if pick_r > 0 and abs(xx) < pick_r and abs(yy) < pick_r:
-                r = xx**2 + yy**2
-                if r < pick_min_r:
-                    bsc_star = bsc_hip_map.get(hip[index]) if hip[index] > 0 else None
-                    state.picked_star = (xx, yy, rr, mag[index], bsc_star)
-                    pick_min_r = r
-            elif cfg.show_star_mag:
-                star_mag_defs.append((xx, yy, rr, mag[index], star_color))
+                gfx.circles(xs, ys, np.round(rs, 2), star_colors, DrawMode.FILL)
+                prof.count('stars.drawn', len(indices))
+            prof.count('stars.culled', len(selection) - len(indices))
+
+        with prof.stage('labels'):
+            star_labels = []
+            star_mag_defs = []
+
+            if pick_r > 0:
+                picked = (np.abs(xs) < pick_r) & (np.abs(ys) < pick_r)
+                pick_min_r = pick_r**2
+                for i in np.nonzero(picked)[0].tolist():
+                    xx, yy = xs[i].item(), ys[i].item()
+                    r = xx**2 + yy**2
+                    if r < pick_min_r:
+                        index = indices[i]
+                        bsc_star = bsc_hip_map.get(hip[index]) if hip[index] > 0 else None
+                        state.picked_star = (xx, yy, rs[i].item(), mag[index], bsc_star)
+                        pick_min_r = r
+                not_picked = ~picked
+            else:
+                not_picked = np.ones(len(indices), dtype=bool)
+
+            if cfg.show_star_mag:
+                for i in np.nonzero(not_picked)[0].tolist():
+                    star_color = tuple(star_colors[i].tolist()) if star_colors is not None else None
+                    star_mag_defs.append((xs[i].item(), ys[i].item(), rs[i].item(), mag[indices[i]], star_color))
             elif cfg.show_star_labels:
-                if hip[index] > 0:
-                    bsc_star = bsc_hip_map.get(hip[index])
+                for i in np.nonzero(not_picked & (hip[indices] > 0))[0].tolist():
+                    xx, yy, rr = xs[i].item(), ys[i].item(), rs[i].item()
+                    bsc_star = bsc_hip_map.get(hip[indices[i]])
                     if bsc_star is not None:
-                        if isinstance(bsc_star, str):
-                            slabel = bsc_star
-                        else:
-                            slabel = bsc_star.greek
-                            if slabel:
-                                slabel = STAR_LABELS[slabel] + bsc_star.greek_no
-                            elif cfg.show_flamsteed:
-                                slabel = bsc_star.flamsteed
-                                if slabel and cfg.flamsteed_numbers_only:
-                                    slabel = slabel.split()[0]
+                        slabel = bsc_star_label(bsc_star, cfg)
                         if slabel:
                             label_length = gfx.text_width(slabel)
                             labelpos_list = self.circular_object_labelpos(ctx, xx, yy, rr, label_length)
@@ -135,24 +171,24 @@ class StarsRenderer(BaseRenderer):
 
                             star_labels.append((xx, yy, rr, labelpos, bsc_star))
 
-        if len(star_mag_defs) > 0:
-            gfx.set_font(gfx.gi_font, 0.8*gfx.gi_default_font_size)
-            for x, y, r, mag, star_color in star_mag_defs:
-                diff_mag = ctx.lm_stars - mag
-                if diff_mag < 0:
-                    diff_mag = 0
-                if diff_mag > 5:
-                    diff_mag = 5
-                star_intensity = 0.4 + 0.6 * diff_mag / 5
+            if len(star_mag_defs) > 0:
+                gfx.set_font(gfx.gi_font, 0.8*gfx.gi_default_font_size)
+                for x, y, r, mag, star_color in star_mag_defs:
+                    diff_mag = ctx.lm_stars - mag
+                    if diff_mag < 0:
+                        diff_mag = 0
+                    if diff_mag > 5:
+                        diff_mag = 5
+                    star_intensity = 0.4 + 0.6 * diff_mag / 5
 
-                gfx.set_pen_rgb((cfg.label_color[0] * star_intensity,
-                                           cfg.label_color[1] * star_intensity,
-                                           cfg.label_color[2] * star_intensity))
+                    gfx.set_pen_rgb((cfg.label_color[0] * star_intensity,
+                                               cfg.label_color[1] * star_intensity,
+                                               cfg.label_color[2] * star_intensity))
 
-                self.draw_circular_object_label(ctx, x, y, r, str(mag), set_pen=False)
+                    self.draw_circular_object_label(ctx, x, y, r, str(mag), set_pen=False)
 
-        if len(star_labels) > 0:
-            self.draw_stars_labels(ctx, star_labels)
+            if len(star_labels) > 0:
+                self.draw_stars_labels(ctx, star_labels)
 
     def draw_stars_labels(self, ctx, star_labels):
         gfx = ctx.gfx
@@ -186,12 +222,6 @@ class StarsRenderer(BaseRenderer):
                             gfx.set_font(gfx.gi_font, flamsteed_fh, cfg.flamsteed_label_font_style)
                         self.draw_circular_object_label(ctx, x, y, r, slabel, labelpos)
 
-    def star(self, ctx, x, y, radius, star_color):
-        if ctx.cfg.star_colors and star_color:
-            ctx.gfx.set_fill_rgb(star_color)
-        r = round(radius, 2)
-        ctx.gfx.circle(x, y, r, DrawMode.FILL)
-
     def draw_picked_star(self, ctx, state):
         gfx = ctx.gfx
         if state.picked_star is not None:
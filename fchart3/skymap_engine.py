@@ -23,43 +23,39 @@ from .configuration import *
 from .graphics import *
 from .projections import *
 from .astro.precession import compute_precession_matrix
+from .astro.timescale import get_timescale
 from .viewport_transformer import ViewportTransformer
-from .i18n import install_translator
+from .i18n import N_, TranslatedLabels
+from .profiler import NULL_PROFILER
 
 from .renderers import *
 from .widgets import *
-import time
 
-_ = install_translator()
 
 
-LABELi18N = {
-    'h': _('h'),
-    'm': _('m'),
-    's': _('s'),
-    'G': _('Galaxy'),
-    'OCL': _('Open cluster'),
-    'GCL': _('Globular cluster'),
-    'AST': _('Asterism'),
-    'PN': _('Planetary nebula'),
-    'N': _('Diffuse nebula'),
-    'SNR': _('Supernova remnant'),
-    'PG': _('Part of galaxy')
-}
+LABELi18N = TranslatedLabels({
+    'h': N_('h'),
+    'm': N_('m'),
+    's': N_('s'),
+    'G': N_('Galaxy'),
+    'OCL': N_('Open cluster'),
+    'GCL': N_('Globular cluster'),
+    'AST': N_('Asterism'),
+    'PN': N_('Planetary nebula'),
+    'N': N_('Diffuse nebula'),
+    'SNR': N_('Supernova remnant'),
+    'PG': N_('Part of galaxy')
+})
 
 
 STARS_IN_SCALE = 10
 LEGEND_MARGIN = 0.47
 BASE_SCALE = 0.98
 
-from skyfield.api import load
-
-ts = load.timescale()
-
 
 class SkymapEngine:
     def __init__(self, graphics, language=LABELi18N, lm_stars=13.8, lm_deepsky=12.5, caption='',
-                 description='', created=''):
+                 description='', created='', profiler=None):
         """
         Create a SkymapEngine.
         :param graphics: depends on output (PDF/TikZ/...)
@@ -68,6 +64,7 @@ class SkymapEngine:
         :param caption: Image title (plotted above)
         :param description: small-letter description in lower left: location, time
         :param created: small-letter 'signature' below frame in lower right
+        :param profiler: RenderProfiler receiving stage durations and counters of make_map(), None disables profiling
         """
 
         self.create_renderers()
@@ -102,6 +99,7 @@ class SkymapEngine:
         self.widgets = None
 
         self.norm_field_radius = None
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
 
     def set_field(self, phi, theta, field_radius, field_label=None, mirror_x=False, mirror_y=False):
         self.field_radius = field_radius
@@ -151,6 +149,9 @@ class SkymapEngine:
         y = self.scene_scale * self.drawing_height / 2.0
         return -x, -y, x, y
 
+    def set_profiler(self, profiler):
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+
     def set_language(self, language):
         self.language = language
 
@@ -166,7 +167,7 @@ class SkymapEngine:
         self.created = created
 
     def _setup_observer(self, dt):
-        t = ts.from_datetime(dt)
+        t = get_timescale().from_datetime(dt)
 
         lat = np.deg2rad(self.cfg.observer_lat_deg)
         lon_hours = self.cfg.observer_lon_deg / 15.0
@@ -227,202 +228,219 @@ class SkymapEngine:
         :param landscape: StellariumLandscape info from Stellarium
         """
 
-        def log_timing(block_name, start_time):
-            duration = time.perf_counter() - start_time
-            # print(f"[SkymapEngine] {block_name} took {duration:.3f}s", flush=True)
-
-        if dt is not None and self.cfg.observer_lat_deg is not None and self.cfg.observer_lon_deg is not None:
-            t0 = time.perf_counter()
-            self._setup_observer(dt)
-            log_timing("setup_observer", t0)
-
-        self.gfx.set_background_rgb(self.cfg.background_color)
-
-        self.gfx.new()
-        self.gfx.set_font(font=self.cfg.font, font_size=self.cfg.font_size)
-        self.gfx.set_default_font_size(self.cfg.font_size)
-        self.gfx.set_pen_rgb(self.cfg.draw_color)
-        self.gfx.set_fill_rgb(self.cfg.draw_color)
-        self.gfx.set_linewidth(self.cfg.legend_linewidth)
-
-        self.create_widgets()
-
-        if not transparent:
-            self.gfx.clear()
-
-        ctx = None
-
-        if self.cfg.widget_mode != WidgetMode.WIDGET_ONLY:
-            clip_path = self.space_widget_allocator.get_border_path()
-
-            if self.cfg.widget_mode == WidgetMode.ALLOC_SPACE_ONLY:
-                x1, y1, x2, y2 = self.get_field_rect_mm()
-                self.gfx.clip_path([(x2, y2), (x2, y1), (x1, y1), (x1, y2)])
-            else:
-                self.gfx.clip_path(clip_path)
-
-            if self._is_all_sky_mode():
-                r_mm = self._get_circular_horizon_radius_mm()
-                n = 256
-                pts = []
-                for i in range(n):
-                    a = 2.0 * math.pi * (i / float(256))
-                    pts.append((r_mm * math.cos(a), r_mm * math.sin(a)))
-                self.gfx.clip_path(pts)
-
-            precession_matrix = np.linalg.inv(compute_precession_matrix(jd)) if jd is not None else None
-
-            mirroring_gfx = self.gfx
-            if self.mirror_x or self.mirror_y:
-                mirroring_gfx = MirroringGraphics(self.gfx, self.mirror_x, self.mirror_y)
-
-            self.star_mag_r_shift = 0
-            if self.cfg.star_mag_shift > 0:
-                self.star_mag_r_shift = self.magnitude_to_radius(self.lm_stars - self.cfg.star_mag_shift) - self.magnitude_to_radius(self.lm_stars)
-
-            ctx = RenderContext(
-                gfx=self.gfx,
-                mirroring_gfx=mirroring_gfx,
-                cfg=self.cfg,
-                transf=self.transf,
-                drawing_width=self.drawing_width,
-                drawing_height=self.drawing_height,
-                min_radius=self.min_radius,
-                scene_scale=self.scene_scale,
-                drawing_scale=self.drawing_scale,
-                field_rect_mm=self.get_field_rect_mm(),
-                clip_path=clip_path,
-                center_equatorial=self.center_equatorial,
-                center_celestial=self.center_celestial,
-                field_radius=self.field_radius,
-                field_size=self.field_size,
-                field_radius_mm=self.get_field_radius_mm(),
-                mirror_x=self.mirror_x,
-                mirror_y=self.mirror_y,
-                lm_stars=self.lm_stars,
-                lm_deepsky=self.lm_deepsky,
-                star_mag_r_shift=self.star_mag_r_shift,
-                used_catalogs=used_catalogs,
-                jd=jd,
-                precession_matrix=precession_matrix,
-                showing_dsos=showing_dsos,
-                dso_hide_filter=dso_hide_filter,
-                dso_highlights=dso_highlights,
-                highlights=highlights,
-                hl_constellation=hl_constellation,
-                extra_positions=extra_positions,
-                solsys_bodies=solsys_bodies,
-                planet_moons=planet_moons,
-                trajectories=trajectories,
-                landscape=landscape
-            )
-
-            visible_objects_collector = [] if visible_objects is not None else None
-
-            state = RenderState(
-                label_potential=LabelPotential(self.get_field_radius_mm()),
-                visible_objects_collector=visible_objects_collector,
-                picked_dso=None,
-                picked_star=None,
-                picked_planet_moon=None,
-            )
-
-            t0 = time.perf_counter()
-            self.renderers["milkyway"].draw(ctx, state)
-            log_timing("render.milkyway", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["grid"].draw(ctx, state)
-            log_timing("render.grid", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["highlights"].draw(ctx, state)
-            log_timing("render.highlights", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["constellations"].draw(ctx, state)
-            log_timing("render.constellations", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["nebulae_outlines"].draw(ctx, state)
-            log_timing("render.nebulae_outlines", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["stars"].draw(ctx, state)
-            log_timing("render.stars", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["deepsky"].draw(ctx, state)
-            log_timing("render.deepsky", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["planets"].draw(ctx, state)
-            log_timing("render.planets", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["extras"].draw(ctx, state)
-            log_timing("render.extras", t0)
-
-            if state.picked_dso is None and state.picked_planet_moon is None and state.picked_star is not None:
-                t0 = time.perf_counter()
-                self.renderers["stars"].draw_picked_star(ctx, state)
-                log_timing("render.stars_picked_star", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["trajectory"].draw(ctx, state)
-            log_timing("render.trajectory", t0)
-
-            t0 = time.perf_counter()
-            self.renderers["arrow"].draw(ctx, state)
-            log_timing("render.arrow", t0)
-
-            if self.cfg.coord_system == CoordSystem.HORIZONTAL:
-                t0 = time.perf_counter()
-                self.renderers["horizon"].draw(ctx, state)
-                log_timing("render.horizon", t0)
-
-            self.gfx.reset_clip()
-
-            if self._is_all_sky_mode():
-                r_mm = self._get_circular_horizon_radius_mm()
-                self.gfx.set_linewidth(self.cfg.legend_linewidth)
-                self.gfx.set_pen_rgb(self.cfg.draw_color)
-                self.gfx.set_solid_line()
-
-                n = 256
-                pts = []
-                for i in range(n + 1):
-                    a = 2.0 * math.pi * (i / float(n))
-                    pts.append((r_mm * math.cos(a), r_mm * math.sin(a)))
-                for (x1, y1), (x2, y2) in zip(pts[:-1], pts[1:]):
-                    self.gfx.line(x1, y1, x2, y2)
-
-            if self.cfg.coord_system == CoordSystem.HORIZONTAL:
-                outside = self._is_all_sky_mode()
-                t0 = time.perf_counter()
-                self.renderers["horizon"].draw_cardinals_only(ctx, state, outside=outside)
-                log_timing("render.horizon_cardinals", t0)
-
-            if visible_objects is not None and state.visible_objects_collector is not None:
-                state.visible_objects_collector.sort(key=lambda x: x[0])
-                for obj in state.visible_objects_collector:
-                    visible_objects.extend([obj[1], obj[2], obj[3], obj[4], obj[5]])
-
-        t0 = time.perf_counter()
-        self.draw_caption()
-        log_timing("draw.caption", t0)
-
-        t0 = time.perf_counter()
-        self.draw_widgets(ctx)
-        log_timing("draw.widgets", t0)
-
-        t0 = time.perf_counter()
-        self.draw_field_border()
-        log_timing("draw.field_border", t0)
-
-        t0 = time.perf_counter()
-        self.gfx.finish()
-        log_timing("gfx.finish", t0)
+        prof = self.profiler
+        prof.begin_render(center=self.center_equatorial, field_size=self.field_size, width=self.drawing_width,
+                          height=self.drawing_height, lm_stars=self.lm_stars, lm_deepsky=self.lm_deepsky)
+        try:
+            if dt is not None and self.cfg.observer_lat_deg is not None and self.cfg.observer_lon_deg is not None:
+                with prof.stage("setup_observer"):
+                    self._setup_observer(dt)
+
+            self.gfx.set_background_rgb(self.cfg.background_color)
+
+            self.gfx.new()
+            self.gfx.set_font(font=self.cfg.font, font_size=self.cfg.font_size)
+            self.gfx.set_default_font_size(self.cfg.font_size)
+            self.gfx.set_pen_rgb(self.cfg.draw_color)
+            self.gfx.set_fill_rgb(self.cfg.draw_color)
+            self.gfx.set_linewidth(self.cfg.legend_linewidth)
+
+            self.create_widgets()
+
+            if not transparent:
+                self.gfx.clear()
+
+            ctx = None
+
+            if self.cfg.widget_mode != WidgetMode.WIDGET_ONLY:
+                clip_path = self.space_widget_allocator.get_border_path()
+
+                if self.cfg.widget_mode == WidgetMode.ALLOC_SPACE_ONLY:
+                    x1, y1, x2, y2 = self.get_field_rect_mm()
+                    self.gfx.clip_path([(x2, y2), (x2, y1), (x1, y1), (x1, y2)])
+                else:
+                    self.gfx.clip_path(clip_path)
+
+                if self._is_all_sky_mode():
+                    r_mm = self._get_circular_horizon_radius_mm()
+                    n = 256
+                    pts = []
+                    for i in range(n):
+                        a = 2.0 * math.pi * (i / float(256))
+                        pts.append((r_mm * math.cos(a), r_mm * math.sin(a)))
+                    self.gfx.clip_path(pts)
+
+                precession_matrix = np.linalg.inv(compute_precession_matrix(jd)) if jd is not None else None
+
+                mirroring_gfx = self.gfx
+                if self.mirror_x or self.mirror_y:
+                    mirroring_gfx = MirroringGraphics(self.gfx, self.mirror_x, self.mirror_y)
+
+                self.star_mag_r_shift = 0
+                if self.cfg.star_mag_shift > 0:
+                    self.star_mag_r_shift = self.magnitude_to_radius(self.lm_stars - self.cfg.star_mag_shift) - self.magnitude_to_radius(self.lm_stars)
+
+                ctx = RenderContext(
+                    gfx=self.gfx,
+                    mirroring_gfx=mirroring_gfx,
+                    cfg=self.cfg,
+                    transf=self.transf,
+                    drawing_width=self.drawing_width,
+                    drawing_height=self.drawing_height,
+                    min_radius=self.min_radius,
+                    scene_scale=self.scene_scale,
+                    drawing_scale=self.drawing_scale,
+                    field_rect_mm=self.get_field_rect_mm(),
+                    clip_path=clip_path,
+                    center_equatorial=self.center_equatorial,
+                    center_celestial=self.center_celestial,
+                    field_radius=self.field_radius,
+                    field_size=self.field_size,
+                    field_radius_mm=self.get_field_radius_mm(),
+                    mirror_x=self.mirror_x,
+                    mirror_y=self.mirror_y,
+                    lm_stars=self.lm_stars,
+                    lm_deepsky=self.lm_deepsky,
+                    star_mag_r_shift=self.star_mag_r_shift,
+                    used_catalogs=used_catalogs,
+                    jd=jd,
+                    precession_matrix=precession_matrix,
+                    showing_dsos=showing_dsos,
+                    dso_hide_filter=dso_hide_filter,
+                    dso_highlights=dso_highlights,
+                    highlights=highlights,
+                    hl_constellation=hl_constellation,
+                    extra_positions=extra_positions,
+                    solsys_bodies=solsys_bodies,
+                    planet_moons=planet_moons,
+                    trajectories=trajectories,
+                    landscape=landscape,
+                    profiler=prof,
+                )
+
+                visible_objects_collector = [] if visible_objects is not None else None
+
+                state = RenderState(
+                    label_potential=LabelPotential(self.get_field_radius_mm(), self.get_field_radius_mm() * LABEL_POTENTIAL_CUTOFF),
+                    visible_objects_collector=visible_objects_collector,
+                    picked_dso=None,
+                    picked_star=None,
+                    picked_planet_moon=None,
+                )
+
+                with prof.stage("render.milkyway"):
+                    self.renderers["milkyway"].draw(ctx, state)
+
+                with prof.stage("render.grid"):
+                    self.renderers["grid"].draw(ctx, state)
+
+                with prof.stage("render.highlights"):
+                    self.renderers["highlights"].draw(ctx, state)
+
+                with prof.stage("render.constellations"):
+                    self.renderers["constellations"].draw(ctx, state)
+
+                with prof.stage("render.nebulae_outlines"):
+                    self.renderers["nebulae_outlines"].draw(ctx, state)
+
+                with prof.stage("render.stars"):
+                    self.renderers["stars"].draw(ctx, state)
+
+                with prof.stage("render.deepsky"):
+                    self.renderers["deepsky"].draw(ctx, state)
+
+                with prof.stage("render.planets"):
+                    self.renderers["planets"].draw(ctx, state)
+
+                with prof.stage("render.extras"):
+                    self.renderers["extras"].draw(ctx, state)
+
+                if state.picked_dso is None and state.picked_planet_moon is None and state.picked_star is not None:
+                    with prof.stage("render.stars_picked_star"):
+                        self.renderers["stars"].draw_picked_star(ctx, state)
+
+                with prof.stage("render.trajectory"):
+                    self.renderers["trajectory"].draw(ctx, state)
+
+                with prof.stage("render.arrow"):
+                    self.renderers["arrow"].draw(ctx, state)
+
+                if self.cfg.coord_system == CoordSystem.HORIZONTAL:
+                    with prof.stage("render.horizon"):
+                        self.renderers["horizon"].draw(ctx, state)
+
+                self.gfx.reset_clip()
+
+                if self._is_all_sky_mode():
+                    r_mm = self._get_circular_horizon_radius_mm()
+                    self.gfx.set_linewidth(self.cfg.legend_linewidth)
+                    self.gfx.set_pen_rgb(self.cfg.draw_color)
+                    self.gfx.set_solid_line()
+
+                    n = 256
+                    pts = []
+                    for i in range(n + 1):
+                        a = 2.0 * math.pi * (i / float(n))
+                        pts.append((r_mm * math.cos(a), r_mm * math.sin(a)))
+                    for (x1, y1), (x2, y2) in zip(pts[:-1], pts[1:]):
+                        self.gfx.line(x1, y1, x2, y2)
+
+                if self.cfg.coord_system == CoordSystem.HORIZONTAL:
+                    outside = self._is_all_sky_mode()
+                    with prof.stage("render.horizon_cardinals"):
+                        self.renderers["horizon"].draw_cardinals_only(ctx, state, outside=outside)
+
+                prof.count("labels.placed", state.label_potential.labels_placed)
+
+                if visible_objects is not None and state.visible_objects_collector is not None:
+                    state.visible_objects_collector.sort(key=lambda x: x[0])
+                    for obj in state.visible_objects_collector:
+                        visible_objects.extend([obj[1], obj[2], obj[3], obj[4], obj[5]])
+
+            with prof.stage("draw.caption"):
+                self.draw_caption()
+
+            with prof.stage("draw.widgets"):
+                self.draw_widgets(ctx)
+
+            with prof.stage("draw.field_border"):
+                self.draw_field_border()
+
+            with prof.stage("gfx.finish"):
+                self.gfx.finish()
+        finally:
+            prof.end_render()
+
+    def render_to_bytes(self, used_catalogs, **kwargs):
+        """
+        Draw map by make_map() into in-memory graphics (created with fobj=None), returns (bytes, mime type).
+
+        :param used_catalogs:
+        :param kwargs: arguments of make_map()
+        """
+        self.make_map(used_catalogs, **kwargs)
+        return self.gfx.to_bytes(), self.gfx.mime_type()
+
+    def prewarm_text_metrics(self, used_catalogs, graphics):
+        """
+        Measure labels of deepsky objects (up to lm_deepsky) and BSC stars in label fonts of the configuration.
+        Widths are stored in text metrics cache shared by graphics of the same kind, graphics must be initialized
+        by new() (e.g. in-memory graphics of the back-end and format of rendered charts).
+        """
+        cfg = self.cfg
+        # label fonts and fonts left current by previous renderers when labels are measured (e.g. grid labels)
+        fonts = list(dict.fromkeys([
+            (cfg.font, cfg.font_size, FontStyle.NORMAL),
+            (cfg.font, cfg.grid_font_scale * cfg.font_size, FontStyle.NORMAL),
+            (cfg.font, cfg.font_size, cfg.dso_label_font_style),
+            (cfg.font, cfg.outlined_dso_label_font_scale * cfg.font_size, cfg.dso_label_font_style),
+            (cfg.font, cfg.bayer_label_font_scale * cfg.font_size, cfg.bayer_label_font_style),
+            (cfg.font, cfg.flamsteed_label_font_scale * cfg.font_size, cfg.flamsteed_label_font_style),
+        ]))
+        texts = dso_label_texts(used_catalogs.deeplist, self.lm_deepsky)
+        if cfg.show_star_labels:
+            texts += bsc_label_texts(used_catalogs.bsc_hip_map, cfg)
+        graphics.prewarm_text_metrics(texts, fonts)
 
     def magnitude_to_radius(self, magnitude):
         return interp_magnitude_to_radius(self.lm_stars, self.star_mag_r_shift, magnitude)
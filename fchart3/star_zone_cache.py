@@ -0,0 +1,195 @@
+#    fchart3 draws beautiful deepsky charts in vector formats
+#    Copyright (C) 2005-2026 fchart3 authors
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 2 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program; if not, write to the Free Software
+#    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import heapq
+from collections import OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from itertools import count
+
+
+class ZoneCachePolicy(Enum):
+    LRU = 'lru'
+    LFU = 'lfu'
+
+
+@dataclass(slots=True)
+class ZoneCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    pinned_entries: int = 0
+    size_bytes: int = 0
+    max_bytes: int = None
+
+
+def _stars_nbytes(stars):
+    return getattr(stars, 'nbytes', 0)
+
+
+class StarZoneCache:
+    """
+    Cache of converted zone stars with optional byte budget. Pinned zones are never evicted
+    and do not count against the budget. Not thread safe, caller must serialize access.
+    """
+    def __init__(self, max_bytes=None, policy=ZoneCachePolicy.LRU):
+        """
+        :param max_bytes: budget of unpinned zones in bytes, None means unlimited
+        :param policy: eviction policy, ZoneCachePolicy.LRU or ZoneCachePolicy.LFU
+        """
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._pinned = {}
+        self._pinned_zones = set()
+        self._entries = OrderedDict()
+        self._use_counts = {}
+        # LFU: heap of (use count, insertion sequence, zone), entries not matching _use_counts/_insert_seqs are stale
+        self._lfu_heap = []
+        self._insert_seqs = {}
+        self._seq = count()
+        self._size_bytes = 0
+        self._pinned_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_policy(self, max_bytes=None, policy=ZoneCachePolicy.LRU):
+        self._max_bytes = max_bytes
+        self._policy = policy
+        self._rebuild_lfu_heap()
+        self._evict()
+
+    def pin(self, zone):
+        """
+        Mark zone as pinned. If zone is already cached, it is moved among pinned zones.
+        """
+        self._pinned_zones.add(zone)
+        stars = self._entries.pop(zone, None)
+        if stars is not None:
+            self._use_counts.pop(zone, None)
+            self._insert_seqs.pop(zone, None)
+            self._size_bytes -= _stars_nbytes(stars)
+            self._pinned[zone] = stars
+            self._pinned_bytes += _stars_nbytes(stars)
+
+    def get(self, zone):
+        stars = self._pinned.get(zone)
+        if stars is not None:
+            self.hits += 1
+            return stars
+        stars = self._entries.get(zone)
+        if stars is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self._policy == ZoneCachePolicy.LRU:
+            self._entries.move_to_end(zone)
+        else:
+            self._use_counts[zone] += 1
+            self._push_lfu(zone)
+        return stars
+
+    def put(self, zone, stars):
+        nbytes = _stars_nbytes(stars)
+        if zone in self._pinned_zones:
+            old_stars = self._pinned.get(zone)
+            self._pinned_bytes += nbytes - (_stars_nbytes(old_stars) if old_stars is not None else 0)
+            self._pinned[zone] = stars
+            return
+        old_stars = self._entries.pop(zone, None)
+        if old_stars is not None:
+            self._size_bytes -= _stars_nbytes(old_stars)
+        self._entries[zone] = stars
+        self._use_counts[zone] = self._use_counts.get(zone, 0) + 1
+        self._insert_seqs[zone] = next(self._seq)
+        if self._policy == ZoneCachePolicy.LFU:
+            self._push_lfu(zone)
+        self._size_bytes += nbytes
+        self._evict(keep_zone=zone)
+
+    def _push_lfu(self, zone):
+        heapq.heappush(self._lfu_heap, (self._use_counts[zone], self._insert_seqs[zone], zone))
+        # drop stale heap items once they outnumber live entries
+        if len(self._lfu_heap) > 2 * len(self._entries) + 64:
+            self._rebuild_lfu_heap()
+
+    def _rebuild_lfu_heap(self):
+        if self._policy == ZoneCachePolicy.LFU:
+            # age is order of entries, LRU policy reorders them on access
+            for z in self._entries:
+                self._insert_seqs[z] = next(self._seq)
+            self._lfu_heap = [(self._use_counts[z], self._insert_seqs[z], z) for z in self._entries]
+            heapq.heapify(self._lfu_heap)
+        else:
+            self._lfu_heap = []
+
+    def _pop_lfu(self, keep_zone):
+        """
+        Least used zone except keep_zone, ties broken by age. Returns None if there is no such zone.
+        """
+        heap = self._lfu_heap
+        kept = None
+        zone = None
+        while heap:
+            use_count, seq, z = heap[0]
+            if self._use_counts.get(z) != use_count or self._insert_seqs.get(z) != seq:
+                heapq.heappop(heap)
+            elif z == keep_zone:
+                kept = heapq.heappop(heap)
+            else:
+                zone = z
+                heapq.heappop(heap)
+                break
+        if kept is not None:
+            heapq.heappush(heap, kept)
+        return zone
+
+    def _evict(self, keep_zone=None):
+        if self._max_bytes is None:
+            return
+        while self._size_bytes > self._max_bytes:
+            # zone just inserted is never evicted, even if it alone exceeds the budget
+            if self._policy == ZoneCachePolicy.LRU:
+                zone = next(iter(self._entries), None)
+            else:
+                zone = self._pop_lfu(keep_zone)
+            if zone is None or zone == keep_zone:
+                break
+            stars = self._entries.pop(zone)
+            del self._use_counts[zone]
+            del self._insert_seqs[zone]
+            self._size_bytes -= _stars_nbytes(stars)
+            self.evictions += 1
+
+    def clear(self, include_pinned=False):
+        self._entries.clear()
+        self._use_counts.clear()
+        self._insert_seqs.clear()
+        self._lfu_heap = []
+        self._size_bytes = 0
+        if include_pinned:
+            self._pinned.clear()
+            self._pinned_bytes = 0
+
+    def stats(self):
+        return ZoneCacheStats(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                              entries=len(self._entries) + len(self._pinned), pinned_entries=len(self._pinned),
+                              size_bytes=self._size_bytes + self._pinned_bytes, max_bytes=self._max_bytes)
+
+
+__all__ = ['ZoneCachePolicy', 'ZoneCacheStats', 'StarZoneCache']
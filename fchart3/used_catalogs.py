@@ -16,106 +16,206 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 import os
+import threading
 
-from .i18n import install_translator
+from .i18n import _
 
-_ = install_translator()
 
 import numpy as np
 
 from .astro.astrocalc import sphere_to_rect
+from .cache_utils import get_cache_dir, cache_key, save_npz, load_npz
+from .deepsky_cache import DEEPSKY_CACHE_VERSION, deepsky_to_arrays, deepsky_from_arrays
 from .constellation import ConstellationCatalog
 from .geodesic_star_catalog_gaia import GeodesicStarGaiaCatalog
 from .deepsky_catalog import DeepskyCatalog
 from .hnsky_deepsky import import_hnsky_deepsky, import_hnsky_supplement
 from .pgc_deepsky import import_pgc_deepsky
 from .outlines_deepsky import import_outlines_catgen
-from .milkyway import import_milky_way, EnhancedMilkyWay
+from .milkyway import import_milky_way, load_enhanced_milky_way
 from .vic import import_vic
 from .deepsky_object import DsoType, UnknownNebula, cmp_name, cmp_to_key
 
 
+CATALOG_NAMES = ('constellations', 'stars', 'deepsky', 'milky_way', 'enhanced_milky_way_10k', 'enhanced_milky_way_30k')
+
+
 class UsedCatalogs:
+    """
+    Catalogs used by SkymapEngine. Each catalog is loaded on first access (thread safe), preload() loads catalogs
+    needed by given configuration in advance.
+    """
     def __init__(self, data_dir, extra_star_data_dir, supplements=None, limit_magnitude_deepsky=10.0, force_messier=False,
                  force_asterisms=False, force_unknown=False, show_catalogs=None, use_pgc_catalog=False,
-                 enhanced_mw_optim_max_col_diff=None, stellarium_skyculture_json=None):
-        # Read basic catalogs
-        constell_filename = stellarium_skyculture_json if stellarium_skyculture_json else (data_dir+os.sep+'constellationship_western.fab')
-        self._constell_catalog = ConstellationCatalog(data_dir+os.sep+'bsc5.dat',
-                                               constell_filename,
-                                               data_dir+os.sep+'constbndJ2000.dat',
-                                               data_dir+os.sep+'cross-id.dat')
-        self._star_catalog = GeodesicStarGaiaCatalog(data_dir, extra_star_data_dir)
-        self._deeplist, self._unknown_nebulae = self._get_deepsky_list(data_dir, show_catalogs, use_pgc_catalog, supplements)
+                 enhanced_mw_optim_max_col_diff=None, stellarium_skyculture_json=None, cache_dir=None, use_cache=True,
+                 mmap_star_catalog=False):
+        """
+        :param cache_dir: directory for binary catalog caches (default: get_cache_dir())
+        :param use_cache: False disables reading and writing of binary catalog caches
+        :param mmap_star_catalog: memory map star catalog, star zones are shared by all processes/threads
+        """
+        self._cache_dir = (cache_dir or get_cache_dir()) if use_cache else None
+        self._data_dir = data_dir
+        self._extra_star_data_dir = extra_star_data_dir
+        self._supplements = supplements
+        self._limit_magnitude_deepsky = limit_magnitude_deepsky
+        self._force_messier = force_messier
+        self._force_asterisms = force_asterisms
+        self._force_unknown = force_unknown
+        self._show_catalogs = show_catalogs
+        self._use_pgc_catalog = use_pgc_catalog
+        self._enhanced_mw_optim_max_col_diff = enhanced_mw_optim_max_col_diff
+        self._stellarium_skyculture_json = stellarium_skyculture_json
+        self._mmap_star_catalog = mmap_star_catalog
+        self._catalogs = {}
+        self._load_locks = {name: threading.Lock() for name in CATALOG_NAMES}
+
+    def _get_catalog(self, name, loader):
+        catalog = self._catalogs.get(name)
+        if catalog is None:
+            with self._load_locks[name]:
+                catalog = self._catalogs.get(name)
+                if catalog is None:
+                    catalog = loader()
+                    self._catalogs[name] = catalog
+        return catalog
+
+    def is_loaded(self, name):
+        """
+        True if catalog name (one of CATALOG_NAMES) is already loaded
+        """
+        return name in self._catalogs
+
+    def preload(self, cfg):
+        """
+        Load catalogs drawn with configuration cfg (EngineConfiguration), e.g. before serving requests or forking
+        workers. Other catalogs are still loaded on first access.
+        """
+        self._get_stars()
+        if cfg.show_constellation_borders or cfg.show_constellation_shapes or cfg.show_star_labels or cfg.picker_radius > 0:
+            self._get_constellations()
+        if cfg.show_deepsky:
+            self._get_deepsky()
+        if cfg.show_simple_milky_way:
+            self._get_milky_way()
+        elif cfg.show_enhanced_milky_way_10k:
+            self._get_enhanced_milky_way('10k')
+        elif cfg.show_enhanced_milky_way_30k:
+            self._get_enhanced_milky_way('30k')
+
+    def free_mem(self):
+        if self.is_loaded('stars'):
+            self._get_stars().free_mem()
+
+    def reopen_data_files(self):
+        if self.is_loaded('stars'):
+            self._get_stars().reopen_data_files()
+
+    def _get_constellations(self):
+        return self._get_catalog('constellations', self._load_constellations)
+
+    def _get_stars(self):
+        return self._get_catalog('stars', self._load_stars)
+
+    def _get_deepsky(self):
+        return self._get_catalog('deepsky', self._load_deepsky)
+
+    def _get_milky_way(self):
+        return self._get_catalog('milky_way', lambda: import_milky_way(os.path.join(self._data_dir, 'milkyway.dat')))
+
+    def _get_enhanced_milky_way(self, dataset):
+        return self._get_catalog('enhanced_milky_way_' + dataset, lambda: self._load_enhanced_milky_way(dataset))
+
+    def _load_constellations(self):
+        data_dir = self._data_dir
+        constell_filename = self._stellarium_skyculture_json if self._stellarium_skyculture_json else (data_dir+os.sep+'constellationship_western.fab')
+        return ConstellationCatalog(data_dir+os.sep+'bsc5.dat',
+                                    constell_filename,
+                                    data_dir+os.sep+'constbndJ2000.dat',
+                                    data_dir+os.sep+'cross-id.dat')
+
+    def _load_stars(self):
+        return GeodesicStarGaiaCatalog(self._data_dir, self._extra_star_data_dir, use_mmap=self._mmap_star_catalog,
+                                       cache_dir=self._cache_dir)
+
+    def _load_deepsky(self):
+        """
+        Returns dict with deeplist, unknown nebulae, reduced deeplist, Messier list and deepsky catalog
+        """
+        deeplist, unknown_nebulae = self._get_deepsky_list(self._data_dir, self._show_catalogs, self._use_pgc_catalog,
+                                                           self._supplements)
         # Apply magnitude selection to deepsky list, build Messier list
-        self._reduced_deeplist = []
-        self._messierlist=[]
-        for dso in self._deeplist:
+        reduced_deeplist = []
+        messierlist = []
+        for dso in deeplist:
             dso.x, dso.y, dso.z = sphere_to_rect(dso.ra, dso.dec)
             if dso.messier > 0:
-                self._messierlist.append(dso)
-            if force_messier and dso.messier > 0:
-                self._reduced_deeplist.append(dso)
-            elif dso.mag <= limit_magnitude_deepsky and \
+                messierlist.append(dso)
+            if self._force_messier and dso.messier > 0:
+                reduced_deeplist.append(dso)
+            elif dso.mag <= self._limit_magnitude_deepsky and \
                     dso.master_object is None and \
                     dso.type != DsoType.GALCL and \
-                    (dso.type != DsoType.STARS or force_asterisms or (dso.messier > 0 and dso.type == DsoType.STARS)) and \
-                    (dso.type != DsoType.PG or force_unknown or dso.type == DsoType.PG and dso.mag > -5.0):
-                self._reduced_deeplist.append(dso)
-
-        self._messierlist.sort(key=lambda x: x.messier)
-        self._deepsky_catalog = DeepskyCatalog(self._reduced_deeplist, force_messier)
-        self._milky_way = import_milky_way(os.path.join(data_dir, 'milkyway.dat'))
-        self._enhanced_milky_way_10k = EnhancedMilkyWay(os.path.join(data_dir, 'milkyway_enhanced_10k.dat'), enhanced_mw_optim_max_col_diff)
-        self._enhanced_milky_way_30k = EnhancedMilkyWay(os.path.join(data_dir, 'milkyway_enhanced_30k.dat'), enhanced_mw_optim_max_col_diff)
-        self._bsc_hip_map = self._constell_catalog.bsc_hip_map
-
-    def free_mem(self):
-        self._star_catalog.free_mem()
+                    (dso.type != DsoType.STARS or self._force_asterisms or (dso.messier > 0 and dso.type == DsoType.STARS)) and \
+                    (dso.type != DsoType.PG or self._force_unknown or dso.type == DsoType.PG and dso.mag > -5.0):
+                reduced_deeplist.append(dso)
+
+        messierlist.sort(key=lambda x: x.messier)
+        return {
+            'deeplist': deeplist,
+            'unknown_nebulae': unknown_nebulae,
+            'reduced_deeplist': reduced_deeplist,
+            'messierlist': messierlist,
+            'deepsky_catalog': DeepskyCatalog(reduced_deeplist, self._force_messier),
+        }
+
+    def _load_enhanced_milky_way(self, dataset):
+        milkyway_filename = os.path.join(self._data_dir, 'milkyway_enhanced_{}.dat'.format(dataset))
+        return load_enhanced_milky_way(milkyway_filename, self._enhanced_mw_optim_max_col_diff, self._cache_dir)
 
     @property
     def messierlist(self):
-        return self._messierlist
+        return self._get_deepsky()['messierlist']
 
     @property
     def star_catalog(self):
-        return self._star_catalog
+        return self._get_stars()
 
     @property
     def constell_catalog(self):
-        return self._constell_catalog
+        return self._get_constellations()
 
     @property
     def deepsky_catalog(self):
-        return self._deepsky_catalog
+        return self._get_deepsky()['deepsky_catalog']
 
     @property
     def deeplist(self):
-        return self._deeplist
+        return self._get_deepsky()['deeplist']
 
     @property
     def reduced_deeplist(self):
-        return self._reduced_deeplist
+        return self._get_deepsky()['reduced_deeplist']
 
     @property
     def unknown_nebulae(self):
-        return self._unknown_nebulae
+        return self._get_deepsky()['unknown_nebulae']
 
     @property
     def milky_way(self):
-        return self._milky_way
+        return self._get_milky_way()
 
     @property
     def enhanced_milky_way_10k(self):
-        return self._enhanced_milky_way_10k
+        return self._get_enhanced_milky_way('10k')
 
     @property
     def enhanced_milky_way_30k(self):
-        return self._enhanced_milky_way_30k
+        return self._get_enhanced_milky_way('30k')
 
     @property
     def bsc_hip_map(self):
-        return self._bsc_hip_map
+        return self._get_constellations().bsc_hip_map
 
     def lookup_dso(self, dso_name):
         index = 0
@@ -206,6 +306,31 @@ class UsedCatalogs:
         return (np.array(arr_x), np.array(arr_y))
 
     def _get_deepsky_list(self, data_dir, show_catalogs, use_pgc_catalog, supplements):
+        if not self._cache_dir:
+            return self._import_deepsky_list(data_dir, show_catalogs, use_pgc_catalog, supplements)
+
+        source_files = [os.path.join(data_dir, 'deep_sky.hnd'), os.path.join(data_dir, 'vic.txt'),
+                        os.path.join(data_dir, 'outlines_catgen.dat')]
+        if use_pgc_catalog:
+            source_files += [os.path.join(data_dir, 'PGC.dat'), os.path.join(data_dir, 'PGC_update.dat')]
+        if supplements:
+            source_files += supplements
+
+        key = cache_key(DEEPSKY_CACHE_VERSION, source_files, sorted(show_catalogs) if show_catalogs else None, use_pgc_catalog)
+        cache_file = os.path.join(self._cache_dir, 'deepsky-{}.npz'.format(key[:16]))
+        data = load_npz(cache_file, key)
+        if data is not None:
+            print(_('Reading deepsky cache...'), flush=True)
+            try:
+                return deepsky_from_arrays(data)
+            finally:
+                data.close()
+
+        deeplist, unknown_nebulae = self._import_deepsky_list(data_dir, show_catalogs, use_pgc_catalog, supplements)
+        save_npz(cache_file, key=np.array(key), **deepsky_to_arrays(deeplist, unknown_nebulae))
+        return deeplist, unknown_nebulae
+
+    def _import_deepsky_list(self, data_dir, show_catalogs, use_pgc_catalog, supplements):
         all_dsos = {}
         print( _('Reading Hnsky...'), flush=True)
         hnskylist = import_hnsky_deepsky(os.path.join(data_dir, 'deep_sky.hnd'), show_catalogs, all_dsos)
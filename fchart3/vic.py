@@ -16,7 +16,7 @@
 #    Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
 from .deepsky_object import *
-from numpy import *
+import numpy as np
 import csv
 
 
@@ -42,9 +42,9 @@ def import_vic(filename):
             object.add_name(object.name)
             object.type = DsoType.STARS
             rhs,rms,rss = row['RA'].split(',')
-            object.ra = pi * (float(rhs) + float(rms)/60.0) / 12.0
+            object.ra = np.pi * (float(rhs) + float(rms)/60.0) / 12.0
             dds, dms, dss = row['Dec'].split(',')
-            object.dec = pi*(float(dds) + float(dms)/60.0) / 180.0
+            object.dec = np.pi*(float(dds) + float(dms)/60.0) / 180.0
             object.mag = _vic2int(row['mag']) / 10
             deeplist.append(object)
     return deeplist
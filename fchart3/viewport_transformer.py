@@ -83,6 +83,14 @@ class ViewportTransformer:
     def is_zoptim(self):
         return self.projection.is_zoptim()
 
+    def view_key(self):
+        """
+        Hashable key of parameters determining the transformation, e.g. to cache projected coordinates.
+        """
+        projection = self.projection
+        return (type(projection).__name__, projection.field_center, projection.scale_x, projection.scale_y,
+                self.obs_lst, self.obs_lat)
+
     def equatorial_to_xy(self, phi, theta):
         """
         Convert equatorial coordinates to 2D Cartesian coordinates (x, y) for the current projection.